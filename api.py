@@ -12,31 +12,73 @@ from flask import jsonify #translates a dictionary into JSON
                           #(http://flask.pocoo.org/docs/api/)
 from flask import (
     json, #parses JSON
-    request
+    request,
+    g
 )
 
 from models import (
-    BuildQueue,
+    create_build_queue,
     Build,
-    WorkerThread,
+    BuildLog,
+    Dispatcher,
+    blame_counts,
+    ensure_blame_indexes,
+    ensure_indexes,
+    new_build,
+    expand_push,
+    explain_query,
+    stage_percentiles,
+    metrics,
+    events,
+    Subscription,
+    format_event,
     connection
 )
 
-from datetime import datetime
+from werkzeug.urls import url_encode
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from mongokit import ObjectId
+import threading
+import calendar
+import hashlib
+import time
 
 api = Flask(__name__)
 
 
-api.worker = None
-api.queue = BuildQueue()
-
 if __name__ == '__main__':
     api.config.from_object('config')
-    api.run()
 else:
     api.config.from_object('rosie.config')
 
+#BUILD_QUEUE selects the in memory or the durable MongoDB build queue
+api.queue = create_build_queue(api.config, connection)
+
+ensure_indexes(connection)
+ensure_blame_indexes(connection, api.config)
+
+#the pool of WorkerThreads lives as long as the application does
+api.dispatcher = Dispatcher(api.queue, api.config, connection)
+api.dispatcher.start()
+
+metrics.gauge('rosie_workers', "WorkerThreads that are building a build or idle.",
+              lambda: [(dict(state=state), count) for state, count in
+                       sorted(api.dispatcher.worker_states().items())])
+
+@api.before_request
+def start_timer():
+    g.request_started = time.time()
+
+@api.after_request
+def count_request(response):
+    #counts every request by route, so /metrics can show their rate and latency
+    endpoint = request.endpoint or 'unknown'
+    metrics.requests.inc(endpoint=endpoint, method=request.method,
+                         status=response.status_code)
+    metrics.request_latency.observe(time.time() - g.request_started, endpoint=endpoint)
+    return response
+
 
 Build = connection.Build
 ###GitHub Webhook###
@@ -55,59 +97,379 @@ def build():
     if not payload:
         return jsonify(success=False)
 
-    build = connection.Build(payload)
-    build['status'] = 0
-    build['error'] = ''
-    build['build_time'] = datetime.utcnow()
-    build.save()
+    #a push of several commits makes a build for each commit PUSH_BUILDS
+    #selects, all saved with a single insert
+    payloads = expand_push(payload, api.config.get('PUSH_BUILDS', 'head'),
+                           api.config.get('PUSH_BUILDS_EVERY', 1))
+    builds = [new_build(payload, connection) for payload in payloads]
+    connection.Build.collection.insert(builds, safe=True)
 
-    #stores the build_id in the build queue
-    api.queue.add_build(build)
+    #stores the build_ids in the build queue, where idle WorkerThreads
+    #of the dispatcher will pick them up
+    for build in builds:
+        metrics.build_queued(build)
+        events.publish('queued', build['_id'], status=0)
+    api.queue.add_builds(builds)
 
-    if (api.worker is None or api.worker.current_build is None):
-        api.worker = WorkerThread(api.queue, api.config, connection)
-        api.worker.start()
-        api.worker.join()
+    #the last build is the head of the push
+    build = builds[-1]
+    if api.config.get('COALESCE_CANCEL_RUNNING', False):
+        api.dispatcher.cancel_superseded(build)
 
-    return jsonify(success=True, id=str(build['_id']))
+    if len(builds) == 1:
+        return jsonify(success=True, id=str(build['_id']))
+    return jsonify(success=True, id=str(build['_id']),
+                   ids=[str(build['_id']) for build in builds])
 
 ###HTML Endpoints###
 
+@api.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    #Prometheus scrapes this; everything comes from memory, never MongoDB
+    return api.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @api.route('/ping', methods=['GET'])
 def ping():
     #checks whether the worker is processing a build or free
-    if api.worker is None or not api.worker.is_building():
-        return jsonify(dict(building=False))
-    else:
-        return jsonify(dict(building=True, build=api.worker.current_build))
+    return jsonify(api.dispatcher.status())
     #returns jsonify(status of server)
 
 @api.route('/builds/<build_id>', methods=['GET'])
 def get_build(build_id):
     #looks up the build by its id in the database
     #the variable build_id is passed in the url
+    #
+    #the response has an ETag, and a conditional GET of a
+    #build that did not change gets 304 without the build being serialized;
+    #for a finished build this process served before, without it being read
+    try:
+        build_id = ObjectId(build_id)
+    except Exception:
+        return jsonify(error="Invalid Build ID")
+
+    known = _finished_builds.lookup(build_id)
+    if known is not None and _not_modified(known):
+        return _conditional(api.response_class(status=304), known, True)
 
     try:
-        build = Build.get_from_id(ObjectId(build_id))
+        build = _find_build(build_id)
     except Exception:
         return jsonify(error="Invalid Build ID")
 
     if build is None:
         return jsonify(error="Invalid Build ID")
 
+    etag = _etag(_build_version(build))
+    final = _is_final(build)
+    if final:
+        _finished_builds.remember(build_id, etag)
+    if _not_modified(etag):
+        return _conditional(api.response_class(status=304), etag, final)
+
     #looks at the status of the build
     #returns jsonify(status of build)
-    return (build.to_json(), 200)
+    return _conditional(api.make_response((build.to_json(), 200)), etag, final)
+
+@api.route('/builds/<build_id>/log', methods=['GET'])
+def get_build_log(build_id):
+    #returns the output of a build from the byte offset given in the url,
+    #along with the offset to ask for next, so that the command line
+    #interface can tail a build while it is running
+    try:
+        build_id = ObjectId(build_id)
+    except Exception:
+        return jsonify(error="Invalid Build ID")
+
+    try:
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify(error="Invalid offset")
+
+    #the status is read before the log: once a build is finished its
+    #whole log has been stored
+    build = Build.collection.find_one({'_id': build_id}, fields=['status'])
+    if build is None:
+        return jsonify(error="Invalid Build ID")
+
+    data, offset = BuildLog.read(build_id, offset, configs=api.config)
+    return jsonify(data=data.decode('utf-8', 'replace'), offset=offset,
+                   complete=build['status'] != 0)
+
+@api.route('/builds/<build_id>/events', methods=['GET'])
+def get_build_events(build_id):
+    #streams what happens to the build as server-sent events, see
+    #_event_stream; the stream ends once the build is finished
+    try:
+        build_id = str(ObjectId(build_id))
+    except Exception:
+        return jsonify(error="Invalid Build ID")
+    return _event_stream(build_id)
+
+@api.route('/events', methods=['GET'])
+def get_events():
+    #streams what happens to every build as server-sent events
+    return _event_stream(None)
+
+def _event_stream(build_id):
+    #the events are handed over in memory by the WorkerThreads (see
+    #models/events.py), so watchers never read the database. A stream lasts
+    #at most EVENTS_STREAM_TIMEOUT seconds, since it holds a thread of the
+    #server; the client reconnects with the Last-Event-ID header to carry on
+    #where it left off (the ingest server has no such limit)
+    try:
+        after = int(request.headers.get('Last-Event-ID', None) or -1)
+    except ValueError:
+        after = -1
+    deadline = time.time() + api.config.get('EVENTS_STREAM_TIMEOUT', 30)
+    heartbeat = api.config.get('EVENTS_HEARTBEAT', 15)
+
+    def stream():
+        #subscribes once the body is read, so a response that never is, such
+        #as the answer to a HEAD request, leaves no subscriber behind
+        subscription = events.subscribe(
+            Subscription(build_id, api.config.get('EVENTS_SUBSCRIBER_BUFFER', 1000)),
+            after if after >= 0 else None)
+        try:
+            yield 'retry: 1000\n\n'
+            while time.time() < deadline:
+                batch = subscription.get(max(0, min(heartbeat, deadline - time.time())))
+                if not batch:
+                    yield ': keep-alive\n\n'
+                for event in batch:
+                    yield format_event(event)
+                    if build_id is not None and event['type'] == 'finished':
+                        return
+        finally:
+            events.unsubscribe(subscription)
+
+    return api.response_class(stream(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache'})
+
+@api.route('/builds/<build_id>/timings', methods=['GET'])
+def get_build_timings(build_id):
+    #returns how many seconds the build spent in every stage, from being
+    #queued to GitHub being told about it (see models/timings.py)
+    try:
+        build_id = ObjectId(build_id)
+    except Exception:
+        return jsonify(error="Invalid Build ID")
+
+    build = Build.collection.find_one({'_id': build_id}, fields=['timings', 'queued_at'])
+    if build is None:
+        return jsonify(error="Invalid Build ID")
+
+    queued_at = build.get('queued_at', None)
+    return jsonify(id=str(build_id), timings=build.get('timings', None) or dict(),
+                   queued_at=queued_at.isoformat() if queued_at else None)
+
+@api.route('/builds/timings', methods=['GET'])
+def get_timing_percentiles():
+    #returns the 50th, 95th and 99th percentile of every stage over the
+    #finished builds of the last ?days= days (default 7) and of one ?repository=
+    try:
+        since = datetime.utcnow() - timedelta(days=int(request.args.get('days', 7)))
+    except ValueError:
+        return jsonify(error="Invalid query")
+
+    return jsonify(stage_percentiles(since, request.args.get('repository', None),
+                                     connection, api.config))
 
 @api.route('/builds', methods=['GET'])
 def get_builds():
-    #gets all builds in DB using .find() method
-    builds = []
-    for build in Build.find():
-        builds.append(build.to_json())
+    #returns one page of builds, newest first, as a JSON list that is
+    #streamed out while the cursor is being read.
+    #
+    #query string:
+    #   repository, ref, status, author    filters
+    #   order       '_id' (default) or 'build_time'
+    #   before      cursor of the page, taken from the Link header
+    #   limit       page size (BUILDS_PAGE_SIZE, at most BUILDS_MAX_PAGE_SIZE)
+    #   fields      comma separated fields to return, or 'all'; by default
+    #               everything but the message and error
+    try:
+        spec = _builds_filter(request.args)
+        order = request.args.get('order', '_id')
+        sort = _BUILDS_ORDERS[order]
+        before = request.args.get('before', None)
+        if before:
+            spec.update(_builds_after_cursor(order, before))
+        limit = min(int(request.args.get('limit', api.config.get('BUILDS_PAGE_SIZE', 100))),
+                    api.config.get('BUILDS_MAX_PAGE_SIZE', 1000))
+        if limit < 1:
+            raise ValueError(limit)
+    except Exception:
+        return jsonify(error="Invalid query")
+
+    fields = _builds_fields(request.args)
+
+    headers = dict()
+    #the last build of this page and the first of the next one, found with
+    #a query on the sort keys alone so the link can be sent before the page
+    edge = Build.collection.find(spec, fields=list(set(['_id', order])))
+    edge = explain_query('builds page edge', edge.sort(sort).skip(limit - 1).limit(2),
+                         api.config)
+    edge = list(edge)
+    if len(edge) == 2:
+        args = request.args.to_dict()
+        args['before'] = _builds_cursor(order, edge[0])
+        headers['Link'] = '<%s?%s>; rel="next"' % (request.base_url, url_encode(args))
+
+    #the ETag is that of the page itself, so it is read and serialized
+    #before anything is sent, but a page that did not change is not sent
+    cursor = explain_query('builds page', Build.find(spec, fields).sort(sort).limit(limit),
+                           api.config)
+    page = [json.dumps(build.to_json()) for build in cursor]
+    etag = _etag(headers.get('Link', ''), *page)
+    if _not_modified(etag):
+        return _conditional(api.response_class(status=304, headers=headers), etag, False)
+
+    def stream():
+        yield '['
+        for i, build in enumerate(page):
+            yield (',' if i else '') + build
+        yield ']'
+
+    return _conditional(api.response_class(stream(), mimetype='application/json',
+                                           headers=headers), etag, False)
+
+@api.route('/builds/batch', methods=['GET'])
+def get_builds_batch():
+    #returns the builds whose comma separated ids are given in ?ids=, in the
+    #same order and with null for unknown ids, so that the status of many
+    #builds can be refreshed with one request. ?fields= works as for /builds.
+    try:
+        ids = [ObjectId(id) for id in request.args.get('ids', '').split(',') if id]
+    except Exception:
+        return jsonify(error="Invalid Build ID")
+
+    if len(ids) > api.config.get('BUILDS_MAX_PAGE_SIZE', 1000):
+        return jsonify(error="Too many Build IDs")
+
+    builds = Build.get_many(ids, _builds_fields(request.args))
+
+    return json.dumps([build and build.to_json() for build in builds]), 200
+
+#the fields that can change after a build is created: two reads of a build
+#that agree on them return the same document, so they make its ETag
+_VERSION_FIELDS = ['_id', 'status', 'build_time', 'queued_at', 'timings']
+
+def _build_version(build):
+    timings = sorted((build.get('timings', None) or dict()).items())
+    return repr([build.get(field, None) for field in _VERSION_FIELDS[:-1]] + [timings])
+
+def _etag(*versions):
+    return hashlib.sha1('\n'.join(versions).encode('utf-8')).hexdigest()
+
+def _is_final(build):
+    #finished, and with the timings the WorkerThread stores last
+    return build.get('status', 0) != 0 and \
+        'save' in (build.get('timings', None) or dict())
 
-    #returns data for all builds
-    return json.dumps(builds), 200
+def _not_modified(etag):
+    #whether the If-None-Match of the request matches; there is no
+    #Last-Modified, since no field of a build is stamped on every write
+    return request.if_none_match.contains(etag)
+
+def _conditional(response, etag, final):
+    #finished builds only change when they are rebuilt, so they may be
+    #cached for BUILD_CACHE_MAX_AGE seconds; anything else is revalidated
+    response.headers['ETag'] = '"%s"' % etag
+    if final:
+        response.headers['Cache-Control'] = 'public, max-age=%d' % \
+            api.config.get('BUILD_CACHE_MAX_AGE', 24 * 3600)
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+class _FinishedBuilds(object):
+    #the ETags of the last BUILD_ETAG_CACHE finished builds
+    #served by this process, so a conditional GET of one needs no read. As a
+    #subscriber of the events of every build, it forgets a build once it is
+    #queued again
+    build_id = None
+
+    def __init__(self, size):
+        self.size = size
+        self.builds = OrderedDict()
+        self.lock = threading.Lock()
+        if size:
+            events.subscribe(self)
+
+    def lookup(self, build_id):
+        with self.lock:
+            return self.builds.get(str(build_id), None)
+
+    def remember(self, build_id, etag):
+        if not self.size:
+            return
+        with self.lock:
+            self.builds.pop(str(build_id), None)
+            self.builds[str(build_id)] = etag
+            while len(self.builds) > self.size:
+                self.builds.popitem(last=False)
+
+    def put(self, event):
+        if event['type'] != 'finished':
+            with self.lock:
+                self.builds.pop(event['id'], None)
+
+_finished_builds = _FinishedBuilds(api.config.get('BUILD_ETAG_CACHE', 10000))
+
+_BUILDS_ORDERS = {
+    '_id': [('_id', -1)],
+    'build_time': [('build_time', -1), ('_id', -1)]
+}
+
+def _builds_fields(args):
+    #the projection asked for with ?fields=
+    fields = args.get('fields', None)
+    if fields is None:
+        return dict(message=0, error=0)
+    elif fields == 'all':
+        return None
+    return fields.split(',')
+
+def _find_build(build_id):
+    #the build with Build.id build_id, None if there is none; a query rather
+    #than Build.get_from_id, so QUERY_EXPLAIN can audit it
+    for build in explain_query('build by id', Build.find({'_id': build_id}).limit(1),
+                               api.config):
+        return build
+    return None
+
+def _builds_filter(args):
+    #builds the query for the filters of /builds
+    spec = dict()
+    if 'repository' in args:
+        spec['repository.name'] = args['repository']
+    if 'ref' in args:
+        spec['ref'] = args['ref']
+    if 'status' in args:
+        spec['status'] = int(args['status'])
+    if 'author' in args:
+        spec['author.name'] = args['author']
+    return spec
+
+def _builds_cursor(order, build):
+    #the 'before' value for the page that follows build
+    if order == '_id':
+        return str(build['_id'])
+    build_time = build['build_time']
+    millis = calendar.timegm(build_time.utctimetuple()) * 1000 + \
+        build_time.microsecond // 1000
+    return '%d_%s' % (millis, build['_id'])
+
+def _builds_after_cursor(order, cursor):
+    #the query selecting the builds that follow a 'before' value
+    if order == '_id':
+        return {'_id': {'$lt': ObjectId(cursor)}}
+
+    millis, id = cursor.split('_')
+    build_time = datetime.utcfromtimestamp(int(millis) / 1000.0)
+    return {'$or': [
+        {'build_time': {'$lt': build_time}},
+        {'build_time': build_time, '_id': {'$lt': ObjectId(id)}}
+    ]}
 
 @api.route('/check_settings', methods=['GET'])
 def get_settings():
@@ -118,13 +480,17 @@ def get_settings():
 
 @api.route('/blame', methods=['GET'])
 def blame():
-    bad_people = dict()
-    for build in Build.find():
-        if build.status == 2:
-            if bad_people.get(build.author.name, None) is None:
-                bad_people[build.author.name] = 1
-            else:
-                bad_people[build.author.name] += 1
+    #counts the failed builds of every author, optionally only those of the
+    #last ?days= days and of one ?repository=
+    since = None
+    try:
+        if 'days' in request.args:
+            since = datetime.utcnow() - timedelta(days=int(request.args['days']))
+    except ValueError:
+        return jsonify(error="Invalid query")
+
+    bad_people = blame_counts(since, request.args.get('repository', None),
+                              connection, api.config)
 
     return jsonify(bad_people)
 
@@ -134,18 +500,28 @@ def rebuild():
     id = request.form.get('build_id', None)
 
     try:
-        build = Build.get_from_id(ObjectId(id))
+        build = _find_build(ObjectId(id))
     except Exception:
         return jsonify(error="Invalid Build ID")
 
     if build is None:
         return jsonify(error="Invalid Build ID")
     #looks up a build by that ID
-    #rebuilds build to see if it fails new tests
-    api.queue.add_build(build)
-
-    if (api.worker is None or api.worker.current_build is None):
-        api.worker = WorkerThread(api.queue, api.config, connection)
-        api.worker.start()
+    #rebuilds build to see if it fails new tests, so it is forced: the result
+    #cache, which holds the result of this very build, is bypassed and gets
+    #the new result. It is processing again, which lets a WorkerThread store
+    #its new result. Only a finished build is queued again: one that is still
+    #queued or being built would otherwise be built twice at once
+    requeued = {'status': 0, 'error': u'', 'queued_at': datetime.utcnow(), 'force': True}
+    result = Build.collection.update({'_id': build['_id'], 'status': {'$ne': 0}},
+                                     {'$set': requeued}, safe=True)
+    if not (result and result.get('n', 0)):
+        return jsonify(error="Build is already queued", id=id)
+    metrics.build_queued(build)
+    events.publish('queued', build['_id'], status=0)
+    api.queue.add_build(build, trigger='rebuild')
 
     return jsonify(success=True, id=id)
+
+if __name__ == '__main__':
+    api.run()
@@ -0,0 +1,3 @@
+"""
+Benchmarks for Rosie; see bench.py.
+"""
@@ -0,0 +1,310 @@
+"""
+Microbenchmarks for the parts of Rosie every build goes through, to have a
+baseline to compare commits against:
+
+    queue.<kind>        BuildQueue.add_build/next_build throughput, with
+                        producer and consumer threads contending for the
+                        memory, coalescing, priority, fair and mongo queues
+    build.construct     creating a Build from a webhook payload
+    build.to_json       serializing it
+    build.save          saving it to MongoDB
+    build.save_result   storing the result of a build with save_result
+    worker.loop         WorkerThread.run overhead per build, with a no-op
+                        build and in-memory stand-ins for the database
+    api.builds          GET /builds latency with 1k, 10k and 100k builds
+    api.blame           GET /blame latency, likewise
+
+Usage, from the directory above the rosie package:
+
+    python -m rosie.benchmarks.bench --output results.json
+    python -m rosie.benchmarks.bench --only queue,worker --no-mongo
+    python -m rosie.benchmarks.bench --compare before.json after.json
+
+The results are a JSON document with the commit they were taken at and one
+record per benchmark:
+
+    {'name': 'api.builds', 'params': {'documents': 10000}, 'iterations': 50,
+     'total_seconds': ..., 'mean': ..., 'p50': ..., 'p95': ..., 'ops_per_second': ...}
+
+Like the tests, the benchmarks that touch MongoDB (build.save*, queue.mongo
+and api.*) need a local mongod they may write to; the builds they add are
+removed again. --no-mongo skips them.
+"""
+
+from timeit import default_timer as timer
+import subprocess
+import argparse
+import platform
+import threading
+import random
+import json
+import sys
+import os
+from datetime import datetime, timedelta
+
+from mock import patch
+
+from rosie.models import (
+    create_build_queue,
+    BuildQueue,
+    WorkerThread,
+    connection,
+    save_result
+)
+
+Build = connection.Build
+
+SIZES = [1000, 10000, 100000]
+
+AUTHORS = [u'dunvi', u'jessepollak', u'brennenbyrne', u'linnea', u'cs181f']
+REPOSITORIES = [u'rosie', u'monorepo', u'website', u'cli', u'docs']
+
+def payload(index):
+    """ PUBLIC: the webhook payload of a made up build """
+    repository = REPOSITORIES[index % len(REPOSITORIES)]
+    return {
+        'repository': {
+            'url': u'https://github.com/cs181f/%s' % repository,
+            'name': repository,
+            'description': u'a lightweight CLI server',
+            'owner': {'name': u'cs181f', 'email': u'cs181f@example.com'}
+        },
+        'url': u'https://github.com/cs181f/%s/commit/%040x' % (repository, index),
+        'author': {'name': AUTHORS[index % len(AUTHORS)], 'email': u'author@example.com'},
+        'message': u'commit number %d' % index,
+        'timestamp': u'2012-12-15T20:05:07-08:00',
+        'ref': u'refs/heads/branch-%d' % index
+    }
+
+def record(name, params, times):
+    """ PUBLIC: the result of a benchmark that timed every operation """
+    times = sorted(times)
+    total = sum(times)
+    return dict(name=name, params=params, iterations=len(times), total_seconds=total,
+                mean=total / len(times), p50=times[len(times) // 2],
+                p95=times[min(len(times) - 1, int(len(times) * 0.95))],
+                ops_per_second=len(times) / total if total else None)
+
+def throughput(name, params, operations, seconds):
+    """ PUBLIC: the result of a benchmark that only timed all operations """
+    return dict(name=name, params=params, iterations=operations, total_seconds=seconds,
+                mean=seconds / operations, p50=None, p95=None,
+                ops_per_second=operations / seconds if seconds else None)
+
+def timed(function, iterations):
+    """ PUBLIC: how long each of iterations calls of function took """
+    times = []
+    for i in range(iterations):
+        started = timer()
+        function(i)
+        times.append(timer() - started)
+    return times
+
+
+def bench_queue(kind, producers=4, consumers=4, builds=20000):
+    """ add_build/next_build throughput with threads on both ends """
+    queue = create_build_queue(dict(BUILD_QUEUE=kind, BUILD_QUEUE_LEASE=600,
+                                    BUILD_QUEUE_COLLECTION='benchmark_build_queue',
+                                    BUILD_QUEUE_POLL_INTERVAL=0.01), connection)
+    if kind == 'mongo':
+        builds = builds // 10
+    per_producer = builds // producers
+    total = per_producer * producers
+    consumed = []
+    lock = threading.Lock()
+
+    def produce(offset):
+        for i in range(per_producer):
+            index = offset + i
+            queue.add_build(dict(_id=index, ref=u'refs/heads/%d' % index,
+                                 repository=dict(url=REPOSITORIES[index % len(REPOSITORIES)])))
+
+    def consume():
+        while True:
+            with lock:
+                if len(consumed) >= total:
+                    return
+            try:
+                build_id = queue.next_build(True, 0.1)
+            except Exception:
+                continue
+            queue.complete_build(build_id)
+            with lock:
+                consumed.append(build_id)
+
+    threads = [threading.Thread(target=produce, args=(p * per_producer,))
+               for p in range(producers)]
+    threads += [threading.Thread(target=consume) for c in range(consumers)]
+    started = timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = timer() - started
+
+    if kind == 'mongo':
+        queue.collection.drop()
+    return [throughput('queue.%s' % kind, dict(producers=producers, consumers=consumers),
+                       total, seconds)]
+
+def bench_build(iterations=10000, mongo=True):
+    """ Build construction, to_json and save """
+    payloads = [payload(i) for i in range(iterations)]
+    builds = []
+    results = [record('build.construct', dict(),
+                      timed(lambda i: builds.append(Build(payloads[i])), iterations))]
+    results.append(record('build.to_json', dict(),
+                          timed(lambda i: builds[i].to_json(), iterations)))
+    if mongo:
+        for build in builds:
+            build['benchmark'] = True
+        results.append(record('build.save', dict(),
+                              timed(lambda i: builds[i].save(), iterations // 10)))
+        for build in builds[:iterations // 10]:
+            build['status'] = 1
+        results.append(record('build.save_result', dict(),
+                              timed(lambda i: save_result(builds[i], expected=None),
+                                    iterations // 10)))
+        Build.collection.remove({'benchmark': True})
+    return results
+
+def bench_worker(builds=5000, prefetch=(1, 10)):
+    """ WorkerThread.run overhead per build, building nothing and storing
+    nothing: without the compare-and-set of each result, its records are not
+    comparable with worker.loop records that have no save_result param """
+    documents = dict((i, Build(payload(i))) for i in range(builds))
+    for i, build in documents.items():
+        build['_id'] = i
+
+    results = []
+    for count in prefetch:
+        queue = BuildQueue()
+        for i in range(builds):
+            queue.add_build(i)
+        worker = WorkerThread(queue, dict(WORKER_PREFETCH=count, RESULT_CACHE=False))
+        with patch.object(WorkerThread, '_prefetch', lambda self, ids:
+                          [(id, documents[id]) for id in ids]):
+            with patch.object(WorkerThread, '_bash_build', lambda self, build: True):
+                with patch.object(WorkerThread, '_save_timings', lambda self, build, **s: None):
+                    with patch.object(WorkerThread, '_save_result', lambda self, build: True):
+                        started = timer()
+                        worker.run()
+                        seconds = timer() - started
+        results.append(throughput('worker.loop', dict(prefetch=count, save_result=False),
+                                  builds, seconds))
+    return results
+
+def seed(documents):
+    """ PUBLIC: adds made up builds to MongoDB until there are documents of them """
+    collection = Build.collection
+    have = collection.find({'benchmark': True}).count()
+    now = datetime.utcnow()
+    batch = []
+    for i in range(have, documents):
+        build = payload(i)
+        build.update(status=random.choice([1, 1, 1, 2]), error=u'', benchmark=True,
+                     build_time=now - timedelta(minutes=random.randint(0, 30 * 24 * 60)))
+        batch.append(build)
+        if len(batch) == 1000:
+            collection.insert(batch)
+            batch = []
+    if batch:
+        collection.insert(batch)
+
+def bench_api(sizes=SIZES, iterations=50):
+    """ /builds and /blame latency as the builds collection grows """
+    from rosie.api import api
+    client = api.test_client()
+    requests = [
+        ('api.builds', '/builds'),
+        ('api.builds', '/builds?status=2&limit=20'),
+        ('api.blame', '/blame'),
+        ('api.blame', '/blame?days=7&repository=rosie')
+    ]
+
+    results = []
+    try:
+        for documents in sizes:
+            seed(documents)
+            for name, url in requests:
+                def get(i):
+                    response = client.get(url)
+                    response.data
+                results.append(record(name, dict(documents=documents, url=url),
+                                      timed(get, iterations)))
+    finally:
+        Build.collection.remove({'benchmark': True})
+        api.dispatcher.stop(5)
+    return results
+
+
+BENCHMARKS = [
+    ('queue', lambda args: sum([bench_queue(kind) for kind in
+                                ['memory', 'coalescing', 'priority', 'fair'] +
+                                ([] if args.no_mongo else ['mongo'])], [])),
+    ('build', lambda args: bench_build(mongo=not args.no_mongo)),
+    ('worker', lambda args: bench_worker()),
+    ('api', lambda args: [] if args.no_mongo else bench_api(args.sizes)),
+]
+
+def commit():
+    """ PUBLIC: the commit the benchmarks are run at, None outside of git """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(before, after):
+    """ PUBLIC: lines comparing the results of two runs """
+    def key(result):
+        return (result['name'], json.dumps(result['params'], sort_keys=True))
+    old = dict((key(result), result) for result in before['results'])
+    lines = []
+    for result in after['results']:
+        previous = old.get(key(result), None)
+        if previous is None or not previous['mean']:
+            continue
+        lines.append("%-14s %-50s %10.6fs -> %10.6fs  %+6.1f%%" % (
+            result['name'], key(result)[1], previous['mean'], result['mean'],
+            (result['mean'] / previous['mean'] - 1) * 100))
+    return lines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the Rosie benchmarks.")
+    parser.add_argument('--output', help="file to write the results to (default stdout)")
+    parser.add_argument('--only', help="comma separated benchmark groups to run: " +
+                        ', '.join(name for name, run in BENCHMARKS))
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES),
+                        help="comma separated numbers of builds for the api benchmarks")
+    parser.add_argument('--no-mongo', action='store_true',
+                        help="skip the benchmarks that need a local mongod")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help="compare two result files instead of running")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as before:
+            with open(args.compare[1]) as after:
+                print '\n'.join(compare(json.load(before), json.load(after)))
+        return
+
+    args.sizes = [int(size) for size in args.sizes.split(',')]
+    only = args.only.split(',') if args.only else None
+    results = []
+    for name, run in BENCHMARKS:
+        if only is None or name in only:
+            results.extend(run(args))
+
+    document = dict(commit=commit(), python=platform.python_version(),
+                    taken_at=datetime.utcnow().isoformat(), results=results)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        json.dump(document, output, indent=2, sort_keys=True)
+        output.write('\n')
+    finally:
+        if args.output:
+            output.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+# Settings for the Rosie server. Only UPPERCASE names are read by Flask's
+# config.from_object, and they are passed on to the WorkerThreads.
+
+# number of persistent WorkerThreads the Dispatcher starts with the server
+WORKER_COUNT = 1
+# seconds an idle WorkerThread waits on the BuildQueue between stop checks
+WORKER_POLL_INTERVAL = 1
+# Build.ids a WorkerThread dequeues and fetches with one query at a time
+WORKER_PREFETCH = 1
+
+# 'memory' keeps queued builds in process; 'coalescing' does too, but only
+# keeps the newest queued build of every repository and ref; 'mongo' stores
+# them durably in MongoDB so several servers and worker hosts can share one
+# queue; 'priority' builds protected refs and pushes before the rest;
+# 'fair' serves the queued builds of every repository in turn
+BUILD_QUEUE = 'memory'
+# seconds a worker may hold a job of the 'mongo' queue before it is requeued
+BUILD_QUEUE_LEASE = 60
+# times a job of the 'mongo' queue is claimed before its build is failed
+BUILD_QUEUE_MAX_ATTEMPTS = 5
+
+# bash run for every build, in BUILD_DIRECTORY; a step left empty is skipped
+PRE_BUILD_HOOK = ''
+TEST_COMMAND = ''
+POST_BUILD_HOOK = ''
+BUILD_DIRECTORY = None
+# wall-clock limit for the pre-build hook and test command together, in
+# seconds (None for no limit)
+BUILD_TIMEOUT = 3600
+# wall-clock limit of the post-build hook, which has a limit of its own so
+# that it still runs after BUILD_TIMEOUT (None for no limit)
+POST_BUILD_HOOK_TIMEOUT = 300
+# resource limits applied to every step, e.g. {'RLIMIT_AS': 2 * 1024 ** 3}
+BUILD_RLIMITS = {}
+# build output is stored in chunks of this many bytes while it is produced
+BUILD_LOG_CHUNK_SIZE = 64 * 1024
+
+# builds returned per page by /builds, by default and at most
+BUILDS_PAGE_SIZE = 100
+BUILDS_MAX_PAGE_SIZE = 1000
+
+# serve /blame from the counters the workers maintain instead of aggregating
+# the builds collection (fill them with models.rebuild_blame_counters first)
+BLAME_COUNTERS = False
+
+# log the plan of every query issued by the api; with QUERY_EXPLAIN_STRICT a
+# query that scans the whole collection raises instead (for tests)
+QUERY_EXPLAIN = False
+QUERY_EXPLAIN_STRICT = False
+
+# with BUILD_QUEUE = 'coalescing', a queued build is replaced by a newer one
+# of the same repository and ref; this also cancels such a build if running
+COALESCE_CANCEL_RUNNING = False
+
+# with BUILD_QUEUE = 'priority', builds are built lowest class first: the
+# class of their ref (PRIORITY_DEFAULT_REF if not listed) plus the class of
+# what queued them. A build moves up a class every PRIORITY_AGING seconds.
+PRIORITY_REFS = {'refs/heads/master': 0}
+PRIORITY_DEFAULT_REF = 2
+PRIORITY_TRIGGERS = {'webhook': 0, 'rebuild': 1}
+PRIORITY_AGING = 300
+
+# with BUILD_QUEUE = 'fair', how many builds of a repository url are handed
+# out per turn (default 1), and how many of them may run at the same time
+FAIR_SHARE_WEIGHTS = {}
+FAIR_SHARE_MAX_RUNNING = {}
+FAIR_SHARE_DEFAULT_MAX_RUNNING = None
+
+# OAuth application used to open issues for failed builds
+GITHUB_ID = None
+GITHUB_SECRET = None
+GITHUB_API_URL = 'https://api.github.com'
+# post failures from a background notifier instead of the WorkerThreads, with
+# up to GITHUB_NOTIFY_RETRIES retries starting GITHUB_NOTIFY_BACKOFF seconds apart
+GITHUB_NOTIFY_ASYNC = True
+GITHUB_NOTIFY_RETRIES = 5
+GITHUB_NOTIFY_BACKOFF = 1
+
+# give a build the result of an earlier build of the same commit with the
+# same build settings instead of building it (/builds/new always builds)
+RESULT_CACHE = True
+
+# directory to keep a mirror of every repository and the checkouts of builds
+# in; without it, builds run in BUILD_DIRECTORY and nothing is checked out
+WORKSPACE_ROOT = None
+
+# bytes the mirrors may take up before the least recently used are removed
+# (None for no limit)
+WORKSPACE_DISK_BUDGET = None
+
+# seconds a clone or fetch into a mirror may take before the checkout fails
+# (None for no limit); BUILD_TIMEOUT does not cover the checkout
+WORKSPACE_FETCH_TIMEOUT = 600
+
+# directory to cache installed dependencies in, keyed by the lockfiles they
+# were installed from (None turns the cache off)
+DEPENDENCY_CACHE_ROOT = None
+
+# directories the pre-build hook installs dependencies into, relative to the
+# build directory, and the lockfiles that decide what goes into them
+DEPENDENCY_CACHE_PATHS = {
+    'vendor/bundle': ['Gemfile.lock'],
+    '.deps': ['requirements.txt']
+}
+
+# bytes the dependency cache may take up (None for no limit), and seconds an
+# entry is kept after it was last used
+DEPENDENCY_CACHE_MAX_SIZE = None
+DEPENDENCY_CACHE_MAX_AGE = 7 * 24 * 3600
+
+# how many shards to split the test command into, run at the same time, and
+# the glob pattern of the test files dealt out over them (substituted for
+# {files} in TEST_COMMAND)
+TEST_SHARDS = 1
+TEST_SHARD_FILES = None
+
+# only run the tests affected by the paths changed since the last successful
+# build of the ref (needs WORKSPACE_ROOT, and {files} in TEST_COMMAND for
+# the tests to be put in). Changed paths are mapped to tests
+# by the (regular expression, test file glob) rules, then by the coverage map
+# file in the checkout; a path matched by neither makes the build run all
+# tests, and so does every TEST_SELECTION_FULL_RUN_EVERY-th build
+TEST_SELECTION = False
+TEST_SELECTION_RULES = []
+TEST_SELECTION_COVERAGE = None
+TEST_SELECTION_FULL_RUN_EVERY = 20
+
+# where the event-loop ingestion server (ingest.py) listens for webhooks, the
+# most builds it inserts with one write, and the largest payload in bytes it
+# accepts
+INGEST_HOST = '127.0.0.1'
+INGEST_PORT = 5001
+INGEST_BATCH_SIZE = 500
+INGEST_MAX_BODY = 25 * 1024 * 1024
+
+# which commits of a push that lists several commits get a build: 'head' for
+# the last one only, 'all' for every commit, or 'every' for every
+# PUSH_BUILDS_EVERY-th commit counting back from the last one
+PUSH_BUILDS = 'head'
+PUSH_BUILDS_EVERY = 1
+
+# store the results of the builds of all workers in batches, written together
+# every RESULT_WRITE_WINDOW seconds (needs MongoDB 2.6 or later)
+RESULT_WRITE_BATCHING = False
+RESULT_WRITE_WINDOW = 0.005
+RESULT_WRITE_BATCH_SIZE = 100
+
+# live build events (/events and /builds/<build_id>/events): how many unread
+# events a watcher may fall behind by before it loses the oldest, how many
+# seconds a stream of the Flask application lasts before the client has to
+# reconnect, and how often a quiet stream sends a keep-alive
+EVENTS_SUBSCRIBER_BUFFER = 1000
+EVENTS_STREAM_TIMEOUT = 30
+EVENTS_HEARTBEAT = 15
+
+# seconds a finished build may be cached by browsers and proxies (a rebuild
+# may be served stale for that long), and how many finished builds the ETags
+# of are kept, so a conditional GET of one needs no read of MongoDB (0 when
+# builds can be rebuilt through another server process)
+BUILD_CACHE_MAX_AGE = 24 * 3600
+BUILD_ETAG_CACHE = 10000
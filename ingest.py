@@ -0,0 +1,449 @@
+"""
+This module is a second front end for GitHub's Webhooks, for when they come
+in faster than the Flask application can take them.
+
+The Flask application handles each request on a thread of its own, which
+saves the Build before it answers, so a storm of redelivered webhooks needs
+as many threads as there are deliveries in flight. The IngestServer instead
+handles every connection on a single thread with an event loop (asyncore,
+with poll, so there is no limit on the number of open connections), and
+hands the payloads to a BuildWriter thread:
+
+    1. The IngestServer reads POST /build, splits the payload into the
+       payloads of its Builds (see PUSH_BUILDS) and passes them on; a
+       payload that is not a push is answered with 400 right away.
+    2. The BuildWriter takes every delivery waiting, inserts their Builds
+       with one acknowledged insert, and adds them to the BuildQueue.
+    3. Only then does the IngestServer answer each delivery with the id of
+       its Build (of the head commit, for a push that makes several builds;
+       see PUSH_BUILDS), just like the Flask application does.
+
+So a delivery is only acknowledged once its Build is in MongoDB; with
+BUILD_QUEUE = 'mongo' its place in the queue is stored too, and a separate
+ingest process hands builds to the WorkerThreads of other processes. GET
+/ping answers like the Flask application's.
+
+GET /events and /builds/<build_id>/events stream the events of builds (see
+models/events.py) like the Flask application does, but a stream is only a
+connection of the event loop, so there is no limit on how long it lasts or,
+short of file descriptors, on how many there are. The IngestServer is one
+subscriber of the EventBus, and hands every event to the streams that want
+it from the event loop.
+
+Running this module serves the IngestServer on INGEST_PORT and the Flask
+application (for everything else) on its usual port, from one process:
+
+    python -m rosie.ingest
+
+CONFIGURATION:
+
+    INGEST_HOST and INGEST_PORT are where the IngestServer listens (default
+    127.0.0.1:5001).
+    INGEST_BATCH_SIZE is the most Builds inserted at once (default 500).
+    INGEST_MAX_BODY is the largest payload in bytes accepted (default 25MB,
+    GitHub's limit).
+    EVENTS_HEARTBEAT is how many seconds a quiet event stream waits before it
+    sends a keep-alive (default 15).
+"""
+
+from Queue import Queue, Empty
+from collections import deque
+import threading
+import asyncore
+import asynchat
+import logging
+import socket
+import fcntl
+import json
+import time
+import os
+import re
+
+from models import (
+    metrics,
+    events,
+    format_event,
+    new_build,
+    expand_push,
+    connection
+)
+
+logger = logging.getLogger(__name__)
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Request Entity Too Large',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+BUILD_EVENTS = re.compile(r'^/builds/([0-9a-f]{24})/events$')
+
+class BuildWriter(threading.Thread):
+    """PUBLIC: Constructor for BuildWriter
+
+        @param queue is the BuildQueue the Builds are added to
+        @param configs is the configuration for the Rosie server
+        @param connection is the mongokit connection the Builds are saved with
+        @param dispatcher is the Dispatcher, used for COALESCE_CANCEL_RUNNING
+    """
+    def __init__(self, queue, configs=dict(), connection=connection, dispatcher=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.configs = configs
+        self.connection = connection
+        self.dispatcher = dispatcher
+        self.batch_size = configs.get('INGEST_BATCH_SIZE', 500)
+        # (payloads, callback) pairs waiting to be written
+        self.pending = Queue()
+        self.stopped = threading.Event()
+
+    def submit(self, payloads, callback):
+        """ PUBLIC: queues the payloads of the Builds of one delivery (see
+        expand_push) to be saved
+
+            @param callback is called from the BuildWriter thread with the
+                saved Builds, head commit last, or None if they could not be
+                saved and queued
+        """
+        self.pending.put((payloads, callback))
+
+    def stop(self):
+        """ PUBLIC: stops the writer once the batch in progress is written """
+        self.stopped.set()
+
+    def run(self):
+        """ PUBLIC: writes batches of Builds until stopped """
+        while not self.stopped.is_set():
+            try:
+                batch = [self.pending.get(True, 1)]
+            except Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception:
+                # the writer must outlive a bad batch, or every later
+                # delivery would wait for an answer forever
+                logger.exception("Could not write a batch of %d deliveries.", len(batch))
+
+    def write(self, batch):
+        """ PUBLIC: saves and queues the Builds of a batch of deliveries with
+        a single insert and a single BuildQueue operation, then calls back for
+        each delivery with its Builds """
+        pushes = []
+        for payloads, callback in batch:
+            try:
+                pushes.append(([new_build(payload, self.connection) for payload in payloads],
+                               callback))
+            except Exception:
+                logger.exception("Could not make the builds of a delivery.")
+                self._answer(callback, None)
+        builds = sum([push for push, callback in pushes], [])
+        if not builds:
+            return
+
+        try:
+            self.connection.Build.collection.insert(builds, safe=True)
+            for build in builds:
+                metrics.build_queued(build)
+                events.publish('queued', build['_id'], status=0)
+            self.queue.add_builds(builds)
+        except Exception:
+            logger.exception("Could not save and queue a batch of %d builds.", len(builds))
+            for push, callback in pushes:
+                self._answer(callback, None)
+            return
+
+        for push, callback in pushes:
+            if self.dispatcher is not None and \
+                    self.configs.get('COALESCE_CANCEL_RUNNING', False):
+                try:
+                    self.dispatcher.cancel_superseded(push[-1])
+                except Exception:
+                    logger.exception("Could not cancel the builds %s supersedes.",
+                                     push[-1]['_id'])
+            self._answer(callback, push)
+
+    def _answer(self, callback, builds):
+        """ PRIVATE: calls back for a delivery, whatever the callback does """
+        try:
+            callback(builds)
+        except Exception:
+            logger.exception("Could not answer a delivery.")
+
+
+class IngestChannel(asynchat.async_chat):
+    """ One connection to the IngestServer, which reads a request and answers
+    it once the IngestServer has a response for it """
+
+    def __init__(self, sock, server):
+        asynchat.async_chat.__init__(self, sock, map=server.map)
+        self.server = server
+        self.data = []
+        self.received = 0
+        self.method = self.path = None
+        self.headers = dict()
+        self.responded = False
+        # for an event stream, the Build.id it follows (None for every
+        # build) and the seq of the last event it was sent
+        self.stream = False
+        self.build_id = None
+        self.seq = 0
+        self.set_terminator('\r\n\r\n')
+
+    def collect_incoming_data(self, data):
+        if self.responded:
+            return
+        self.received += len(data)
+        if self.received > self.server.max_body:
+            self.set_terminator(None)
+            self.respond(413, dict(error="Payload too large"))
+            return
+        self.data.append(data)
+
+    def found_terminator(self):
+        data, self.data = ''.join(self.data), []
+        if self.method is None:
+            lines = data.split('\r\n')
+            try:
+                self.method, self.path = lines[0].split(' ')[:2]
+            except ValueError:
+                self.set_terminator(None)
+                return self.respond(400, dict(error="Invalid request"))
+            headers = dict(line.split(':', 1) for line in lines[1:] if ':' in line)
+            self.headers = headers = dict((name.strip().lower(), value.strip())
+                                          for name, value in headers.items())
+            try:
+                length = int(headers.get('content-length', 0))
+            except ValueError:
+                length = -1
+            if length < 0 or length > self.server.max_body:
+                self.set_terminator(None)
+                return self.respond(413 if length > 0 else 400, dict(error="Invalid length"))
+            self.received = 0
+            if length:
+                self.set_terminator(length)
+                return
+        self.set_terminator(None)
+        self.server.handle(self, self.method, self.path.split('?')[0], data)
+
+    def respond(self, status, document):
+        """ PUBLIC: sends a JSON response and closes the connection """
+        self.responded = True
+        body = json.dumps(document)
+        self.push("HTTP/1.0 %d %s\r\nContent-Type: application/json\r\n"
+                  "Content-Length: %d\r\nConnection: close\r\n\r\n%s"
+                  % (status, REASONS.get(status, ''), len(body), body))
+        self.close_when_done()
+
+    def start_stream(self, build_id, missed):
+        """ PUBLIC: turns the connection into an event stream of the build
+        with Build.id build_id (None for every build) """
+        self.responded = self.stream = True
+        self.build_id = build_id
+        self.push("HTTP/1.0 200 OK\r\nContent-Type: text/event-stream\r\n"
+                  "Cache-Control: no-cache\r\nConnection: close\r\n\r\nretry: 1000\n\n")
+        for event in missed:
+            self.send_event(event)
+
+    def send_event(self, event):
+        """ PUBLIC: sends an event on the stream, unless it was sent already;
+        the stream of a build ends when it is finished """
+        if event['seq'] <= self.seq or not self.connected:
+            return
+        self.seq = event['seq']
+        self.push(format_event(event))
+        if self.build_id is not None and event['type'] == 'finished':
+            self.close_when_done()
+
+    def close(self):
+        if self.stream:
+            self.server.end_stream(self)
+        asynchat.async_chat.close(self)
+
+    def handle_error(self):
+        logger.exception("Error on an ingest connection.")
+        self.close()
+
+
+class Waker(asyncore.file_dispatcher):
+    """ The read end of a pipe that wakes the event loop when the BuildWriter
+    has responses for it """
+
+    def __init__(self, server):
+        self.read_fd, self.write_fd = os.pipe()
+        fcntl.fcntl(self.write_fd, fcntl.F_SETFL, os.O_NONBLOCK)
+        asyncore.file_dispatcher.__init__(self, self.read_fd, map=server.map)
+        self.server = server
+        self.pending = False
+        self.lock = threading.Lock()
+
+    def wake(self):
+        # one byte in the pipe is enough to wake the loop, however many
+        # threads have something for it
+        with self.lock:
+            if self.pending:
+                return
+            self.pending = True
+        os.write(self.write_fd, 'x')
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(4096)
+        with self.lock:
+            self.pending = False
+        self.server.send_responses()
+
+
+class IngestServer(asyncore.dispatcher):
+    """PUBLIC: Constructor for IngestServer
+
+        @param queue is the BuildQueue the Builds are added to
+        @param configs is the configuration for the Rosie server
+        @param connection is the mongokit connection the Builds are saved with
+        @param dispatcher is the Dispatcher that /ping reports on
+    """
+    def __init__(self, queue, configs=dict(), connection=connection, dispatcher=None):
+        # a socket map of its own, so it can share a process with other loops
+        self.map = dict()
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.dispatcher = dispatcher
+        self.max_body = configs.get('INGEST_MAX_BODY', 25 * 1024 * 1024)
+        self.push_builds = configs.get('PUSH_BUILDS', 'head')
+        self.push_builds_every = configs.get('PUSH_BUILDS_EVERY', 1)
+        self.writer = BuildWriter(queue, configs, connection, dispatcher)
+        self.waker = Waker(self)
+        # (channel, status, document) waiting to be sent by the event loop
+        self.responses = deque()
+        self.thread = None
+
+        # the IngestServer subscribes to the events of every build, and hands
+        # them to its streams: Build.id (None for every build) -> channels
+        self.build_id = None
+        self.events = deque()
+        self.streams = dict()
+        self.heartbeat = configs.get('EVENTS_HEARTBEAT', 15)
+        events.subscribe(self)
+
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((configs.get('INGEST_HOST', '127.0.0.1'), configs.get('INGEST_PORT', 5001)))
+        self.listen(1024)
+        self.port = self.socket.getsockname()[1]
+
+    def start(self):
+        """ PUBLIC: runs the BuildWriter and the event loop in the background """
+        self.writer.start()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve_forever(self):
+        """ PUBLIC: runs the event loop until the IngestServer is closed """
+        beat = time.time() + self.heartbeat
+        while self.map:
+            asyncore.loop(timeout=1, use_poll=True, map=self.map, count=1)
+            if time.time() >= beat:
+                beat = time.time() + self.heartbeat
+                for channels in self.streams.values():
+                    for channel in list(channels):
+                        channel.push(': keep-alive\n\n')
+
+    def stop(self):
+        """ PUBLIC: stops accepting deliveries and closes every connection """
+        events.unsubscribe(self)
+        self.writer.stop()
+        asyncore.close_all(map=self.map)
+
+    def put(self, event):
+        """ PUBLIC: hands an event of the EventBus to the event loop """
+        if self.streams:
+            self.events.append(event)
+            self.waker.wake()
+
+    def end_stream(self, channel):
+        """ PUBLIC: forgets a stream that was closed """
+        channels = self.streams.get(channel.build_id, set())
+        channels.discard(channel)
+        if not channels:
+            self.streams.pop(channel.build_id, None)
+
+    def handle_accept(self):
+        accepted = self.accept()
+        if accepted is not None:
+            IngestChannel(accepted[0], self)
+
+    def handle(self, channel, method, path, body):
+        """ PUBLIC: answers a request, or passes it to the BuildWriter """
+        if path == '/ping' and method == 'GET':
+            status = self.dispatcher.status() if self.dispatcher else dict(building=False)
+            metrics.requests.inc(endpoint='ingest.ping', method=method, status=200)
+            return channel.respond(200, status)
+        match = BUILD_EVENTS.match(path)
+        if method == 'GET' and (match or path == '/events'):
+            build_id = match.group(1) if match else None
+            try:
+                after = int(channel.headers.get('last-event-id', None) or -1)
+            except ValueError:
+                after = -1
+            metrics.requests.inc(endpoint='ingest.events', method=method, status=200)
+            self.streams.setdefault(build_id, set()).add(channel)
+            return channel.start_stream(build_id, events.missed(build_id,
+                                                                after if after >= 0 else None))
+        if path != '/build' or method != 'POST':
+            return channel.respond(404, dict(error="Not found"))
+
+        try:
+            payload = json.loads(body).get('payload', None)
+        except (ValueError, AttributeError):
+            return channel.respond(400, dict(error="Invalid JSON"))
+        if not payload:
+            return channel.respond(200, dict(success=False))
+        try:
+            payloads = expand_push(payload, self.push_builds, self.push_builds_every)
+            if not all(isinstance(payload, dict) for payload in payloads):
+                raise ValueError(payloads)
+        except Exception:
+            return channel.respond(400, dict(error="Invalid payload"))
+
+        def saved(builds):
+            # answered like the Flask application answers: the id of the head
+            # commit's Build, and the ids of all of them for several commits
+            if builds is None:
+                self.responses.append((channel, 503, dict(success=False)))
+            elif len(builds) == 1:
+                self.responses.append((channel, 200, dict(success=True,
+                                                          id=str(builds[0]['_id']))))
+            else:
+                self.responses.append((channel, 200, dict(success=True,
+                    id=str(builds[-1]['_id']), ids=[str(build['_id']) for build in builds])))
+            self.waker.wake()
+        self.writer.submit(payloads, saved)
+
+    def send_responses(self):
+        """ PUBLIC: sends the responses the BuildWriter left, and the events
+        for the streams, from the event loop, since connections may only be
+        used from its thread """
+        while self.responses:
+            channel, status, document = self.responses.popleft()
+            metrics.requests.inc(endpoint='ingest.build', method='POST', status=status)
+            channel.respond(status, document)
+        while self.events:
+            event = self.events.popleft()
+            for build_id in (event['id'], None):
+                for channel in list(self.streams.get(build_id, ())):
+                    channel.send_event(event)
+
+    def handle_error(self):
+        logger.exception("Error in the ingest server.")
+
+
+if __name__ == '__main__':
+    from api import api
+    server = IngestServer(api.queue, api.config, connection, api.dispatcher)
+    server.start()
+    api.run()
@@ -1,3 +1,22 @@
-from build_queue import BuildQueue
-from build import Build, BuildErrorException, connection
+from build_queue import BuildQueue, create_build_queue
+from mongo_build_queue import MongoBuildQueue
+from priority_build_queue import PriorityBuildQueue
+from fair_share_build_queue import FairShareBuildQueue
+from coalescing_build_queue import CoalescingBuildQueue, coalesce_key
+from build import Build, BuildErrorException, connection, ensure_indexes, new_build, expand_push, \
+    save_result
+from query_plan import explain_query, explain_aggregate, QueryPlanException
+from metrics import metrics, Metrics
+from events import events, EventBus, Subscription, format_event
+from timings import stage_percentiles, STAGES
+from build_log import BuildLog
+from result_cache import ResultCache, commit_id
+from blame import blame_counts, record_failure, rebuild_blame_counters, ensure_blame_indexes
+from dependency_cache import DependencyCache
+from executor import BuildExecutor
+from selection import TestSelector
+from workspace import WorkspaceCache, WorkspaceException
+from notifier import GitHubNotifier
+from result_writer import ResultWriter
 from worker_thread import WorkerThread, BuildNotFoundException
+from dispatcher import Dispatcher
@@ -0,0 +1,130 @@
+"""
+Counts of failed builds per author, for the /blame endpoint.
+
+There are two ways of counting them:
+
+    By default, the builds collection is aggregated on the server: every build
+    with status 2 is matched and counted per author.name, so no Build is ever
+    loaded into Python.
+
+    With BLAME_COUNTERS = True, a blame counters collection is read instead.
+    The WorkerThread increments a counter with $inc each time it marks a build
+    failed, whether it built it or took the result from the ResultCache, so reading it only touches one document per author, repository and
+    day. A counter document looks like this:
+
+        {
+            'author': unicode,      # author.name of the failed build
+            'repository': unicode,  # repository.name of the failed build
+            'day': datetime,        # midnight (UTC) of the day it failed
+            'failures': int
+        }
+
+    Builds that failed before the WorkerThreads started keeping counters are
+    not counted; rebuild_blame_counters fills the counters in from the builds
+    collection.
+    Because counters record failures as they happen, a build that is rebuilt
+    and fails again is counted twice.
+
+Both can be restricted to one repository and to the builds of the last days
+(for counters, whole days are counted).
+"""
+
+from datetime import datetime
+from build import connection
+from query_plan import explain_aggregate
+
+def blame_collection(connection=connection, configs=dict()):
+    """ PUBLIC: the collection the blame counters are stored in """
+    return connection.rosie[configs.get('BLAME_COLLECTION', 'blame')]
+
+def _day(moment):
+    """ PRIVATE: midnight of the day of moment """
+    return datetime(moment.year, moment.month, moment.day)
+
+def _aggregate(collection, pipeline):
+    """ PRIVATE: runs an aggregation, whichever shape pymongo returns """
+    result = collection.aggregate(pipeline)
+    if isinstance(result, dict):
+        return result['result']
+    return list(result)
+
+def record_failure(build, connection=connection, configs=dict()):
+    """ PUBLIC: increments the blame counter of the author of a failed build """
+    author = build.get('author', dict()).get('name', None)
+    if author is None:
+        return
+    collection = blame_collection(connection, configs)
+    collection.update(
+        dict(author=author,
+             repository=build.get('repository', dict()).get('name', None),
+             day=_day(build.get('build_time', None) or datetime.utcnow())),
+        {'$inc': {'failures': 1}},
+        upsert=True
+    )
+
+def blame_counts(since=None, repository=None, connection=connection, configs=dict()):
+    """ PUBLIC: number of failed builds per author name
+
+        @param since only counts builds from this datetime (UTC) on
+        @param repository only counts builds of the repository with this name
+    """
+    if configs.get('BLAME_COUNTERS', False):
+        collection = blame_collection(connection, configs)
+        match = dict()
+        if since is not None:
+            match['day'] = {'$gte': _day(since)}
+        if repository is not None:
+            match['repository'] = repository
+        group = {'_id': '$author', 'failures': {'$sum': '$failures'}}
+    else:
+        collection = connection.Build.collection
+        match = dict(status=2)
+        if since is not None:
+            match['build_time'] = {'$gte': since}
+        if repository is not None:
+            match['repository.name'] = repository
+        group = {'_id': '$author.name', 'failures': {'$sum': 1}}
+
+    pipeline = [{'$match': match}, {'$group': group}]
+    if not configs.get('BLAME_COUNTERS', False):
+        # the counters are few and are always read whole
+        explain_aggregate('blame counts', collection, pipeline, configs)
+    results = _aggregate(collection, pipeline)
+    return dict((result['_id'], result['failures']) for result in results)
+
+def rebuild_blame_counters(connection=connection, configs=dict()):
+    """ PUBLIC: replaces the blame counters with counts from the builds
+    collection, to start using BLAME_COUNTERS on an existing database """
+    results = _aggregate(connection.Build.collection, [
+        # builds that were never built have no day to be counted on
+        {'$match': {'status': 2, 'build_time': {'$type': 9}}},
+        {'$group': {
+            '_id': {
+                'author': '$author.name',
+                'repository': '$repository.name',
+                'year': {'$year': '$build_time'},
+                'month': {'$month': '$build_time'},
+                'day': {'$dayOfMonth': '$build_time'}
+            },
+            'failures': {'$sum': 1}
+        }}
+    ])
+
+    collection = blame_collection(connection, configs)
+    collection.remove()
+    for result in results:
+        key = result['_id']
+        if key.get('author', None) is None:
+            continue
+        collection.insert(dict(
+            author=key['author'],
+            repository=key.get('repository', None),
+            day=datetime(key['year'], key['month'], key['day']),
+            failures=result['failures']
+        ))
+    ensure_blame_indexes(connection, configs)
+
+def ensure_blame_indexes(connection=connection, configs=dict()):
+    """ PUBLIC: creates the index the counters are looked up with """
+    blame_collection(connection, configs).ensure_index(
+        [('author', 1), ('repository', 1), ('day', 1)], unique=True)
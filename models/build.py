@@ -49,9 +49,31 @@ class Build(Document):
         'message': unicode,     # the commit message describing changes made
         'timestamp': unicode,   # time committed
         'ref': unicode,         # branch information
-        'status': IS(0,1,2),    # 0 = processing, 1 = successful, 2 = failed
+        'status': IS(0,1,2,3),  # 0 = processing, 1 = successful, 2 = failed,
+                                # 3 = skipped, superseded by a newer build
         'error': unicode,        # information about any build errors (optional)
-        'build_time': datetime.datetime
+        'build_time': datetime.datetime,
+        'queued_at': datetime.datetime,     # when it was last queued
+        'timings': dict,        # seconds spent in every stage (see timings.py)
+        'superseded_by': ObjectId,  # the build that replaced a skipped build
+        'force': bool,          # build even if the result is cached
+        'cached_from': ObjectId, # the build whose cached result this build got
+        'dependencies': [{      # what the dependency cache restored
+            'path': unicode,
+            'key': unicode,
+            'hit': bool,
+            'restore_time': float
+        }],
+        'full_run': bool,       # False if only the tests affected by the
+                                # changes were run
+        'selected_tests': [unicode],
+        'shards': [{            # how the shards of the test command went
+            'index': int,
+            'status': int,      # exit status
+            'duration': float   # seconds
+        }],
+        'result_token': ObjectId    # which batched write stored the result
+                                    # (see result_writer.py)
     }
 
     default_values = {
@@ -74,6 +96,15 @@ class Build(Document):
         'status'
     ]
 
+    # the indexes behind the queries of /blame, /builds and the WorkerThread.
+    # ensure_indexes creates them when the Application Server starts.
+    indexes = [
+        {'fields': [('status', 1), ('build_time', -1)]},
+        {'fields': [('repository.name', 1), ('ref', 1), ('build_time', -1)]},
+        {'fields': [('repository.url', 1), ('ref', 1), ('build_time', -1)]},
+        {'fields': [('author.name', 1), ('status', 1)]}
+    ]
+
 
     # The following two methods are documented here:
     #    http://namlook.github.com/mongokit/json.html
@@ -100,18 +131,26 @@ class Build(Document):
 
     # load
     def load_from_database(self, id):
-    	""" takes in an id and fills the build document with it """
-    	if not isinstance(id, ObjectId):
-    	    raise BuildErrorException("Not a valid ID")
+        """ takes in an id and returns the build with that id """
+        if not isinstance(id, ObjectId):
+            raise BuildErrorException("Not a valid ID")
 
-        matches = connection.Build.find({'_id': id})
+        # _id is unique, so a single find_one is all it takes
+        build = connection.Build.find_one({'_id': id})
 
-    	if matches.count() == 1:
-    	    return matches[0]
-    	elif matches.count() == 0:
-    	    raise BuildErrorException("Found no matching documents.")
-        else:
-    	    raise BuildErrorException("Found multiple matching documents.")
+        if build is None:
+            raise BuildErrorException("Found no matching documents.")
+        return build
+
+    # get_many
+    def get_many(self, ids, fields=None):
+        """ takes in a list of ids and returns the builds with those ids,
+            in the same order, using a single query. Ids that match no
+            build give None. fields restricts the fields that are loaded. """
+        ids = list(ids)
+        builds = dict((build['_id'], build) for build in
+                      connection.Build.find({'_id': {'$in': ids}}, fields))
+        return [builds.get(id, None) for id in ids]
 
     # save
     # def save(self, *args, **kwargs):
@@ -127,11 +166,14 @@ class Build(Document):
     #     return self.collection.save(self, *args, **kwargs)
 
     # update_with_results
-    def update_with_results(self, newstatus, errmsg=None):
-    	self['status'] = newstatus
-    	if newstatus == 2: # if the build failed
-    	    self['error'] = errmsg
-    	self.save()        # handles validation
+    def update_with_results(self, newstatus, errmsg=None, expected=None):
+        """ sets the status (and error) with a $set of only those fields,
+            leaving the rest of the document alone. With expected, only
+            if the status still is expected; returns whether it was set """
+        self['status'] = newstatus
+        if newstatus == 2: # if the build failed
+            self['error'] = errmsg
+        return save_result(self, ['status', 'error'], expected)
 
     # The following methods are documented here:
     #    http://namlook.github.com/mongokit/query.html
@@ -147,3 +189,77 @@ class Build(Document):
         provided by MongoKit
         returns a cursor that will iterate through all of the builds
     """
+
+
+def new_build(payload, connection=connection):
+    """ Creates the Build for a webhook payload, ready to be saved and
+    queued """
+    build = connection.Build(payload)
+    build['status'] = 0
+    build['error'] = u''
+    build['build_time'] = datetime.datetime.utcnow()
+    build['queued_at'] = build['build_time']
+    return build
+
+# the fields a WorkerThread changes while building a Build
+RESULT_FIELDS = ['status', 'error', 'build_time', 'superseded_by', 'force', 'cached_from',
+                 'dependencies', 'full_run', 'selected_tests', 'shards', 'timings']
+
+def result_update(build, fields=RESULT_FIELDS):
+    """ The $set of the fields of build a WorkerThread changed """
+    return {'$set': dict((field, build[field]) for field in fields if field in build)}
+
+def save_result(build, fields=RESULT_FIELDS, expected=0, connection=connection):
+    """ Stores the result of a build with a $set of only the fields that
+    building it changed, instead of rewriting the whole document.
+
+        @param expected is the status the build must still have in the
+            database (None for any); a build that has been finished or
+            superseded by someone else in the meantime is left alone
+
+        returns whether the result was stored
+    """
+    spec = {'_id': build['_id']}
+    if expected is not None:
+        spec['status'] = expected
+    result = connection.Build.collection.update(spec, result_update(build, fields), safe=True)
+    return bool(result and result.get('n', 0))
+
+def expand_push(payload, mode='head', every=1):
+    """ Splits a push payload, which lists every commit pushed, into the
+    payloads of the Builds it makes, oldest commit first. A payload without
+    a list of commits already is the payload of one Build.
+
+        @param mode is 'head' to build the last commit of the push only, 'all'
+            to build every commit, or 'every' to build every every-th commit,
+            counting back from the last one, which is always built
+    """
+    commits = payload.get('commits', None)
+    if not commits:
+        return [payload]
+    if mode == 'head':
+        commits = [payload.get('head_commit', None) or commits[-1]]
+    elif mode == 'every':
+        commits = commits[::-1][::max(every, 1)][::-1]
+    elif mode != 'all':
+        raise BuildErrorException("Unknown push build mode %r" % mode)
+
+    # everything but the commits is shared by the builds of the push
+    push = dict((key, value) for key, value in payload.items()
+                if key not in ('commits', 'head_commit'))
+    payloads = []
+    for commit in commits:
+        author = commit.get('author', None) or dict()
+        payloads.append(dict(push,
+            url=commit.get('url', None),
+            author=dict(name=author.get('name', None), email=author.get('email', None)),
+            message=commit.get('message', None),
+            timestamp=commit.get('timestamp', None)
+        ))
+    return payloads
+
+def ensure_indexes(connection=connection):
+    """ Creates the indexes declared by Build if they do not exist yet """
+    collection = connection.Build.collection
+    for index in Build.indexes:
+        collection.ensure_index(index['fields'])
@@ -0,0 +1,119 @@
+"""
+The BuildLog class stores the output of a build in MongoDB while it is being
+built, without ever holding the whole output in memory.
+
+Output is appended to a small buffer that is written out as a chunk document
+whenever it reaches BUILD_LOG_CHUNK_SIZE bytes, or when the executor asks for
+a flush because the build has been quiet for a while. A chunk looks like this:
+
+    {
+        'build_id': ObjectId,   # the Build the output belongs to
+        'offset': int,          # byte offset of the first byte of data
+        'end': int,             # byte offset just past the last byte of data
+        'data': Binary          # the raw output
+    }
+
+so that the log can be tailed by byte offset, from another thread or another
+process, while the build is still running. A build that is built again (see
+/builds/new) starts its log over: a new BuildLog removes the chunks of the
+last run of the build, so its output is never mixed with theirs. Only the last BUILD_LOG_TAIL_SIZE
+bytes are kept in memory, as the summary that ends up in Build.error; the
+tail always starts at the beginning of a UTF-8 character.
+"""
+
+from bson.binary import Binary
+import threading
+import time
+
+from build import connection
+
+# the bytes that continue a UTF-8 character rather than start one
+UTF8_CONTINUATION = ''.join(chr(byte) for byte in range(0x80, 0xc0))
+
+def log_collection(connection=connection, configs=dict()):
+    """ PUBLIC: the collection the BuildLog chunks are stored in """
+    return connection.rosie[configs.get('BUILD_LOG_COLLECTION', 'build_logs')]
+
+
+class BuildLog(object):
+    """PUBLIC: Constructor for BuildLog
+
+        @param build_id is the Build.id the output belongs to
+        @param configs is the configuration for the Rosie server
+        @param connection is the mongokit connection the chunks are stored with
+    """
+    def __init__(self, build_id, configs=dict(), connection=connection):
+        self.build_id = build_id
+        self.collection = log_collection(connection, configs)
+        self.chunk_size = configs.get('BUILD_LOG_CHUNK_SIZE', 64 * 1024)
+        self.tail_size = configs.get('BUILD_LOG_TAIL_SIZE', 4 * 1024)
+
+        self.offset = 0         # bytes already stored in chunks
+        self.buffer = []        # bytes not yet stored
+        self.buffered = 0
+        self.tail = ''
+        self.flushed_at = time.time()
+        self.lock = threading.Lock()
+
+        self.collection.ensure_index([('build_id', 1), ('end', 1)])
+        self.collection.remove({'build_id': build_id})
+
+    def __repr__(self):
+        return "<BuildLog %s %d bytes>" % (self.build_id, self.offset + self.buffered)
+
+    def write(self, data):
+        """ PUBLIC: appends data to the log """
+        if not data:
+            return
+        with self.lock:
+            self.buffer.append(data)
+            self.buffered += len(data)
+            self.tail = (self.tail + data)[-self.tail_size:].lstrip(UTF8_CONTINUATION)
+            if self.buffered >= self.chunk_size:
+                self._flush()
+
+    def flush(self):
+        """ PUBLIC: stores whatever is buffered as a chunk """
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        """ PUBLIC: stores the rest of the log """
+        self.flush()
+
+    def _flush(self):
+        """ PRIVATE: stores the buffer, the lock must be held """
+        self.flushed_at = time.time()
+        if not self.buffered:
+            return
+        data = ''.join(self.buffer)
+        self.collection.insert(dict(
+            build_id=self.build_id,
+            offset=self.offset,
+            end=self.offset + len(data),
+            data=Binary(data)
+        ))
+        self.offset += len(data)
+        self.buffer = []
+        self.buffered = 0
+
+    @staticmethod
+    def read(build_id, offset=0, limit=256 * 1024, configs=dict(), connection=connection):
+        """ PUBLIC: reads the stored log of a build starting at offset
+
+            @param limit is roughly the most bytes that will be returned
+
+            returns the data and the offset to read from next
+        """
+        collection = log_collection(connection, configs)
+        chunks = collection.find({'build_id': build_id, 'end': {'$gt': offset}})
+        data = []
+        read = 0
+        for chunk in chunks.sort('offset', 1):
+            start = max(offset - chunk['offset'], 0)
+            data.append(str(chunk['data'])[start:])
+            read += chunk['end'] - chunk['offset'] - start
+            offset = chunk['end']
+            if read >= limit:
+                break
+        return ''.join(data), offset
@@ -12,7 +12,7 @@ http://docs.python.org/2/library/queue.html
 """
 
 # Python stdlib requirements for Queue
-from Queue import Queue
+from Queue import Queue, Empty
 import datetime
 
 # BuildQueue inherits from standard multithreaded Python Queue
@@ -35,20 +35,103 @@ class BuildQueue(Queue):
     """ PUBLIC: Dequeue Build.id of next build.
 
     The Build.id of the next build is *removed* from the BuildQueue
-    when this is called.
+    when this is called. By default it raises Queue.Empty straight away
+    if there is no build; with block=True it waits for one instead
+    (at most timeout seconds, if given).
     """
-    def next_build(self):
+    def next_build(self, block=False, timeout=None):
         # returns Build ID of next Build in the queue
-        return self.get_nowait()
+        return self.get(block, timeout)
+
+    """ PUBLIC: Dequeue the Build.ids of up to count builds at once.
+
+    Waits for the first one like next_build does, then takes whatever else
+    is already queued without waiting.
+    """
+    def next_builds(self, count, block=False, timeout=None):
+        builds = [self.next_build(block, timeout)]
+        while len(builds) < count:
+            try:
+                builds.append(self.next_build())
+            except Empty:
+                break
+        return builds
+
+    """ PUBLIC: Mark a dequeued build as finished.
+
+    Every Build.id returned by next_build must eventually be passed back
+    here by whoever built it, so that BuildQueue.join() can tell when all
+    the builds have been processed.
+
+        @param build_id is the Build.id that was returned by next_build
+    """
+    def complete_build(self, build_id):
+        self.task_done()
 
     """ PUBLIC: Add a build to the BuildQueue. Accepts a Build object
         but only stores the Build.id in the BuildQueue.
 
         @param build is the Build object to be added to the BuildQueue
+        @param trigger is what queued the build, 'webhook' or 'rebuild'; it
+            is only used by the PriorityBuildQueue
     """
-    def add_build(self, build):
+    def add_build(self, build, trigger='webhook'):
         # returns boolean of whether build was successfully added
+        return self.put(self._item(build, trigger))
+
+    """ PUBLIC: Add several builds to the BuildQueue in one operation, which
+        takes the lock of the queue once and wakes as many waiting
+        WorkerThreads as there are builds.
+
+        @param builds are the Build objects (or Build.ids) to be added
+        @param trigger is what queued the builds
+    """
+    def add_builds(self, builds, trigger='webhook'):
+        items = [self._item(build, trigger) for build in builds]
+        if not items:
+            return
+        with self.mutex:
+            for item in items:
+                self._put(item)
+            self.unfinished_tasks += len(items)
+            self.not_empty.notify(len(items))
+
+    def _item(self, build, trigger):
+        """ PRIVATE: what is stored in the queue for a build """
         if type(build) is int or type(build) is str:
-            return self.put(build)
+            return build
         else:
-            return self.put(build['_id'])
\ No newline at end of file
+            return build['_id']
+
+
+def create_build_queue(configs=dict(), connection=None):
+    """ PUBLIC: Creates the build queue selected by the BUILD_QUEUE setting.
+
+        'memory' (the default) is the in process BuildQueue; 'coalescing',
+        'priority' and 'fair' are the in process CoalescingBuildQueue,
+        PriorityBuildQueue and FairShareBuildQueue; and 'mongo' is the durable
+        MongoBuildQueue that can be shared between processes and hosts.
+
+        @param configs is the configuration for the Rosie server
+        @param connection is the mongokit connection used by durable queues
+    """
+    backend = configs.get('BUILD_QUEUE', 'memory')
+    if backend == 'memory':
+        return BuildQueue()
+    elif backend == 'coalescing':
+        from coalescing_build_queue import CoalescingBuildQueue
+        if connection is None:
+            return CoalescingBuildQueue(configs)
+        return CoalescingBuildQueue(configs, connection)
+    elif backend == 'priority':
+        from priority_build_queue import PriorityBuildQueue
+        return PriorityBuildQueue(configs)
+    elif backend == 'fair':
+        from fair_share_build_queue import FairShareBuildQueue
+        return FairShareBuildQueue(configs)
+    elif backend == 'mongo':
+        from mongo_build_queue import MongoBuildQueue
+        if connection is None:
+            return MongoBuildQueue(configs)
+        return MongoBuildQueue(configs, connection)
+    raise ValueError("Unknown BUILD_QUEUE backend %r" % backend)
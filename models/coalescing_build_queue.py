@@ -0,0 +1,143 @@
+"""
+The CoalescingBuildQueue class is a BuildQueue that only keeps the newest
+queued build of every branch.
+
+Builds are keyed on (repository.url, ref). When builds are added for a key
+that already has builds waiting in the queue, the new Build.ids take the
+place of the old ones, so they keep the old ones' position, and the old
+Builds are marked as superseded in the database:
+
+    status = 3, superseded_by = the last Build.id that replaced them
+
+Builds added together by one add_builds are never coalesced with each other:
+they are the commits of a push (PUSH_BUILDS = 'all' or 'every'), or pushes
+delivered within one batch, and every one of them was asked for.
+
+Builds added by Build.id alone cannot be keyed and are never coalesced, and
+neither are builds queued again by /builds/new (trigger 'rebuild'): a rebuild
+was asked for explicitly, so it neither replaces nor is replaced by the
+builds of its branch.
+
+Like the BuildQueue, it relies on the standard Python Queue for all of the
+threading, and only replaces the hooks (_init, _qsize, _put and _get) that
+store the items.
+
+CONFIGURATION:
+
+    BUILD_QUEUE = 'coalescing' makes the Application Server use this queue.
+    COALESCE_CANCEL_RUNNING = True also cancels a build of the same key that
+    a WorkerThread is building when a newer one arrives (see Dispatcher).
+"""
+
+from collections import deque
+from build import connection
+from build_queue import BuildQueue
+from metrics import metrics
+from events import events
+
+def coalesce_key(build):
+    """ PUBLIC: the key builds are coalesced on, None if build is only an id """
+    if not isinstance(build, dict):
+        return None
+    return (build.get('repository', dict()).get('url', None), build.get('ref', None))
+
+
+class CoalescingBuildQueue(BuildQueue):
+
+    """ Constructor for CoalescingBuildQueue.
+
+        @param configs is the configuration for the Rosie server
+        @param connection is used to mark superseded builds
+    """
+    def __init__(self, configs=dict(), connection=connection):
+        BuildQueue.__init__(self)
+        self.connection = connection
+
+    def __repr__(self):
+        return "<CoalescingBuildQueue %s>" % sum([self.pending[key] for key in self.queue], [])
+
+    def _init(self, maxsize):
+        # keys in the order they were first queued
+        self.queue = deque()
+        # key -> the Build.ids currently queued for it, in order
+        self.pending = dict()
+        # the number of Build.ids queued, over every key
+        self.size = 0
+
+    def _qsize(self, len=len):
+        return self.size
+
+    def _put(self, item):
+        """ PRIVATE: queues (key, Build.ids) and returns the Build.ids they
+        replaced, if any """
+        key, build_ids = item
+        replaced = self.pending.get(key, [])
+        if not replaced:
+            self.queue.append(key)
+        self.pending[key] = list(build_ids)
+        self.size += len(build_ids) - len(replaced)
+        return replaced
+
+    def _get(self):
+        key = self.queue[0]
+        build_ids = self.pending[key]
+        build_id = build_ids.pop(0)
+        if not build_ids:
+            self.queue.popleft()
+            del self.pending[key]
+        self.size -= 1
+        return build_id
+
+    """ PUBLIC: Add a build to the CoalescingBuildQueue, replacing the queued
+        build of the same repository and ref.
+
+        @param build is the Build object (or Build.id) to be added
+        @param trigger is what queued the build; rebuilds are not coalesced
+    """
+    def add_build(self, build, trigger='webhook'):
+        self.add_builds([build], trigger)
+
+    """ PUBLIC: Add several builds in one operation. They replace the queued
+        builds of their repositories and refs, but not each other.
+
+        @param builds are the Build objects (or Build.ids) to be added
+        @param trigger is what queued the builds; rebuilds are not coalesced
+    """
+    def add_builds(self, builds, trigger='webhook'):
+        keys = []
+        added = dict()
+        for key, build_id in [self._item(build, trigger) for build in builds]:
+            if key not in added:
+                keys.append(key)
+                added[key] = []
+            if build_id not in added[key]:
+                added[key].append(build_id)
+
+        superseded = []
+        with self.mutex:
+            for key in keys:
+                replaced = self._put((key, added[key]))
+                # replaced builds will never be completed
+                self.unfinished_tasks += len(added[key]) - len(replaced)
+                superseded.extend((build_id, added[key][-1]) for build_id in replaced
+                                  if build_id not in added[key])
+            self.not_empty.notify(len(builds))
+
+        for replaced, build_id in superseded:
+            self.supersede(replaced, build_id)
+
+    def _item(self, build, trigger):
+        build_id = build['_id'] if isinstance(build, dict) else build
+        key = coalesce_key(build) if trigger != 'rebuild' else None
+        if key is None:
+            key = ('build', build_id)
+        return (key, build_id)
+
+    def supersede(self, build_id, superseded_by):
+        """ PUBLIC: marks a build that will not be built as superseded """
+        metrics.build_dropped(build_id)
+        events.publish('finished', build_id, status=3, superseded_by=str(superseded_by))
+        self.connection.Build.collection.update(
+            {'_id': build_id, 'status': 0},
+            {'$set': {'status': 3, 'superseded_by': superseded_by}}
+        )
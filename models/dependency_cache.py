@@ -0,0 +1,187 @@
+"""
+The DependencyCache class keeps the dependencies a build installs, so that
+builds whose lockfiles did not change do not install them again.
+
+Each cached path is a directory in the build directory that the pre-build
+hook installs dependencies into, together with the lockfiles that decide
+what goes into it:
+
+    DEPENDENCY_CACHE_PATHS = {
+        'vendor/bundle': ['Gemfile.lock'],
+        '.deps': ['requirements.txt']
+    }
+
+Its key is a hash of the pre-build hook, the path and the contents of those
+of its lockfiles the build has (a path without any of them is not cached).
+Before the steps run, the BuildExecutor restores every path whose key is in
+the cache; after the pre-build hook passed, the paths that were not restored
+are saved under their key. The installed directories must still work when
+copied to another build directory, e.g. `pip install --target .deps` or
+`bundle install --path vendor/bundle`.
+
+Builds only use the cache when they have a directory of their own
+(BUILD_DIRECTORY, or a checkout under WORKSPACE_ROOT); the BuildExecutor
+never restores paths into the working directory of the Rosie server.
+
+Cache entries not used for DEPENDENCY_CACHE_MAX_AGE seconds are removed, and
+so are the least recently used ones while the cache takes up more than
+DEPENDENCY_CACHE_MAX_SIZE bytes.
+
+CONFIGURATION:
+
+    DEPENDENCY_CACHE_ROOT is the directory the cache is kept in (default
+    None, which turns the cache off).
+    DEPENDENCY_CACHE_PATHS maps paths to their lockfiles, as above.
+    DEPENDENCY_CACHE_MAX_SIZE is the size limit in bytes (default None, no
+    limit).
+    DEPENDENCY_CACHE_MAX_AGE is the age limit in seconds (default a week).
+"""
+
+import tempfile
+import hashlib
+import logging
+import shutil
+import time
+import os
+
+from workspace import disk_usage
+
+logger = logging.getLogger(__name__)
+
+DEPENDENCY_PATHS = {
+    'vendor/bundle': ['Gemfile.lock'],
+    '.deps': ['requirements.txt']
+}
+
+class DependencyCache(object):
+    """PUBLIC: Constructor for DependencyCache
+
+        @param configs is the configuration for the Rosie server
+    """
+    def __init__(self, configs=dict()):
+        self.root = configs.get('DEPENDENCY_CACHE_ROOT', None)
+        self.paths = configs.get('DEPENDENCY_CACHE_PATHS', DEPENDENCY_PATHS)
+        self.max_size = configs.get('DEPENDENCY_CACHE_MAX_SIZE', None)
+        self.max_age = configs.get('DEPENDENCY_CACHE_MAX_AGE', 7 * 24 * 3600)
+        self.install = configs.get('PRE_BUILD_HOOK', None) or ''
+        if self.root and not os.path.isdir(self.root):
+            os.makedirs(self.root)
+
+    @property
+    def enabled(self):
+        return bool(self.root)
+
+    def key(self, directory, path):
+        """ PUBLIC: the key of path in the build directory, None if none of
+        its lockfiles are there """
+        digest = hashlib.sha1(self.install)
+        digest.update('\0%s' % path)
+        found = False
+        for lockfile in sorted(self.paths[path]):
+            filename = os.path.join(directory, lockfile)
+            if not os.path.isfile(filename):
+                continue
+            with open(filename, 'rb') as f:
+                digest.update('\0%s\0%s' % (lockfile, f.read()))
+            found = True
+        return unicode(digest.hexdigest()) if found else None
+
+    def restore(self, directory):
+        """ PUBLIC: copies the cached paths into the build directory
+
+            returns a dict(path, key, hit, restore_time) for every path that
+            has lockfiles, which save takes back once they are installed
+        """
+        if not self.enabled:
+            return []
+
+        entries = []
+        for path in sorted(self.paths):
+            key = self.key(directory, path)
+            if key is None:
+                continue
+            start = time.time()
+            hit = self._restore(key, os.path.join(directory, path))
+            entries.append(dict(path=unicode(path), key=key, hit=hit,
+                                restore_time=time.time() - start))
+        return entries
+
+    def save(self, directory, entries):
+        """ PUBLIC: stores the paths that were not restored from the cache
+
+            @param entries is what restore returned for the build directory
+        """
+        if not self.enabled:
+            return
+        for entry in entries:
+            source = os.path.join(directory, entry['path'])
+            if entry['hit'] or not os.path.isdir(source):
+                continue
+            target = os.path.join(self.root, entry['key'])
+            staging = tempfile.mkdtemp(prefix='.%s-' % entry['key'], dir=self.root)
+            try:
+                shutil.copytree(source, os.path.join(staging, 'files'), symlinks=True)
+                if not os.path.exists(target):
+                    # renaming is atomic, so other builds never restore a
+                    # half copied entry
+                    os.rename(staging, target)
+            except (IOError, OSError, shutil.Error):
+                logger.exception("Could not cache %s.", entry['path'])
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """ PUBLIC: removes entries that are too old, then the least recently
+        used ones until the cache fits in DEPENDENCY_CACHE_MAX_SIZE
+
+            returns the keys of the entries that were removed
+        """
+        if not self.enabled:
+            return []
+
+        keys = [name for name in os.listdir(self.root) if not name.startswith('.')]
+        used = dict((key, os.path.getmtime(os.path.join(self.root, key))) for key in keys)
+        keys.sort(key=used.get)
+
+        removed = []
+        if self.max_age is not None:
+            removed = [key for key in keys if time.time() - used[key] > self.max_age]
+        if self.max_size is not None:
+            sizes = dict((key, disk_usage(os.path.join(self.root, key))) for key in keys)
+            total = sum(size for key, size in sizes.items() if key not in removed)
+            for key in keys:
+                if total <= self.max_size:
+                    break
+                if key not in removed:
+                    removed.append(key)
+                    total -= sizes[key]
+
+        for key in removed:
+            # moved out of the way first, so it is gone for restore at once
+            doomed = tempfile.mkdtemp(prefix='.%s-' % key, dir=self.root)
+            try:
+                os.rename(os.path.join(self.root, key), os.path.join(doomed, key))
+            except OSError:
+                pass
+            shutil.rmtree(doomed, ignore_errors=True)
+        return removed
+
+    def _restore(self, key, target):
+        """ PRIVATE: replaces target by the cached entry for key
+
+            returns True if there was one
+        """
+        entry = os.path.join(self.root, key)
+        if not os.path.isdir(entry):
+            return False
+        try:
+            os.utime(entry, None)
+            if os.path.lexists(target):
+                shutil.rmtree(target)
+            shutil.copytree(os.path.join(entry, 'files'), target, symlinks=True)
+        except (IOError, OSError, shutil.Error):
+            logger.exception("Could not restore %s from the cache.", target)
+            shutil.rmtree(target, ignore_errors=True)
+            return False
+        return True
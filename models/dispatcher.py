@@ -0,0 +1,131 @@
+"""
+The Dispatcher owns the pool of WorkerThreads that build the Builds in the
+BuildQueue.
+
+It is created once, when the Application Server starts, and keeps its
+WorkerThreads alive for the lifetime of the process. The Application Server
+only ever pushes a Build.id onto the BuildQueue and returns; one of the idle
+WorkerThreads, which are blocked on the BuildQueue, wakes up and builds it.
+
+CONFIGURATION:
+
+    WORKER_COUNT is the number of WorkerThreads in the pool (default 1).
+    WORKER_POLL_INTERVAL is how many seconds a WorkerThread waits on the
+    BuildQueue before checking whether it has been asked to stop (default 1).
+    GITHUB_NOTIFY_ASYNC (default True) makes the pool share a GitHubNotifier
+    that posts failures to Github in the background.
+    RESULT_WRITE_BATCHING (default False) makes the pool share a ResultWriter
+    that stores the results of builds in batches.
+"""
+
+import threading
+from build import connection
+from worker_thread import WorkerThread
+from coalescing_build_queue import coalesce_key
+from notifier import GitHubNotifier
+from result_writer import ResultWriter
+
+
+class Dispatcher(object):
+    """PUBLIC: Constructor for Dispatcher class
+
+        @param queue is the BuildQueue that the WorkerThreads pull from
+        @param configs is the configuration for the Rosie server
+    """
+    def __init__(self, queue, configs=dict(), connection=connection):
+        self.queue = queue
+        self.configs = configs
+        self.connection = connection
+        self.size = configs.get('WORKER_COUNT', 1)
+        self.workers = []
+        self.notifier = None
+        self.result_writer = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "<Dispatcher %d workers>" % len(self.workers)
+
+    def start(self):
+        """ PUBLIC: Starts the pool of WorkerThreads. Calling it on a
+        Dispatcher that is already running does nothing. """
+        with self.lock:
+            if self.workers:
+                return
+            if self.configs.get('GITHUB_NOTIFY_ASYNC', True):
+                self.notifier = GitHubNotifier(self.configs)
+                self.notifier.start()
+            if self.configs.get('RESULT_WRITE_BATCHING', False):
+                self.result_writer = ResultWriter(self.configs, self.connection)
+                self.result_writer.start()
+            for i in range(self.size):
+                worker = WorkerThread(self.queue, self.configs, self.connection,
+                                      persistent=True, notifier=self.notifier,
+                                      result_writer=self.result_writer)
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+
+    def stop(self, timeout=None):
+        """ PUBLIC: Asks every WorkerThread to stop once it has finished its
+        current build and waits for them to do so. """
+        with self.lock:
+            workers, self.workers = self.workers, []
+            notifier, self.notifier = self.notifier, None
+            result_writer, self.result_writer = self.result_writer, None
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join(timeout)
+        if notifier is not None:
+            notifier.stop()
+            notifier.join(timeout)
+        if result_writer is not None:
+            result_writer.stop()
+            result_writer.join(timeout)
+
+    def is_building(self):
+        """ PUBLIC: Whether any WorkerThread is processing a build """
+        return any(worker.is_building() for worker in self.workers)
+
+    def status(self):
+        """ PUBLIC: What /ping reports: whether the pool is building, the
+        Build.ids it is building, and where the builds of every repository
+        stand for queues that keep them per repository """
+        if not self.is_building():
+            status = dict(building=False)
+        else:
+            builds = [str(build['_id']) for build in self.current_builds()]
+            status = dict(building=True, builds=builds)
+
+        positions = getattr(self.queue, 'positions', None)
+        if positions is not None:
+            status['queue'] = dict(
+                (repo, dict(running=position['running'],
+                            queued=[str(id) for id in position['queued']]))
+                for repo, position in positions().items())
+        return status
+
+    def worker_states(self):
+        """ PUBLIC: How many WorkerThreads are busy building and idle """
+        busy = sum(1 for worker in self.workers if worker.is_building())
+        return dict(busy=busy, idle=len(self.workers) - busy)
+
+    def cancel_superseded(self, build):
+        """ PUBLIC: Cancels the builds of the same repository and ref as build
+        that are being built, because build supersedes them
+
+            @param build is the newer Build
+        """
+        key = coalesce_key(build)
+        for worker in self.workers:
+            current = worker.current_build
+            if current is not None and current['_id'] != build['_id'] \
+                    and coalesce_key(current) == key:
+                worker.cancel(current['_id'], build['_id'])
+
+    def current_builds(self):
+        """ PUBLIC: The Builds currently being built by the pool """
+        # current_build is read once per worker: a worker may finish between
+        # two reads of it
+        builds = [worker.current_build for worker in self.workers]
+        return [build for build in builds if build is not None]
@@ -0,0 +1,155 @@
+"""
+An in-process publish/subscribe of what happens to builds, so the CLI and the
+web frontend can follow builds live instead of polling /ping and
+/builds/<build_id>.
+
+The WorkerThreads publish an event when they take a build off the queue,
+when it moves to another stage and when it is finished; /build publishes one
+when a build is queued. An event is a dict:
+
+    {'seq': 12,                 # increasing within the process
+     'type': 'queued' | 'started' | 'stage' | 'finished',
+     'id': '50cd0a3f...',       # the Build.id
+     'status': 0,               # every event but 'stage'; None when the
+                                # build failed, was not found or was
+                                # finished elsewhere
+     'stage': 'test_command',   # 'stage' events, see timings.py
+     'time': 1355630707.2}
+
+Events are kept in memory only. Subscribers get the events published after
+they subscribed, those of the last 1000 events after the seq they ask to
+resume from (the Last-Event-ID of a reconnecting SSE client), and for
+the events of one build, the last event of that build first. Watching a
+build therefore costs no database reads at all; only builds handled by this
+process are seen.
+
+Handing an event to a subscriber never blocks: one that falls more than
+EVENTS_SUBSCRIBER_BUFFER events behind loses the oldest of them rather than
+holding up the WorkerThreads.
+"""
+
+from collections import deque, OrderedDict
+import threading
+import json
+import time
+
+class Subscription(object):
+    """PUBLIC: Constructor for Subscription, the events a subscriber has not
+    read yet
+
+        @param build_id is the Build.id (as a string) to get the events of,
+            None for the events of every build
+        @param size is how many unread events are kept
+    """
+    def __init__(self, build_id=None, size=1000):
+        self.build_id = build_id
+        self.events = deque(maxlen=size)
+        self.condition = threading.Condition()
+
+    def put(self, event):
+        """ PUBLIC: hands an event to the subscriber """
+        with self.condition:
+            self.events.append(event)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """ PUBLIC: the events published since the last call, waiting at most
+        timeout seconds for one; an empty list if none came """
+        with self.condition:
+            if not self.events:
+                self.condition.wait(timeout)
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+
+class EventBus(object):
+    """PUBLIC: Constructor for EventBus
+
+        @param backlog is how many of the latest events are kept for
+            subscribers that resume
+        @param recent is of how many builds the last event is kept
+    """
+    def __init__(self, backlog=1000, recent=1000):
+        self.seq = 0
+        self.backlog = deque(maxlen=backlog)
+        self.recent = recent
+        # Build.id -> its last event, least recently updated first
+        self.last = OrderedDict()
+        # Build.id (None for every build) -> subscribers
+        self.subscribers = dict()
+        self.lock = threading.Lock()
+
+    def publish(self, type, build_id, **fields):
+        """ PUBLIC: publishes an event about the build with Build.id build_id
+        to its subscribers and those of every build """
+        build_id = str(build_id)
+        with self.lock:
+            self.seq += 1
+            event = dict(fields, seq=self.seq, type=type, id=build_id, time=time.time())
+            self.backlog.append(event)
+            self.last.pop(build_id, None)
+            self.last[build_id] = event
+            while len(self.last) > self.recent:
+                self.last.popitem(last=False)
+            # under the lock, so that every subscriber gets events in order
+            for subscriber in self.subscribers.get(build_id, []) + \
+                    self.subscribers.get(None, []):
+                subscriber.put(event)
+        return event
+
+    def subscribe(self, subscriber, after=None):
+        """ PUBLIC: starts handing events to subscriber, a Subscription or
+        any object with its build_id and put(event)
+
+            @param after is the seq of the last event the subscriber got
+                before, to resume from; without it a subscriber to one build
+                first gets the last event of that build
+
+            returns the subscriber
+        """
+        with self.lock:
+            # under the lock, so that no newer event gets in before them
+            for event in self._missed(subscriber.build_id, after):
+                subscriber.put(event)
+            self.subscribers.setdefault(subscriber.build_id, []).append(subscriber)
+        return subscriber
+
+    def missed(self, build_id=None, after=None):
+        """ PUBLIC: the events a new subscriber gets first, see subscribe """
+        with self.lock:
+            return self._missed(build_id, after)
+
+    def unsubscribe(self, subscriber):
+        """ PUBLIC: stops handing events to subscriber """
+        with self.lock:
+            subscribers = self.subscribers.get(subscriber.build_id, [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self.subscribers.pop(subscriber.build_id, None)
+
+    def _missed(self, build_id, after):
+        if after is not None:
+            return [event for event in self.backlog if event['seq'] > after and
+                    build_id in (None, event['id'])]
+        elif build_id is not None and build_id in self.last:
+            return [self.last[build_id]]
+        return []
+
+    def last_event(self, build_id):
+        """ PUBLIC: the last event of a build, None if it was not seen """
+        with self.lock:
+            return self.last.get(str(build_id), None)
+
+    def watchers(self):
+        """ PUBLIC: how many subscribers there are """
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+def format_event(event):
+    """ PUBLIC: an event as a message of a text/event-stream """
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (event['seq'], event['type'], json.dumps(event))
+
+# the events of this process
+events = EventBus()
@@ -0,0 +1,386 @@
+"""
+The BuildExecutor class runs the commands that make up a build as
+subprocesses of the WorkerThread.
+
+A build is made of three steps, each of which is a line of bash taken from
+the configuration:
+
+    PRE_BUILD_HOOK      run first, for example to install dependencies
+    TEST_COMMAND        the test suite itself, e.g. `nosetests` or `rake test`
+    POST_BUILD_HOOK     always run last, whether the tests passed or not
+
+A step that is not configured is skipped. The build fails if any step exits
+with a non-zero status or cannot be started at all (say BUILD_DIRECTORY does
+not exist), and the test command is not run if the pre-build hook failed.
+
+Output (stdout and stderr together) is read from the subprocess as it is
+produced and written to a BuildLog, so it can be tailed while the build runs
+and is never held in memory as a whole.
+
+With TEST_SHARDS = N, the test command is run as N shards at the same time,
+each told which one it is by ROSIE_SHARD_INDEX (0 to N-1) and
+ROSIE_SHARD_TOTAL (N). With TEST_SHARD_FILES set to a glob pattern, such as
+'tests/*_test.py', the matching files are also dealt out over the shards;
+each shard gets its files in ROSIE_SHARD_FILES, and in place of {files} in
+the test command:
+
+    TEST_COMMAND = 'nosetests {files}'
+
+The output of the shards goes into the same log, every line prefixed with
+the shard it came from (a line longer than READ_SIZE bytes is split, so that
+output without newlines is not held in memory). The test command fails if any shard fails, and the
+exit status and duration of every shard are kept in BuildExecutor.shards.
+
+If DEPENDENCY_CACHE_ROOT is set, the dependencies the pre-build hook installs
+are restored from a DependencyCache (see dependency_cache.py) before the
+steps run, and stored in it once the pre-build hook passed.
+
+CONFIGURATION:
+
+    BUILD_DIRECTORY is the directory the steps are run in (default: the
+    current directory).
+    BUILD_TIMEOUT is the wall-clock limit in seconds for the pre-build hook
+    and the test command together (default: none). A build that runs over it
+    is killed and fails.
+    POST_BUILD_HOOK_TIMEOUT is the wall-clock limit in seconds of the
+    post-build hook, which runs even after the build timed out (default 300,
+    None for none).
+    BUILD_RLIMITS maps names of the resource module, such as 'RLIMIT_CPU' or
+    'RLIMIT_AS', to a limit (or a (soft, hard) pair) applied to every step.
+    TEST_SHARDS is how many shards the test command is split into (default 1,
+    no sharding), and TEST_SHARD_FILES the pattern of the test files to deal
+    out over them (default None).
+    BUILD_LOG_FLUSH_INTERVAL is how many seconds output may sit in the
+    BuildLog buffer before it is stored (default 1).
+"""
+
+import subprocess
+import pipes
+import glob
+import resource
+import select
+import signal
+import time
+import os
+
+from dependency_cache import DependencyCache
+
+# how many bytes of output are read at once, and the longest prefixed line
+READ_SIZE = 4096
+
+class BuildExecutor(object):
+    """PUBLIC: Constructor for BuildExecutor
+
+        @param configs is the configuration for the Rosie server
+        @param log is the BuildLog the output is written to
+        @param on_step is called with the name of every step as it starts
+    """
+    def __init__(self, configs, log, on_step=None):
+        self.configs = configs
+        self.log = log
+        self.on_step = on_step
+        self.directory = configs.get('BUILD_DIRECTORY', None)
+        self.timeout = configs.get('BUILD_TIMEOUT', None)
+        self.post_build_timeout = configs.get('POST_BUILD_HOOK_TIMEOUT', 300)
+        self.rlimits = configs.get('BUILD_RLIMITS', dict())
+        self.flush_interval = configs.get('BUILD_LOG_FLUSH_INTERVAL', 1)
+        self.shard_count = configs.get('TEST_SHARDS', 1)
+        self.shard_files = configs.get('TEST_SHARD_FILES', None)
+        self.processes = []
+        self.cancelled = False
+        # whether the last run was stopped by a timeout or a cancel rather
+        # than by its own steps
+        self.interrupted = False
+        self.dependency_cache = DependencyCache(configs)
+        # what the DependencyCache restored for the last run
+        self.dependencies = []
+        # dict(index, status, duration) for every shard of the last run
+        self.shards = []
+        # step name -> seconds it ran for in the last run
+        self.timings = dict()
+
+    def steps(self):
+        """ PUBLIC: the (name, command) pairs of the configured steps """
+        steps = [
+            ('pre-build hook', self.configs.get('PRE_BUILD_HOOK', None)),
+            ('test command', self.configs.get('TEST_COMMAND', None)),
+            ('post-build hook', self.configs.get('POST_BUILD_HOOK', None))
+        ]
+        return [(name, command) for name, command in steps if command]
+
+    def run(self, env=None, cwd=None, tests=None):
+        """ PUBLIC: runs all the steps
+
+            @param env is added to the environment of every step
+            @param cwd overrides BUILD_DIRECTORY
+            @param tests are the test files to run in place of those
+                matching TEST_SHARD_FILES (default None, run them all); with
+                none, the test command is skipped
+
+            returns True if the build passed, otherwise a string describing
+            the failure followed by the end of the output
+        """
+        environment = dict(os.environ)
+        environment.update(env or dict())
+        cwd = cwd or self.directory
+        deadline = self._deadline(self.timeout)
+
+        self.shards = []
+        self.timings = dict()
+        self.interrupted = False
+        self.dependencies = []
+        if cwd is not None:
+            self.dependencies = self.dependency_cache.restore(cwd)
+        elif self.dependency_cache.enabled:
+            # the steps run in the working directory of the Rosie server
+            # itself, which the cache must not replace directories in
+            self.log.write("The dependency cache needs BUILD_DIRECTORY or WORKSPACE_ROOT.\n")
+        for entry in self.dependencies:
+            if entry['hit']:
+                self.log.write("Restored %s from the dependency cache in %.2f seconds.\n"
+                               % (entry['path'], entry['restore_time']))
+            else:
+                self.log.write("%s is not in the dependency cache.\n" % entry['path'])
+
+        failure = None
+        for name, command in self.steps():
+            if self.cancelled:
+                self.interrupted = True
+                failure = "The build was cancelled."
+                break
+            if failure is not None and name != 'post-build hook':
+                continue
+            started = time.time()
+            if self.on_step is not None:
+                self.on_step(name)
+            if name == 'test command':
+                shards = self.shard_commands(command, environment, cwd, tests)
+                if not shards:
+                    self.log.write("No tests are affected by the changes.\n")
+                    continue
+                if len(shards) > 1:
+                    error = self.run_shards(name, shards, cwd, deadline)
+                else:
+                    error = self.run_step(name, shards[0][0], shards[0][1], cwd, deadline)
+            elif name == 'post-build hook':
+                # a deadline of its own, so it runs after a timeout too
+                error = self.run_step(name, command, environment, cwd,
+                                      self._deadline(self.post_build_timeout))
+            else:
+                error = self.run_step(name, command, environment, cwd, deadline)
+            self.timings[name] = time.time() - started
+            if error is None and name == 'pre-build hook' and cwd is not None:
+                self.dependency_cache.save(cwd, self.dependencies)
+            if failure is None:
+                failure = error
+
+        if failure is None:
+            return True
+        # the output may not be UTF-8 at all, and Build.error must be
+        return "%s\n%s" % (failure, self.log.tail.decode('utf-8', 'replace'))
+
+    def run_step(self, name, command, env, cwd, deadline):
+        """ PUBLIC: runs one step, streaming its output into the log
+
+            returns None if it passed, otherwise a description of the failure
+        """
+        self.log.write("$ %s\n" % command)
+        try:
+            timed_out, results = self._run_processes([(command, env, None)], cwd, deadline)
+        except Exception as e:
+            return self._not_started(name, e)
+        status, duration = results[0]
+
+        if self.cancelled or timed_out:
+            self.interrupted = True
+        if self.cancelled:
+            return "The build was cancelled."
+        if timed_out:
+            return "The %s timed out after %s seconds." % (name, self._timeout(name))
+        if status != 0:
+            return "The %s exited with status %d." % (name, status)
+        return None
+
+    def run_shards(self, name, shards, cwd, deadline):
+        """ PUBLIC: runs the shards of a step at the same time, streaming
+        their output into the log
+
+            @param shards are the (command, env) pairs from shard_commands
+
+            returns None if every shard passed, otherwise a description of
+            the first failure
+        """
+        total = len(shards)
+        commands = []
+        for index, (shard_command, shard_env) in enumerate(shards):
+            prefix = "[shard %d/%d] " % (index + 1, total)
+            self.log.write("%s$ %s\n" % (prefix, shard_command))
+            commands.append((shard_command, shard_env, prefix))
+        try:
+            timed_out, results = self._run_processes(commands, cwd, deadline)
+        except Exception as e:
+            return self._not_started(name, e)
+        self.shards = [dict(index=index, status=status, duration=duration)
+                       for index, (status, duration) in enumerate(results)]
+
+        if self.cancelled or timed_out:
+            self.interrupted = True
+        if self.cancelled:
+            return "The build was cancelled."
+        if timed_out:
+            return "The %s timed out after %s seconds." % (name, self._timeout(name))
+        for index, (status, duration) in enumerate(results):
+            if status != 0:
+                return "The %s exited with status %d in shard %d of %d." % (
+                    name, status, index + 1, total)
+        return None
+
+    def shard_commands(self, command, env, cwd, tests=None):
+        """ PUBLIC: the (command, env) of every shard of a command
+
+            @param tests are the test files to deal out, None for those
+                matching TEST_SHARD_FILES; with none, there are no shards
+        """
+        if tests is not None and not tests:
+            return []
+        total = self.shard_count
+        files = tests
+        if files is None and self.shard_files:
+            directory = cwd or os.getcwd()
+            files = sorted(os.path.relpath(path, directory) for path in
+                           glob.glob(os.path.join(directory, self.shard_files)))
+        if files is not None:
+            # no shard is left without files
+            total = max(1, min(total, len(files)))
+
+        shards = []
+        for index in range(total):
+            shard_command = command
+            shard_env = dict(env, ROSIE_SHARD_INDEX=str(index), ROSIE_SHARD_TOTAL=str(total))
+            if files is not None:
+                shard_files = files[index::total]
+                shard_env['ROSIE_SHARD_FILES'] = ' '.join(shard_files)
+                shard_command = command.replace('{files}', ' '.join(pipes.quote(path)
+                                                                    for path in shard_files))
+            shards.append((shard_command, shard_env))
+        return shards
+
+    def _deadline(self, timeout):
+        """ PRIVATE: when a step started now must be done, None for never """
+        return None if timeout is None else time.time() + timeout
+
+    def _timeout(self, name):
+        """ PRIVATE: the timeout the step called name runs under """
+        return self.post_build_timeout if name == 'post-build hook' else self.timeout
+
+    def _not_started(self, name, error):
+        """ PRIVATE: the failure of a step that could not be started """
+        self.log.write("%s\n" % error)
+        self.log.flush()
+        return "The %s could not be started: %s" % (name, error)
+
+    def cancel(self):
+        """ PUBLIC: stops the build, killing the step that is running """
+        self.cancelled = True
+        for process in self.processes:
+            self._kill(process)
+
+    def _run_processes(self, commands, cwd, deadline):
+        """ PRIVATE: runs commands at the same time, streaming their output
+        into the log
+
+            @param commands are (command, env, prefix) triples; every line of
+                the output of a command is prefixed with its prefix, unless it
+                is None
+
+            returns whether they were killed for running past the deadline,
+            and the (exit status, seconds) of every command; raises what
+            starting a command raised, once the commands already started
+            are killed
+        """
+        started = time.time()
+        self.processes = []
+        try:
+            for command, env, prefix in commands:
+                self.processes.append(subprocess.Popen(
+                    command, shell=True, cwd=cwd, env=env,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    close_fds=True, preexec_fn=self._prepare_child))
+        except Exception:
+            for process in self.processes:
+                self._kill(process)
+                process.communicate()
+            self.processes = []
+            raise
+        if self.cancelled:
+            for process in self.processes:
+                self._kill(process)
+        prefixes = [prefix for command, env, prefix in commands]
+        timed_out, ended = self._stream(self.processes, prefixes, deadline)
+        results = [(process.wait(), ended.get(index, time.time()) - started)
+                   for index, process in enumerate(self.processes)]
+        self.processes = []
+        self.log.flush()
+        return timed_out, results
+
+    def _stream(self, processes, prefixes, deadline):
+        """ PRIVATE: copies output into the log until every process closed it
+
+            returns whether the processes had to be killed for running past
+            the deadline, and when each process closed its output, by index
+        """
+        fds = dict((process.stdout.fileno(), index) for index, process in enumerate(processes))
+        # the last, unfinished line of every prefixed output
+        partial = dict((index, '') for index in fds.values())
+        ended = dict()
+        while len(ended) < len(processes):
+            wait = self.flush_interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    for process in processes:
+                        self._kill(process)
+                    return True, ended
+
+            open_fds = [fd for fd, index in fds.items() if index not in ended]
+            readable, _, _ = select.select(open_fds, [], [], wait)
+            for fd in readable:
+                index = fds[fd]
+                data = os.read(fd, READ_SIZE)
+                prefix = prefixes[index]
+                if not data:
+                    ended[index] = time.time()
+                    if prefix is not None and partial[index]:
+                        self.log.write("%s%s\n" % (prefix, partial[index]))
+                elif prefix is None:
+                    self.log.write(data)
+                else:
+                    lines = (partial[index] + data).split('\n')
+                    partial[index] = lines.pop()
+                    if len(partial[index]) >= READ_SIZE:
+                        lines.append(partial[index])
+                        partial[index] = ''
+                    if lines:
+                        self.log.write(''.join("%s%s\n" % (prefix, line) for line in lines))
+            if time.time() - self.log.flushed_at >= self.flush_interval:
+                self.log.flush()
+        return False, ended
+
+    def _kill(self, process):
+        """ PRIVATE: kills the step and everything it started """
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def _prepare_child(self):
+        """ PRIVATE: runs in the child before the command is executed.
+
+            Puts it in its own process group, so it can be killed along with
+            its children, and applies the resource limits.
+        """
+        os.setsid()
+        for name, limit in self.rlimits.items():
+            if not isinstance(limit, (tuple, list)):
+                limit = (limit, limit)
+            resource.setrlimit(getattr(resource, name), tuple(limit))
@@ -0,0 +1,144 @@
+"""
+The FairShareBuildQueue class is a BuildQueue that shares the WorkerThreads
+fairly between repositories.
+
+Instead of one first in, first out queue, it keeps a sub-queue of Build.ids
+for every repository (keyed on repository.url) and serves the repositories
+that have builds waiting in turn. Within a repository, builds are still built
+first in, first out, so a repository that queues dozens of builds only ever
+delays the others by one build per turn.
+
+    FAIR_SHARE_WEIGHTS maps a repository url to how many builds it gets per
+    turn (default 1, which is plain round-robin).
+    FAIR_SHARE_MAX_RUNNING maps a repository url to how many of its builds
+    may be built at the same time; FAIR_SHARE_DEFAULT_MAX_RUNNING applies to
+    the others (default None, no limit). While a repository is at its limit,
+    its builds are not handed out, and a WorkerThread waiting on the queue
+    keeps waiting until complete_build frees a slot.
+
+Builds added by Build.id alone share a sub-queue keyed on None. Like the
+BuildQueue, it relies on the standard Python Queue for all of the threading,
+and only replaces the hooks (_init, _qsize, _put and _get) that store the
+items.
+
+CONFIGURATION:
+
+    BUILD_QUEUE = 'fair' makes the Application Server use this queue.
+"""
+
+from collections import deque
+from build_queue import BuildQueue
+
+def repository_key(build):
+    """ PUBLIC: the repository a build is queued under """
+    if not isinstance(build, dict):
+        return None
+    return build.get('repository', dict()).get('url', None)
+
+
+class FairShareBuildQueue(BuildQueue):
+
+    """ Constructor for FairShareBuildQueue.
+
+        @param configs is the configuration for the Rosie server
+    """
+    def __init__(self, configs=dict()):
+        BuildQueue.__init__(self)
+        self.weights = configs.get('FAIR_SHARE_WEIGHTS', dict())
+        self.max_running = configs.get('FAIR_SHARE_MAX_RUNNING', dict())
+        self.default_max_running = configs.get('FAIR_SHARE_DEFAULT_MAX_RUNNING', None)
+
+    def __repr__(self):
+        return "<FairShareBuildQueue %s>" % dict((repo, list(ids))
+                                                 for repo, ids in self.queues.items())
+
+    def _init(self, maxsize):
+        # repository -> Build.ids waiting, oldest first
+        self.queues = dict()
+        # repositories with builds waiting, in the order they are served
+        self.rotation = deque()
+        # how many builds the repository at the head of rotation has been
+        # given this turn
+        self.served = 0
+        # repository -> builds handed out and not completed yet
+        self.running = dict()
+        # Build.id -> repositories it was handed out for
+        self.handed_out = dict()
+
+    def _limit(self, repo):
+        return self.max_running.get(repo, self.default_max_running)
+
+    def _eligible(self, repo):
+        limit = self._limit(repo)
+        return limit is None or self.running.get(repo, 0) < limit
+
+    def _qsize(self, len=len):
+        # only counts builds that may be handed out right now, so that
+        # next_build waits while every waiting repository is at its limit
+        return sum(len(ids) for repo, ids in self.queues.items() if self._eligible(repo))
+
+    def _put(self, item):
+        repo, build_id = item
+        if repo not in self.queues:
+            self.queues[repo] = deque()
+            self.rotation.append(repo)
+        self.queues[repo].append(build_id)
+
+    def _get(self):
+        while not self._eligible(self.rotation[0]):
+            self.rotation.rotate(-1)
+            self.served = 0
+
+        repo = self.rotation[0]
+        build_id = self.queues[repo].popleft()
+        self.running[repo] = self.running.get(repo, 0) + 1
+        self.handed_out.setdefault(build_id, []).append(repo)
+
+        self.served += 1
+        if not self.queues[repo]:
+            del self.queues[repo]
+            self.rotation.popleft()
+            self.served = 0
+        elif self.served >= self.weights.get(repo, 1):
+            self.rotation.rotate(-1)
+            self.served = 0
+        return build_id
+
+    """ PUBLIC: Add a build to the sub-queue of its repository.
+
+        @param build is the Build object (or Build.id) to be added
+        @param trigger is what queued the build, which is ignored
+    """
+    def add_build(self, build, trigger='webhook'):
+        return self.put(self._item(build, trigger))
+
+    def _item(self, build, trigger):
+        build_id = build['_id'] if isinstance(build, dict) else build
+        return (repository_key(build), build_id)
+
+    """ PUBLIC: Mark a dequeued build as finished, which frees a slot of its
+        repository.
+
+        @param build_id is the Build.id that was returned by next_build
+    """
+    def complete_build(self, build_id):
+        with self.mutex:
+            repos = self.handed_out.get(build_id, [])
+            if repos:
+                repo = repos.pop(0)
+                if not repos:
+                    del self.handed_out[build_id]
+                self.running[repo] -= 1
+                if self._qsize():
+                    self.not_empty.notify()
+        self.task_done()
+
+    def positions(self):
+        """ PUBLIC: for every repository, how many of its builds are running
+        and the Build.ids it has waiting, in the order they will be built """
+        with self.mutex:
+            repos = set(self.queues.keys()) | set(repo for repo, count in
+                                                  self.running.items() if count)
+            return dict((repo, dict(running=self.running.get(repo, 0),
+                                    queued=list(self.queues.get(repo, []))))
+                        for repo in repos)
@@ -0,0 +1,234 @@
+"""
+Metrics about the queue, the WorkerThreads, GitHub notifications and the
+HTTP API, which /metrics exposes in the Prometheus text format.
+
+Everything is kept in memory by the process: counters and histograms are
+updated as things happen, each under a lock of its own that is only held to
+add a number, and gauges are computed from in-memory state when they are
+scraped. A scrape never touches MongoDB.
+
+    rosie_queue_depth{repository}           builds queued, per repository
+    rosie_workers{state="busy"|"idle"}      WorkerThreads
+    rosie_queue_wait_seconds                from being queued to being built
+    rosie_build_duration_seconds            running the build steps
+    rosie_github_notify_seconds             from a failure to GitHub having it
+    rosie_http_requests_total{endpoint, method, status}
+    rosie_http_request_duration_seconds{endpoint}
+
+The queue depth and wait only know about builds queued by this process, so
+builds left in a MongoBuildQueue by an earlier process are not counted. The
+other way around, a build queued here is forgotten QUEUED_TTL seconds after
+it was queued if it was not started here, since with a MongoBuildQueue
+shared by several hosts it may well have been started by another one; the
+depth counts such builds until then, and the wait of a build started later
+still is not observed.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+# seconds a build queued by this process is counted as queued, at most
+QUEUED_TTL = 6 * 3600
+
+# seconds
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUILD_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+def format_labels(labels):
+    """ PUBLIC: labels as they appear in a sample, e.g. {a="1",b="2"} """
+    if not labels:
+        return ''
+    escaped = []
+    for name, value in sorted(labels.items()):
+        value = unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(u'%s="%s"' % (name, value))
+    return u'{%s}' % u','.join(escaped)
+
+
+class Counter(object):
+    """PUBLIC: Constructor for Counter
+
+        @param name and help describe the metric
+        @param labels are the names of the labels it is counted by
+    """
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = dict()
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """ PUBLIC: adds amount to the count for labels """
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        """ PUBLIC: the (name, labels, value) of every sample """
+        with self.lock:
+            values = self.values.items()
+        return [(self.name, dict(zip(self.labels, key)), value)
+                for key, value in sorted(values)]
+
+
+class Histogram(object):
+    """PUBLIC: Constructor for Histogram
+
+        @param name and help describe the metric
+        @param buckets are the upper bounds of the buckets, in increasing order
+        @param labels are the names of the labels it is observed by
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        # label values -> [count per bucket, sum, count]
+        self.values = dict()
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """ PUBLIC: records one observation for labels """
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self.lock:
+            counts = self.values.get(key, None)
+            if counts is None:
+                counts = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][index] += 1
+                    break
+            counts[1] += value
+            counts[2] += 1
+
+    def samples(self):
+        """ PUBLIC: the (name, labels, value) of every sample """
+        with self.lock:
+            values = [(key, (list(buckets), total, count))
+                      for key, (buckets, total, count) in self.values.items()]
+
+        samples = []
+        for key, (buckets, total, count) in sorted(values):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, buckets):
+                cumulative += bucket
+                samples.append((self.name + '_bucket', dict(labels, le=repr(float(bound))),
+                                cumulative))
+            samples.append((self.name + '_bucket', dict(labels, le='+Inf'), count))
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, count))
+        return samples
+
+
+class Gauge(object):
+    """PUBLIC: Constructor for Gauge
+
+        @param name and help describe the metric
+        @param collect is called on every scrape, and returns the (labels,
+            value) of every sample
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, collect):
+        self.name = name
+        self.help = help
+        self.collect = collect
+
+    def samples(self):
+        """ PUBLIC: the (name, labels, value) of every sample """
+        return [(self.name, labels, value) for labels, value in self.collect()]
+
+
+class Metrics(object):
+    """ PUBLIC: Constructor for Metrics, the metrics of one Rosie process """
+    def __init__(self):
+        self.queue_wait = Histogram('rosie_queue_wait_seconds',
+                                    "Seconds from a build being queued to being built.",
+                                    BUILD_BUCKETS)
+        self.build_duration = Histogram('rosie_build_duration_seconds',
+                                        "Seconds it took to run the steps of a build.",
+                                        BUILD_BUCKETS)
+        self.notify_latency = Histogram('rosie_github_notify_seconds',
+                                        "Seconds from a build failing to GitHub being told.",
+                                        REQUEST_BUCKETS)
+        self.requests = Counter('rosie_http_requests_total', "HTTP requests handled.",
+                                ('endpoint', 'method', 'status'))
+        self.request_latency = Histogram('rosie_http_request_duration_seconds',
+                                         "Seconds it took to handle an HTTP request.",
+                                         REQUEST_BUCKETS, ('endpoint',))
+        self.metrics = [
+            Gauge('rosie_queue_depth', "Builds waiting in the queue, per repository.",
+                  self._queue_depths),
+            self.queue_wait,
+            self.build_duration,
+            self.notify_latency,
+            self.requests,
+            self.request_latency
+        ]
+        # Build.id -> (repository url, when it was queued), oldest first
+        self.queued = OrderedDict()
+        self.lock = threading.Lock()
+
+    def gauge(self, name, help, collect):
+        """ PUBLIC: adds a Gauge computed by collect on every scrape """
+        self.metrics.append(Gauge(name, help, collect))
+
+    def build_queued(self, build):
+        """ PUBLIC: records that a build was put on the queue """
+        repository = build.get('repository', dict()).get('url', None)
+        now = time.time()
+        with self.lock:
+            self.queued.pop(build['_id'], None)
+            self.queued[build['_id']] = (repository, now)
+            self._expire(now)
+
+    def build_started(self, build_id):
+        """ PUBLIC: records that a WorkerThread started on a queued build """
+        with self.lock:
+            queued = self.queued.pop(build_id, None)
+        if queued is not None:
+            self.queue_wait.observe(time.time() - queued[1])
+
+    def build_dropped(self, build_id):
+        """ PUBLIC: records that a queued build will not be built """
+        with self.lock:
+            self.queued.pop(build_id, None)
+
+    def render(self):
+        """ PUBLIC: all metrics in the Prometheus text format """
+        lines = []
+        for metric in self.metrics:
+            lines.append(u'# HELP %s %s' % (metric.name, metric.help))
+            lines.append(u'# TYPE %s %s' % (metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append(u'%s%s %s' % (name, format_labels(labels), repr(float(value))))
+        return u'\n'.join(lines) + u'\n'
+
+    def _expire(self, now):
+        """ PRIVATE: forgets the builds queued more than QUEUED_TTL seconds
+        ago, the lock must be held """
+        while self.queued:
+            build_id, (repository, queued_at) = next(self.queued.iteritems())
+            if now - queued_at < QUEUED_TTL:
+                break
+            del self.queued[build_id]
+
+    def _queue_depths(self):
+        with self.lock:
+            self._expire(time.time())
+            repositories = [repository for repository, queued_at in self.queued.values()]
+        depths = dict()
+        for repository in repositories:
+            depths[repository] = depths.get(repository, 0) + 1
+        return [(dict(repository=repository or ''), depth)
+                for repository, depth in sorted(depths.items())]
+
+# the metrics of this process
+metrics = Metrics()
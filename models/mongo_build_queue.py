@@ -0,0 +1,253 @@
+"""
+The MongoBuildQueue class is a durable alternative to the in memory BuildQueue.
+
+Instead of a Python Queue, the Build.ids are stored as jobs in a MongoDB
+collection, so queued builds survive a restart of the Application Server and
+any number of Application Servers and WorkerThreads, on any number of hosts,
+can share one queue. It exposes the same interface as the BuildQueue:
+
+    add_build(build)
+    add_builds(builds)
+    next_build(block=False, timeout=None)
+    next_builds(count, block=False, timeout=None)
+    complete_build(build_id)
+    has_builds()
+
+A job document looks like this:
+
+    {
+        'build_id': ObjectId,       # the Build.id to be built
+        'state': 'queued' or 'claimed',
+        'enqueued_at': datetime,
+        'owner': unicode,           # which queue instance claimed it
+        'lease_expires': datetime,  # when the claim runs out
+        'attempts': int             # how many times it has been claimed
+    }
+
+CLAIMING:
+
+    next_build claims the oldest job that is queued, or claimed with an expired
+    lease, with a single find-and-modify, so two workers can never claim the
+    same job. While a job is claimed, a heartbeat thread keeps extending the
+    lease of every job held by this queue instance. If the process dies the
+    heartbeats stop, the lease expires after BUILD_QUEUE_LEASE seconds and the
+    job is handed to the next worker that asks for one. complete_build removes
+    the job once it has been built.
+
+    A job whose lease ran out BUILD_QUEUE_MAX_ATTEMPTS times is not handed out
+    again, since its build brings down every worker that claims it: the
+    heartbeat removes the job and marks the build as failed. The heartbeat
+    logs the errors of MongoDB, such as a failover, and carries on; stop()
+    ends it.
+
+CONFIGURATION:
+
+    BUILD_QUEUE = 'mongo' makes the Application Server use this queue.
+    BUILD_QUEUE_COLLECTION is the collection of the rosie database that stores
+    the jobs (default 'build_queue').
+    BUILD_QUEUE_LEASE is the visibility timeout of a claim in seconds
+    (default 60).
+    BUILD_QUEUE_POLL_INTERVAL is how many seconds a blocked next_build waits
+    between claim attempts (default 0.5).
+    BUILD_QUEUE_MAX_ATTEMPTS is how many times a job is claimed before its
+    build is given up on (default 5).
+"""
+
+from Queue import Empty
+from datetime import datetime, timedelta
+import threading
+import logging
+import socket
+import time
+import os
+import uuid
+
+from build import connection
+
+logger = logging.getLogger(__name__)
+
+class MongoBuildQueue(object):
+    """PUBLIC: Constructor for MongoBuildQueue
+
+        @param configs is the configuration for the Rosie server
+        @param connection is the mongokit connection the jobs are stored with
+    """
+    def __init__(self, configs=dict(), connection=connection):
+        name = configs.get('BUILD_QUEUE_COLLECTION', 'build_queue')
+        self.collection = connection.rosie[name]
+        self.connection = connection
+        self.lease = configs.get('BUILD_QUEUE_LEASE', 60)
+        self.max_attempts = configs.get('BUILD_QUEUE_MAX_ATTEMPTS', 5)
+        self.poll_interval = configs.get('BUILD_QUEUE_POLL_INTERVAL', 0.5)
+        self.owner = u"%s:%d:%s" % (socket.gethostname(), os.getpid(),
+                                    uuid.uuid4().hex[:8])
+
+        # Build.id -> ids of the jobs this instance has claimed for it
+        self.claims = dict()
+        self.lock = threading.Lock()
+
+        self.collection.ensure_index([('state', 1), ('enqueued_at', 1)])
+        self.collection.ensure_index([('state', 1), ('lease_expires', 1)])
+
+        self.stopped = threading.Event()
+        self.heartbeat = threading.Thread(target=self._heartbeat)
+        self.heartbeat.daemon = True
+        self.heartbeat.start()
+
+    def __repr__(self):
+        return "<MongoBuildQueue %s>" % self.collection.full_name
+
+    """ PUBLIC: Stop the heartbeat; the leases this instance holds run out
+    after BUILD_QUEUE_LEASE seconds """
+    def stop(self):
+        self.stopped.set()
+
+    """ PUBLIC: Check whether there are any builds waiting to be claimed """
+    def has_builds(self):
+        return self.collection.find_one(self._claimable(), fields=['_id']) is not None
+
+    """ PUBLIC: Claim the Build.id of the next build.
+
+    Raises Queue.Empty if there is nothing to claim, after waiting at most
+    timeout seconds if block is True.
+    """
+    def next_build(self, block=False, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            job = self._claim()
+            if job is not None:
+                return job['build_id']
+            if not block or (deadline is not None and time.time() >= deadline):
+                raise Empty
+            time.sleep(self.poll_interval)
+
+    """ PUBLIC: Claim the Build.ids of up to count builds at once.
+
+    Waits for the first one like next_build does, then claims whatever else
+    can be claimed without waiting. Every job is claimed atomically.
+    """
+    def next_builds(self, count, block=False, timeout=None):
+        builds = [self.next_build(block, timeout)]
+        while len(builds) < count:
+            try:
+                builds.append(self.next_build())
+            except Empty:
+                break
+        return builds
+
+    """ PUBLIC: Add a build to the MongoBuildQueue. Accepts a Build object
+        or a Build.id.
+
+        @param build is the Build object to be added to the MongoBuildQueue
+        @param trigger is what queued the build, which is ignored
+    """
+    def add_build(self, build, trigger='webhook'):
+        self.add_builds([build], trigger)
+
+    """ PUBLIC: Add several builds to the MongoBuildQueue with one insert.
+
+        @param builds are the Build objects (or Build.ids) to be added
+        @param trigger is what queued the builds, which is ignored
+    """
+    def add_builds(self, builds, trigger='webhook'):
+        now = datetime.utcnow()
+        jobs = [dict(
+            build_id=build['_id'] if isinstance(build, dict) else build,
+            state=u'queued',
+            enqueued_at=now,
+            owner=None,
+            lease_expires=None,
+            attempts=0
+        ) for build in builds]
+        if jobs:
+            self.collection.insert(jobs)
+
+    """ PUBLIC: Mark a claimed build as finished, which removes its job.
+
+        @param build_id is the Build.id that was returned by next_build
+    """
+    def complete_build(self, build_id):
+        with self.lock:
+            jobs = self.claims.get(build_id, [])
+            if not jobs:
+                return
+            job_id = jobs.pop(0)
+            if not jobs:
+                del self.claims[build_id]
+        self.collection.remove({'_id': job_id, 'owner': self.owner})
+
+    def _claimable(self):
+        """ PRIVATE: query matching jobs that may be claimed right now """
+        return {'$or': [
+            {'state': u'queued'},
+            {'state': u'claimed', 'lease_expires': {'$lt': datetime.utcnow()},
+             'attempts': {'$lt': self.max_attempts}}
+        ]}
+
+    def _claim(self):
+        """ PRIVATE: atomically claims the oldest claimable job, or None """
+        job = self.collection.find_and_modify(
+            query=self._claimable(),
+            update={
+                '$set': {
+                    'state': u'claimed',
+                    'owner': self.owner,
+                    'lease_expires': datetime.utcnow() + timedelta(seconds=self.lease)
+                },
+                '$inc': {'attempts': 1}
+            },
+            sort=[('enqueued_at', 1), ('_id', 1)],
+            new=True
+        )
+        if job is not None:
+            with self.lock:
+                self.claims.setdefault(job['build_id'], []).append(job['_id'])
+        return job
+
+    def _heartbeat(self):
+        """ PRIVATE: keeps extending the leases held by this instance, and
+        gives up on the jobs no worker could finish, until stopped """
+        while not self.stopped.wait(self.lease / 3.0):
+            try:
+                self._renew()
+                self._bury()
+            except Exception:
+                # the leases are renewed again on the next beat, which is
+                # well before they run out
+                logger.exception("The heartbeat of %s failed.", self.owner)
+
+    def _renew(self):
+        """ PRIVATE: extends the leases held by this instance """
+        with self.lock:
+            job_ids = [j for jobs in self.claims.values() for j in jobs]
+        if job_ids:
+            self.collection.update(
+                {'_id': {'$in': job_ids}, 'owner': self.owner},
+                {'$set': {'lease_expires': datetime.utcnow() + timedelta(seconds=self.lease)}},
+                multi=True
+            )
+
+    def _bury(self):
+        """ PRIVATE: removes the jobs whose lease ran out max_attempts times,
+        and fails their builds
+
+            returns the Build.ids that were given up on
+        """
+        buried = []
+        while True:
+            job = self.collection.find_and_modify(
+                query={'state': u'claimed', 'lease_expires': {'$lt': datetime.utcnow()},
+                       'attempts': {'$gte': self.max_attempts}},
+                remove=True
+            )
+            if not job:
+                return buried
+            logger.error("Build %s was given up on after %d attempts.",
+                         job['build_id'], job['attempts'])
+            self.connection.Build.collection.update(
+                {'_id': job['build_id'], 'status': 0},
+                {'$set': {'status': 2, 'error': u"The build was given up on: none of the "
+                                                u"%d workers that claimed it finished it."
+                                                % job['attempts']}}
+            )
+            buried.append(job['build_id'])
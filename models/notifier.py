@@ -0,0 +1,186 @@
+"""
+The GitHubNotifier class posts build failures to GitHub from its own thread,
+so that a slow or rate limited GitHub never holds up the WorkerThreads.
+
+WorkerThreads hand failed builds to GitHubNotifier.notify, which only puts
+them on the notifier's delivery queue and returns. The notifier thread then
+delivers them one at a time:
+
+    The first failure on a ref opens an issue, and later failures on the same
+    ref are posted as comments on that issue. Failures on a ref that arrive
+    while an earlier one is still waiting to be delivered are merged into it,
+    so a burst of failures turns into a single update.
+
+    Every request goes through one requests session, so the connection to
+    GitHub is kept alive between deliveries.
+
+    A request that fails to connect, gets a 5xx response, or is refused
+    because of a rate limit (a 429, or a 403 that says so) is retried up to
+    GITHUB_NOTIFY_RETRIES times, waiting GITHUB_NOTIFY_BACKOFF seconds, then
+    twice as long each time. When GitHub says the rate limit is
+    used up (X-RateLimit-Remaining: 0) the notifier waits until
+    X-RateLimit-Reset, or for Retry-After seconds if given, before sending
+    anything else.
+
+CONFIGURATION:
+
+    GITHUB_ID and GITHUB_SECRET are the OAuth application credentials; without
+    them nothing is delivered.
+    GITHUB_API_URL is the root of the GitHub API (default
+    'https://api.github.com'), which tests point at a local HTTP server.
+    GITHUB_NOTIFY_ASYNC = False makes WorkerThreads post synchronously
+    instead of using a GitHubNotifier.
+"""
+
+from Queue import Queue, Empty
+import threading
+import logging
+import json
+import time
+
+import requests
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+def notification_key(build):
+    """ PUBLIC: failures with the same key are reported on the same issue """
+    return (build.repository.owner.name, build.repository.name, build.ref)
+
+
+class GitHubNotifier(threading.Thread):
+    """PUBLIC: Constructor for GitHubNotifier
+
+        @param configs is the configuration for the Rosie server
+    """
+    def __init__(self, configs=dict()):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.github_id = configs.get('GITHUB_ID', None)
+        self.github_secret = configs.get('GITHUB_SECRET', None)
+        self.api_url = configs.get('GITHUB_API_URL', 'https://api.github.com').rstrip('/')
+        self.retries = configs.get('GITHUB_NOTIFY_RETRIES', 5)
+        self.backoff = configs.get('GITHUB_NOTIFY_BACKOFF', 1)
+
+        self.session = requests.session()
+        # keys waiting to be delivered, in order
+        self.deliveries = Queue()
+        # key -> the failure waiting to be delivered for it
+        self.pending = dict()
+        # key -> number of the issue opened for it
+        self.issues = dict()
+        # time before which no request may be sent, because of rate limits
+        self.resume_at = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def notify(self, build):
+        """ PUBLIC: queues the failure of a build for delivery
+
+            returns False if there are no credentials to deliver it with
+        """
+        if not self.github_id or not self.github_secret:
+            return False
+
+        key = notification_key(build)
+        with self.lock:
+            failure = self.pending.get(key, None)
+            if failure is None:
+                self.pending[key] = dict(ref=build.ref, error=build['error'], count=1,
+                                         queued_at=time.time())
+                self.deliveries.put(key)
+            else:
+                failure['error'] = build['error']
+                failure['count'] += 1
+        return True
+
+    def stop(self):
+        """ PUBLIC: stops the notifier once the delivery in progress is done """
+        self.stopped.set()
+
+    def run(self):
+        """ PUBLIC: delivers queued failures until stopped """
+        while not self.stopped.is_set():
+            try:
+                key = self.deliveries.get(True, 1)
+            except Empty:
+                continue
+            with self.lock:
+                failure = self.pending.pop(key)
+            try:
+                self.deliver(key, failure)
+            except Exception:
+                logger.exception("Could not notify GitHub of a failure on %s.", key[2])
+            finally:
+                self.deliveries.task_done()
+
+    def deliver(self, key, failure):
+        """ PUBLIC: opens an issue for the failure, or comments on the issue
+        already opened for its ref
+
+            returns True if GitHub accepted it
+        """
+        owner, name, ref = key
+        body = failure['error']
+        if failure['count'] > 1:
+            body = "%d builds failed, the last one with:\n\n%s" % (failure['count'], body)
+
+        issue = self.issues.get(key, None)
+        if issue is None:
+            url = "/repos/%s/%s/issues" % (owner, name)
+            data = dict(title="Build failure on ref %s" % ref, body=body)
+        else:
+            url = "/repos/%s/%s/issues/%d/comments" % (owner, name, issue)
+            data = dict(body=body)
+
+        response = self._post(url, data)
+        if response is None or response.status_code >= 300:
+            return False
+        if issue is None:
+            self.issues[key] = json.loads(response.content)['number']
+        metrics.notify_latency.observe(time.time() - failure.get('queued_at', time.time()))
+        return True
+
+    def _post(self, path, data):
+        """ PRIVATE: posts to the GitHub API, retrying with exponential backoff
+
+            returns the last response, or None if GitHub could not be reached
+        """
+        url = "%s%s?client_id=%s&client_secret=%s" % (self.api_url, path,
+                                                        self.github_id, self.github_secret)
+        response = None
+        for attempt in range(self.retries + 1):
+            self._wait(self.resume_at - time.time())
+            try:
+                response = self.session.post(url, data=json.dumps(data),
+                                             headers={'Content-Type': 'application/json'})
+            except requests.exceptions.RequestException:
+                response = None
+            else:
+                limited = self._respect_rate_limit(response)
+                if response.status_code < 500 and not limited:
+                    return response
+
+            if attempt < self.retries:
+                self._wait(self.backoff * 2 ** attempt)
+        return response
+
+    def _respect_rate_limit(self, response):
+        """ PRIVATE: holds off further requests as GitHub asks
+
+            returns True if the request was refused because of a rate limit
+        """
+        headers = response.headers
+        exhausted = headers.get('x-ratelimit-remaining', None) == '0'
+        if headers.get('retry-after', None):
+            self.resume_at = time.time() + float(headers['retry-after'])
+        elif exhausted and headers.get('x-ratelimit-reset', None):
+            self.resume_at = float(headers['x-ratelimit-reset'])
+        return response.status_code == 429 or \
+            (response.status_code == 403 and (exhausted or 'retry-after' in headers))
+
+    def _wait(self, seconds):
+        """ PRIVATE: sleeps, unless the notifier is stopped """
+        if seconds > 0:
+            self.stopped.wait(seconds)
@@ -0,0 +1,82 @@
+"""
+The PriorityBuildQueue class is a BuildQueue that builds the most important
+builds first instead of the oldest.
+
+Every build is given a priority class when it is added, lowest first:
+
+    PRIORITY_REFS maps refs to a class, e.g. {'refs/heads/master': 0}, and
+    any other ref gets PRIORITY_DEFAULT_REF (default 2).
+    PRIORITY_TRIGGERS adds to it depending on what queued the build, e.g.
+    {'webhook': 0, 'rebuild': 1} puts manual rebuilds behind pushes.
+
+Within a class builds are built first in, first out. So that nothing starves,
+a build moves up one class for every PRIORITY_AGING seconds (default 300) it
+has waited. Since every queued build ages at the same rate, this does not
+need re-sorting: a build is ordered by
+
+    class * PRIORITY_AGING + the time it was added
+
+which is kept in a heap. Like the BuildQueue, it relies on the standard
+Python Queue for all of the threading, and only replaces the hooks (_init,
+_qsize, _put and _get) that store the items, in the same way as the standard
+PriorityQueue.
+
+CONFIGURATION:
+
+    BUILD_QUEUE = 'priority' makes the Application Server use this queue.
+"""
+
+from heapq import heappush, heappop
+import itertools
+import time
+
+from build_queue import BuildQueue
+
+
+class PriorityBuildQueue(BuildQueue):
+
+    """ Constructor for PriorityBuildQueue.
+
+        @param configs is the configuration for the Rosie server
+    """
+    def __init__(self, configs=dict()):
+        BuildQueue.__init__(self)
+        self.refs = configs.get('PRIORITY_REFS', {'refs/heads/master': 0})
+        self.default_ref = configs.get('PRIORITY_DEFAULT_REF', 2)
+        self.triggers = configs.get('PRIORITY_TRIGGERS', {'webhook': 0, 'rebuild': 1})
+        self.aging = configs.get('PRIORITY_AGING', 300)
+
+    def __repr__(self):
+        return "<PriorityBuildQueue %s>" % [item[-1] for item in sorted(self.queue)]
+
+    def _init(self, maxsize):
+        self.queue = []
+        # breaks ties between builds added at the same time
+        self.counter = itertools.count()
+
+    def _qsize(self, len=len):
+        return len(self.queue)
+
+    def _put(self, item):
+        heappush(self.queue, item)
+
+    def _get(self):
+        return heappop(self.queue)[-1]
+
+    def priority(self, build, trigger):
+        """ PUBLIC: the priority class of a build, lowest first """
+        ref = build.get('ref', None) if isinstance(build, dict) else None
+        return self.refs.get(ref, self.default_ref) + self.triggers.get(trigger, 0)
+
+    """ PUBLIC: Add a build to the PriorityBuildQueue.
+
+        @param build is the Build object (or Build.id) to be added
+        @param trigger is what queued the build, 'webhook' or 'rebuild'
+    """
+    def add_build(self, build, trigger='webhook'):
+        return self.put(self._item(build, trigger))
+
+    def _item(self, build, trigger):
+        build_id = build['_id'] if isinstance(build, dict) else build
+        order = self.priority(build, trigger) * self.aging + time.time()
+        return (order, next(self.counter), build_id)
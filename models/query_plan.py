@@ -0,0 +1,82 @@
+"""
+A debug mode that explains the queries the Application Server issues.
+
+With QUERY_EXPLAIN = True, every cursor passed to explain_query (and every
+aggregation passed to explain_aggregate) is explained by MongoDB before it is
+used, and the winning plan is logged. A plan that
+scans the whole collection (COLLSCAN, or a BasicCursor on MongoDB 2.x) is
+logged as a warning, and with QUERY_EXPLAIN_STRICT = True it raises a
+QueryPlanException instead, so that tests fail when a query stops using an
+index.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+class QueryPlanException(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+def winning_plan(plan):
+    """ PUBLIC: the part of an explain() result describing the chosen plan,
+    without the candidate plans that were rejected """
+    if 'queryPlanner' in plan:
+        return plan['queryPlanner']['winningPlan']
+    if 'stages' in plan:
+        # an aggregation: the plan of the query that feeds its first stage
+        for stage in plan['stages']:
+            if '$cursor' in stage:
+                return winning_plan(stage['$cursor'].get('plan', stage['$cursor']))
+        return plan
+    return dict((key, value) for key, value in plan.items()
+                if key not in ('allPlans', 'oldPlan'))
+
+def is_collection_scan(plan):
+    """ PUBLIC: whether a (winning) plan scans a whole collection """
+    if isinstance(plan, dict):
+        if plan.get('stage', None) == 'COLLSCAN':
+            return True
+        if unicode(plan.get('cursor', '')).startswith('BasicCursor'):
+            return True
+        return any(is_collection_scan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(is_collection_scan(value) for value in plan)
+    return False
+
+def explain_query(name, cursor, configs=dict()):
+    """ PUBLIC: explains cursor if QUERY_EXPLAIN is set, then returns it
+
+        @param name describes the query in the log
+        @param cursor is a pymongo or mongokit cursor that has not been read
+    """
+    if not configs.get('QUERY_EXPLAIN', False):
+        return cursor
+
+    _audit(name, winning_plan(cursor.clone().explain()), configs)
+    return cursor
+
+def explain_aggregate(name, collection, pipeline, configs=dict()):
+    """ PUBLIC: explains an aggregation of collection if QUERY_EXPLAIN is set,
+    like explain_query does for a cursor
+
+        @param pipeline is the pipeline that is about to be run
+    """
+    if not configs.get('QUERY_EXPLAIN', False):
+        return
+
+    plan = collection.database.command('aggregate', collection.name,
+                                       pipeline=pipeline, explain=True)
+    _audit(name, winning_plan(plan), configs)
+
+def _audit(name, plan, configs):
+    """ PRIVATE: logs a winning plan, or raises if it scans the collection
+    and QUERY_EXPLAIN_STRICT is set """
+    if is_collection_scan(plan):
+        if configs.get('QUERY_EXPLAIN_STRICT', False):
+            raise QueryPlanException("Query %s scans the whole collection." % name)
+        logger.warning("Query %s scans the whole collection: %r", name, plan)
+    else:
+        logger.info("Query %s: %r", name, plan)
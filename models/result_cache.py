@@ -0,0 +1,103 @@
+"""
+The ResultCache class remembers the result of every build by commit and by
+build configuration, so that a commit that has already been built with the
+same configuration is not built again.
+
+The key of a build is the commit id at the end of its url together with a
+hash of the settings that decide what a build does (the hooks, the test
+command and the limits it runs under). A cached result looks like this:
+
+    {
+        '_id': unicode,         # '<commit id>:<settings hash>'
+        'build_id': ObjectId,   # the build that produced the result
+        'status': 1 or 2,
+        'error': unicode
+    }
+
+The WorkerThread looks a build up before building it. On a hit, the build
+gets the cached status and error, and cached_from is set to the Build.id of
+the original build, without anything being run. A build with force set (as
+every rebuild is) is always built, and its result replaces the cached one.
+
+Only results that building the commit again would give again are stored:
+those of builds that ran the whole test suite to the end. A build that timed
+out, was cancelled or could not be checked out, and one that only ran the
+tests selected by TEST_SELECTION, is not cached.
+
+CONFIGURATION:
+
+    RESULT_CACHE = False turns the cache off (default True).
+    RESULT_CACHE_SETTINGS lists the settings that are part of the key.
+"""
+
+import hashlib
+import json
+
+from build import connection
+
+CACHED_SETTINGS = [
+    'PRE_BUILD_HOOK',
+    'TEST_COMMAND',
+    'POST_BUILD_HOOK',
+    'BUILD_DIRECTORY',
+    'BUILD_TIMEOUT',
+    'BUILD_RLIMITS',
+    'TEST_SHARDS',
+    'TEST_SHARD_FILES',
+    'TEST_SELECTION',
+    'TEST_SELECTION_RULES',
+    'TEST_SELECTION_COVERAGE',
+    'TEST_SELECTION_FULL_RUN_EVERY'
+]
+
+def commit_id(build):
+    """ PUBLIC: the commit id at the end of the url of a build, or None """
+    url = build.get('url', None)
+    if not isinstance(url, basestring) or '/commit/' not in url:
+        return None
+    return url.rstrip('/').rsplit('/', 1)[-1] or None
+
+
+class ResultCache(object):
+    """PUBLIC: Constructor for ResultCache
+
+        @param configs is the configuration for the Rosie server
+        @param connection is the mongokit connection results are stored with
+    """
+    def __init__(self, configs=dict(), connection=connection):
+        self.enabled = configs.get('RESULT_CACHE', True)
+        self.collection = connection.rosie[configs.get('RESULT_CACHE_COLLECTION',
+                                                       'build_results')]
+        settings = configs.get('RESULT_CACHE_SETTINGS', CACHED_SETTINGS)
+        settings = json.dumps(dict((name, configs.get(name, None)) for name in settings),
+                              sort_keys=True)
+        self.settings_hash = hashlib.sha1(settings).hexdigest()
+
+    def key(self, build):
+        """ PUBLIC: the key of a build, None if it cannot be cached """
+        commit = commit_id(build)
+        if commit is None:
+            return None
+        return u"%s:%s" % (commit, self.settings_hash)
+
+    def lookup(self, build):
+        """ PUBLIC: the cached result for build, None on a miss """
+        key = self.key(build)
+        if not self.enabled or key is None or build.get('force', False):
+            return None
+        return self.collection.find_one({'_id': key})
+
+    def store(self, build, interrupted=False):
+        """ PUBLIC: caches the result of a finished build
+
+            @param interrupted is whether the build was stopped by something
+                other than its own steps (a timeout, a cancel or a failed
+                checkout), so that its result may not be the commit's
+        """
+        key = self.key(build)
+        if not self.enabled or key is None or build['status'] not in (1, 2):
+            return
+        if interrupted or build.get('full_run', True) is False:
+            return
+        self.collection.save(dict(_id=key, build_id=build['_id'],
+                                  status=build['status'], error=build['error']))
@@ -0,0 +1,148 @@
+"""
+The ResultWriter batches the status transitions of the WorkerThreads of a
+Dispatcher into as few writes as possible.
+
+Without it every WorkerThread stores the result of a build with a write of
+its own (see save_result in build.py). With RESULT_WRITE_BATCHING, the
+WorkerThreads hand their results to the one ResultWriter of the Dispatcher
+and wait: the ResultWriter takes the first one, gathers whatever else comes
+in within RESULT_WRITE_WINDOW seconds, and stores all of them with a single
+update command of MongoDB (2.6 or later), then tells every WorkerThread
+whether its result was stored.
+
+Like save_result, every update is a compare-and-set from status 0, so a
+WorkerThread that lost a race for a build (another worker finished it, or it
+was superseded) finds out. The update command only says how many of the
+updates matched, so each one also sets result_token to a token of its own;
+if fewer matched than were sent, one query of the tokens tells the winners
+from the losers.
+
+When the update command fails, the ResultWriter stores the results of the
+batch one at a time with save_result instead, and a result that cannot be
+stored at all raises in its WorkerThread, as it would without batching. A
+WorkerThread whose result the stopped ResultWriter never got to stores it
+itself.
+
+CONFIGURATION:
+
+    RESULT_WRITE_BATCHING (default False) turns the ResultWriter on.
+    RESULT_WRITE_WINDOW is how many seconds the ResultWriter waits for more
+    results after the first one (default 0.005).
+    RESULT_WRITE_BATCH_SIZE is the most results written at once (default 100).
+"""
+
+from Queue import Queue, Empty
+import threading
+import logging
+import time
+
+from bson.son import SON
+from build import connection, result_update, save_result, RESULT_FIELDS
+from mongokit import ObjectId
+
+logger = logging.getLogger(__name__)
+
+class ResultWriter(threading.Thread):
+    """PUBLIC: Constructor for ResultWriter
+
+        @param configs is the configuration for the Rosie server
+        @param connection is the mongokit connection results are stored with
+    """
+    def __init__(self, configs=dict(), connection=connection):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.connection = connection
+        self.window = configs.get('RESULT_WRITE_WINDOW', 0.005)
+        self.batch_size = configs.get('RESULT_WRITE_BATCH_SIZE', 100)
+        # [build, fields, token, stored, threading.Event] of results waiting;
+        # stored is what storing raised, if it failed
+        self.pending = Queue()
+        self.stopped = threading.Event()
+
+    def save(self, build, fields=RESULT_FIELDS):
+        """ PUBLIC: stores the result of a build along with whatever other
+        results come in at the same time, and waits for it to be written
+
+            returns whether the result was stored, like save_result
+        """
+        result = [build, fields, ObjectId(), False, threading.Event()]
+        self.pending.put(result)
+        while not result[4].wait(1):
+            # a writer that has stopped will never get to it
+            if self.stopped.is_set() and not self.is_alive():
+                self.write_each([result])
+                break
+        if isinstance(result[3], Exception):
+            raise result[3]
+        return result[3]
+
+    def stop(self):
+        """ PUBLIC: stops the writer once the batch in progress is written """
+        self.stopped.set()
+
+    def run(self):
+        """ PUBLIC: writes batches of results until stopped """
+        while not self.stopped.is_set():
+            try:
+                batch = [self.pending.get(True, 1)]
+            except Empty:
+                continue
+            deadline = time.time() + self.window
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get(True, max(0, deadline - time.time())))
+                except Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception:
+                logger.exception("Could not store the results of %d builds at once; "
+                                 "storing them one at a time.", len(batch))
+                self.write_each(batch)
+            finally:
+                for result in batch:
+                    result[4].set()
+
+    def write(self, batch):
+        """ PUBLIC: stores a batch of results with one update command, and
+        marks the ones that were stored """
+        collection = self.connection.Build.collection
+        updates = []
+        for result in batch:
+            build, fields, token = result[:3]
+            update = result_update(build, fields)
+            update['$set']['result_token'] = token
+            updates.append(dict(q={'_id': build['_id'], 'status': 0}, u=update,
+                                multi=False, upsert=False))
+
+        response = collection.database.command(SON([
+            ('update', collection.name),
+            ('updates', updates),
+            ('ordered', False)
+        ]))
+        if response.get('n', 0) == len(batch):
+            for result in batch:
+                result[3] = True
+            return
+
+        # some lost the race; the tokens that were stored tell which
+        tokens = set(document.get('result_token', None) for document in
+                     collection.find({'_id': {'$in': [result[0]['_id'] for result in batch]}},
+                                     fields=['result_token']))
+        for result in batch:
+            result[3] = result[2] in tokens
+
+    def write_each(self, batch):
+        """ PUBLIC: stores a batch of results one at a time with save_result,
+        and marks the ones that were stored. A result a failed update command
+        stored anyway is found by its token. """
+        collection = self.connection.Build.collection
+        for result in batch:
+            build, fields, token = result[:3]
+            try:
+                result[3] = save_result(build, fields, connection=self.connection) or \
+                    collection.find_one({'_id': build['_id'], 'result_token': token},
+                                        fields=['_id']) is not None
+            except Exception as error:
+                logger.exception("Could not store the result of build %s.", build['_id'])
+                result[3] = error
@@ -0,0 +1,169 @@
+"""
+The TestSelector class decides which tests a build has to run, from the
+paths that changed since the last successful build of its ref.
+
+The changed paths are what `git diff --name-only` gives between the commit
+of that build and the checkout of this one (so it needs WORKSPACE_ROOT).
+Each changed path is mapped to the tests it affects by, in order:
+
+    TEST_SELECTION_RULES, a list of (pattern, tests) pairs. pattern is a
+    regular expression the whole path has to match, and tests a glob pattern
+    of test files that may use its groups, or None if the path affects no
+    tests at all:
+
+        TEST_SELECTION_RULES = [
+            (r'tests/.*_test\.py', r'\g<0>'),
+            (r'models/(.*)\.py', r'tests/\1_test.py'),
+            (r'(docs/.*|.*\.md)', None)
+        ]
+
+    TEST_SELECTION_COVERAGE, a JSON file in the checkout that maps each test
+    file to the paths it covers, as recorded by a coverage run.
+
+The build runs the tests affected by any changed path, in place of {files}
+in the test command (see executor.py). All tests are run instead when:
+
+    the test command has no {files}, so it would run them all anyway,
+    a changed path is matched by neither, since what it affects is unknown,
+    the ref has no successful build yet, or its commit cannot be diffed with,
+    or none of the last TEST_SELECTION_FULL_RUN_EVERY - 1 finished builds
+    of the ref ran all tests, which is the safety net for whatever the rules
+    and the coverage map miss.
+
+Which tests a build ran is stored on it in full_run and selected_tests.
+
+CONFIGURATION:
+
+    TEST_SELECTION = True turns test selection on (default False).
+    TEST_SELECTION_FULL_RUN_EVERY (default 20); None never forces a full run.
+"""
+
+import subprocess
+import logging
+import json
+import glob
+import re
+import os
+
+from build import connection
+from result_cache import commit_id
+
+logger = logging.getLogger(__name__)
+
+class TestSelector(object):
+    """PUBLIC: Constructor for TestSelector
+
+        @param configs is the configuration for the Rosie server
+        @param connection is the mongokit connection builds are looked up with
+    """
+    def __init__(self, configs=dict(), connection=connection):
+        self.enabled = configs.get('TEST_SELECTION', False)
+        self.rules = [(re.compile(pattern + '$'), tests) for pattern, tests in
+                      configs.get('TEST_SELECTION_RULES', [])]
+        self.coverage = configs.get('TEST_SELECTION_COVERAGE', None)
+        self.full_run_every = configs.get('TEST_SELECTION_FULL_RUN_EVERY', 20)
+        self.command = configs.get('TEST_COMMAND', None) or ''
+        self.connection = connection
+
+    def select(self, build, directory):
+        """ PUBLIC: the tests build has to run, from its checkout in directory
+
+            returns the test files, or None to run all of them, and a line
+            saying why
+        """
+        if not self.enabled:
+            return None, None
+        if '{files}' not in self.command:
+            return None, "Running all tests, since the test command has no {files}."
+        if not directory:
+            return None, "Running all tests, since the build has no checkout."
+        if self._full_run_due(build):
+            return None, "Running all tests, since the last %d builds of %s did not." % (
+                self.full_run_every - 1, build.get('ref', None))
+
+        previous = self._previous_success(build)
+        if previous is None:
+            return None, "Running all tests, since there is no successful build to compare with."
+        changed = self._changed_paths(directory, previous)
+        if changed is None:
+            return None, "Running all tests, since %s cannot be compared with." % previous
+
+        tests = set()
+        for path in changed:
+            affected = self.affected_tests(path, directory)
+            if affected is None:
+                return None, "Running all tests, since the tests %s affects are unknown." % path
+            tests.update(affected)
+        return sorted(tests), "Running the %d tests affected by %d paths changed since %s." % (
+            len(tests), len(changed), previous)
+
+    def affected_tests(self, path, directory):
+        """ PUBLIC: the test files affected by a change to path, None if that
+        is unknown """
+        for pattern, tests in self.rules:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            if tests is None:
+                return []
+            found = glob.glob(os.path.join(directory, match.expand(tests)))
+            return [os.path.relpath(test, directory) for test in found]
+
+        covering = self._coverage_map(directory).get(path, None)
+        if covering is not None:
+            return [test for test in covering if os.path.exists(os.path.join(directory, test))]
+        return None
+
+    def _coverage_map(self, directory):
+        """ PRIVATE: path -> the tests covering it, from the coverage file """
+        if not self.coverage:
+            return dict()
+        try:
+            with open(os.path.join(directory, self.coverage)) as f:
+                recorded = json.load(f)
+        except (IOError, ValueError):
+            logger.warning("Could not read the coverage map %s.", self.coverage)
+            return dict()
+        covering = dict()
+        for test, paths in recorded.items():
+            covering.setdefault(test, []).append(test)
+            for path in paths:
+                covering.setdefault(path, []).append(test)
+        return covering
+
+    def _ref_builds(self, build):
+        # keyed on the url: repositories of the same name by different owners
+        # are different repositories
+        return {'repository.url': build['repository']['url'], 'ref': build['ref'],
+                '_id': {'$ne': build['_id']}}
+
+    def _full_run_due(self, build):
+        """ PRIVATE: whether the last finished builds of the ref all selected """
+        if not self.full_run_every:
+            return False
+        if self.full_run_every == 1:
+            return True
+        spec = self._ref_builds(build)
+        spec['status'] = {'$in': [1, 2]}
+        recent = list(self.connection.Build.collection.find(spec, fields=['full_run'])
+                      .sort('build_time', -1).limit(self.full_run_every - 1))
+        return len(recent) >= self.full_run_every - 1 and \
+            not any(previous.get('full_run', True) for previous in recent)
+
+    def _previous_success(self, build):
+        """ PRIVATE: the commit id of the last successful build of the ref """
+        spec = self._ref_builds(build)
+        spec['status'] = 1
+        previous = list(self.connection.Build.collection.find(spec, fields=['url'])
+                        .sort('build_time', -1).limit(1))
+        return commit_id(previous[0]) if previous else None
+
+    def _changed_paths(self, directory, commit):
+        """ PRIVATE: the paths changed between commit and the checkout, None
+        if git cannot tell """
+        try:
+            output = subprocess.check_output(['git', 'diff', '--name-only', commit, 'HEAD'],
+                                             cwd=directory, stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return [path for path in output.splitlines() if path]
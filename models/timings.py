@@ -0,0 +1,87 @@
+"""
+Where the time of a build goes.
+
+Every Build records how many seconds it spent in each stage, from being
+queued to GitHub being told about it, in Build.timings:
+
+    queue               from /build (Build.queued_at) to a WorkerThread
+                        taking it off the BuildQueue
+    retrieve            loading it from the database
+    prefetch_wait       with WORKER_PREFETCH > 1, waiting behind the builds
+                        fetched before it in the same batch
+    checkout            checking it out and selecting its tests
+    pre_build_hook      the build steps (see executor.py)
+    test_command
+    post_build_hook
+    save                saving its result
+    notify              posting its failure to GitHub, or handing it to the
+                        GitHubNotifier
+
+Stages a build did not go through are left out. The durations are measured
+with time.time() within one WorkerThread, so the only stage that depends on
+the clocks of two processes agreeing is queue. A stage during which the clock
+was stepped back is recorded as 0 seconds rather than a negative duration.
+
+stage_percentiles gives the 50th, 95th and 99th percentile of every stage
+over the builds of a time window.
+"""
+
+import calendar
+import time
+
+from build import connection
+from query_plan import explain_query
+
+STAGES = ['queue', 'retrieve', 'prefetch_wait', 'checkout', 'pre_build_hook', 'test_command',
+          'post_build_hook', 'save', 'notify']
+
+PERCENTILES = [50, 95, 99]
+
+def stage_name(step):
+    """ PUBLIC: the stage of a step of the BuildExecutor, e.g. test_command """
+    return step.replace('-', '_').replace(' ', '_')
+
+def elapsed(started):
+    """ PUBLIC: seconds since started, a time.time(), never negative """
+    return max(0.0, time.time() - started)
+
+def epoch(when):
+    """ PUBLIC: a UTC datetime as seconds since the epoch """
+    return calendar.timegm(when.utctimetuple()) + when.microsecond / 1e6
+
+def percentile(values, p):
+    """ PUBLIC: the p-th percentile of sorted values, by nearest rank """
+    if not values:
+        return None
+    rank = int(len(values) * p / 100.0 + 0.5)
+    return values[min(max(rank, 1), len(values)) - 1]
+
+def stage_percentiles(since=None, repository=None, connection=connection, configs=dict()):
+    """ PUBLIC: dict(count, p50, p95, p99) per stage, over finished builds
+
+        @param since only counts builds from this datetime (UTC) on
+        @param repository only counts builds of the repository with this name
+    """
+    spec = {'status': {'$in': [1, 2]}}
+    if since is not None:
+        spec['build_time'] = {'$gte': since}
+    if repository is not None:
+        spec['repository.name'] = repository
+
+    values = dict((stage, []) for stage in STAGES)
+    builds = connection.Build.collection.find(spec, fields=['timings'])
+    for build in explain_query('stage percentiles', builds, configs):
+        for stage, seconds in (build.get('timings', None) or dict()).items():
+            if stage in values and seconds is not None:
+                values[stage].append(seconds)
+
+    results = dict()
+    for stage, seconds in values.items():
+        if not seconds:
+            continue
+        seconds.sort()
+        result = dict(count=len(seconds))
+        for p in PERCENTILES:
+            result['p%d' % p] = percentile(seconds, p)
+        results[stage] = result
+    return results
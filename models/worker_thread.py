@@ -5,11 +5,14 @@ asynchronously to the Application Server.
 The only data structure used in this class is the BuildQueue class, which
 we design in the build_queue.py file.
 
-The basic logic for a WorkerThread is as follows. There is only ever 1 WorkerThread
-running at a time. When a new build comes in, the Application Server checks if a
-WorkerThread is already running. If it is, the Application Server simply saves the
-Build in the database and pushes the Build.id onto the queue. If a WorkerThread is not running,
-the Application Server starts a new one with the following code:
+The basic logic for a WorkerThread is as follows. When the Application Server
+starts, its Dispatcher (see dispatcher.py) starts a pool of persistent WorkerThreads.
+When a new build comes in, the Application Server simply saves the Build in the
+database and pushes the Build.id onto the queue. A persistent WorkerThread blocks
+on the BuildQueue until a Build.id is available, builds it, and goes back to
+waiting; it only terminates when it is asked to stop.
+
+A WorkerThread can also be run on its own:
 
     WorkerThread(queue)
     WorkerThread.run()
@@ -24,6 +27,13 @@ DATABASE CONNECTION:
     Build object. Thus, there is no need to actively maintain another connection
     to the database.
 
+    The result of a build is stored with a $set of only the fields building it
+    changed, on the condition that its status is still 0 (processing). If it
+    is not, another WorkerThread finished it first or it was superseded, and
+    this WorkerThread drops its result instead of overwriting theirs. With
+    RESULT_WRITE_BATCHING the results of all WorkerThreads of the Dispatcher
+    are written in batches (see result_writer.py).
+
 CONFIGURATION:
 
     Configuration for the WorkerThread is stored in a configuration file
@@ -41,6 +51,10 @@ subclasses the threading.Thread class. Documentation can be found at:
 http://docs.python.org/2/library/threading.html
 """
 import threading
+import logging
+import time
+from Queue import Empty
+from collections import deque
 
 """
 The requests module is used to communicate with the Github API after the build
@@ -54,9 +68,19 @@ This module only uses:
     requests.post()
 """
 import requests
-from build import connection
+from build import connection, save_result
+from build_log import BuildLog
+from blame import record_failure
+from result_cache import ResultCache, commit_id
+from workspace import WorkspaceCache, WorkspaceException
+from selection import TestSelector
+from executor import BuildExecutor
+from metrics import metrics
+from events import events
+from timings import stage_name, elapsed, epoch
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
 
 class BuildNotFoundException(Exception):
     def __init__(self, value):
@@ -70,8 +94,15 @@ class WorkerThread(threading.Thread):
 
         @param queue is the BuildQueue that contains the Builds to be built
         @param configs is the configuration for the Rosie server
+        @param persistent keeps the WorkerThread blocked on the BuildQueue
+            when it is empty instead of terminating
+        @param notifier is the GitHubNotifier failures are handed to; without
+            one they are posted to Github by the WorkerThread itself
+        @param result_writer is the ResultWriter results are batched by;
+            without one they are stored by the WorkerThread itself
     """
-    def __init__(self, queue, configs=dict(), connection=connection):
+    def __init__(self, queue, configs=dict(), connection=connection,
+                 persistent=False, notifier=None, result_writer=None):
         # calls standard Thread constructor
         threading.Thread.__init__(self)
 
@@ -83,28 +114,239 @@ class WorkerThread(threading.Thread):
         self.current_build = None
         self.connection = connection
         self.building = False
+        self.persistent = persistent
+        self.notifier = notifier
+        self.result_writer = result_writer
+        self.poll_interval = configs.get('WORKER_POLL_INTERVAL', 1)
+        self.stopped = threading.Event()
+
+        # (Build.id, Build) pairs dequeued and fetched ahead of time; the
+        # Build is None if it was not in the database
+        self.prefetch = configs.get('WORKER_PREFETCH', 1)
+        self.prefetched = deque()
+        # when the builds in self.prefetched were fetched
+        self.fetched_at = None
+
+        # the BuildExecutor running the current build, and the Build.id of
+        # the build that cancelled it, if it was cancelled
+        self.executor = None
+        self.superseded_by = None
+        # whether the current build was stopped by something other than its
+        # steps, in which case its result is not cached
+        self.interrupted = False
+        # whether the 'finished' event of the build being processed was
+        # published
+        self.finished = False
+        self.lock = threading.Lock()
+
+        self.result_cache = ResultCache(configs, connection)
+        self.workspaces = WorkspaceCache(configs)
+        self.test_selector = TestSelector(configs, connection)
 
     def run(self):
         """ PUBLIC: Starts worker in new Thread """
-        self.building = True
-        while self.queue.has_builds():
-            self.current_build = self._retrieve_build(self.queue.next_build())
-            result = self._build(self.current_build)
-            if result['success']:
-                self.current_build['status'] = 1
-                self.current_build.save()
-            else:
-                self.current_build['status'] = 2
-                self.current_build['error'] = result['error']
-                self.current_build.save()
-                self._post_to_github(self.current_build)
-
-        self.current_build = None
-        self.building = False
+        while not self.stopped.is_set():
+            if not self.prefetched:
+                try:
+                    ids = self.queue.next_builds(self.prefetch, block=self.persistent,
+                                                 timeout=self.poll_interval)
+                except Empty:
+                    if self.persistent:
+                        continue
+                    break
+                dequeued = time.time()
+                try:
+                    fetched = self._prefetch(ids)
+                    self.fetched_at = retrieved = time.time()
+                    for build_id, build in fetched:
+                        if build is not None:
+                            build['timings'] = self._queue_timings(build, dequeued, retrieved)
+                except Exception:
+                    # the builds are handed back rather than lost, and the
+                    # database gets a moment before they are asked for again
+                    self._requeue(ids)
+                    if not self.persistent:
+                        raise
+                    logger.exception("Builds %s could not be retrieved.", ids)
+                    self.stopped.wait(self.poll_interval)
+                    continue
+                self.prefetched.extend(fetched)
+
+            build_id, build = self.prefetched.popleft()
+            if build is not None and self.prefetch > 1:
+                build['timings']['prefetch_wait'] = elapsed(self.fetched_at)
+            self.building = True
+            self.finished = False
+            try:
+                self._process(build_id, build)
+            except BuildNotFoundException:
+                logger.warning("Build %s was not in database.", build_id)
+            except Exception:
+                # a persistent worker must outlive a single bad build
+                if not self.persistent:
+                    raise
+                logger.exception("Build %s could not be built.", build_id)
+            finally:
+                # watchers of the build are always told it is over, even when
+                # it failed, was not found or was finished elsewhere
+                if not self.finished:
+                    events.publish('finished', build_id, status=None)
+                with self.lock:
+                    self.current_build = None
+                self.building = False
+                self.queue.complete_build(build_id)
+
+        # hands the builds that were fetched but not built to other workers
+        self._requeue([build_id for build_id, build in self.prefetched])
+        self.prefetched.clear()
+
+    def _requeue(self, ids):
+        """ PRIVATE: puts dequeued Build.ids that will not be built by this
+        WorkerThread back on the BuildQueue """
+        for build_id in ids:
+            try:
+                self.queue.add_build(build_id)
+                self.queue.complete_build(build_id)
+            except Exception:
+                # a MongoBuildQueue hands the build out again once its lease
+                # runs out
+                logger.exception("Build %s could not be put back on the queue.", build_id)
+
+    def stop(self):
+        """ PUBLIC: Stops the worker once its current build is done """
+        self.stopped.set()
 
     def is_building(self):
         return self.building
 
+    def cancel(self, build_id, superseded_by):
+        """ PUBLIC: Cancels the build with Build.id == build_id if it is the
+        one being built, because the build superseded_by replaces it
+
+            returns True if the build was cancelled
+        """
+        with self.lock:
+            if self.current_build is None or self.current_build['_id'] != build_id:
+                return False
+            self.superseded_by = superseded_by
+            if self.executor is not None:
+                self.executor.cancel()
+            return True
+
+    def _process(self, id, build):
+        """ PRIVATE: Builds and saves the build with Build.id == id
+
+            @param build is the prefetched Build, None if it was not found
+        """
+        metrics.build_started(id)
+        if build is None:
+            raise BuildNotFoundException("Build was not in database.")
+        events.publish('started', id, status=0)
+        with self.lock:
+            self.current_build = build
+            self.superseded_by = None
+        if not build.get('timings', None):
+            build['timings'] = dict()
+
+        cached = self.result_cache.lookup(build)
+        if cached is not None:
+            # this commit was already built with the same configuration
+            build['status'] = cached['status']
+            build['error'] = cached['error']
+            build['cached_from'] = cached['build_id']
+            started = time.time()
+            if self._save_result(build):
+                self._save_timings(build, save=elapsed(started))
+                self._finished(id, status=build['status'], cached=True)
+                # counted like a failure that was built, as the aggregation
+                # of the builds collection counts it
+                if build['status'] == 2:
+                    record_failure(build, self.connection, self.configs)
+            return
+
+        build['force'] = False
+        build['cached_from'] = None
+        self.interrupted = False
+        started = time.time()
+        result = self._build(self.current_build)
+        metrics.build_duration.observe(elapsed(started))
+        if self.superseded_by is not None:
+            self.current_build['status'] = 3
+            self.current_build['superseded_by'] = self.superseded_by
+        elif result['success']:
+            self.current_build['status'] = 1
+        else:
+            self.current_build['status'] = 2
+            self.current_build['error'] = result['error']
+        events.publish('stage', id, stage='save')
+        started = time.time()
+        if not self._save_result(self.current_build):
+            return
+        timings = dict(save=elapsed(started))
+        self._finished(id, status=self.current_build['status'], cached=False)
+
+        if self.current_build['status'] != 3:
+            self.result_cache.store(self.current_build, self.interrupted)
+        if self.current_build['status'] == 2:
+            record_failure(self.current_build, self.connection, self.configs)
+            started = time.time()
+            self._post_to_github(self.current_build)
+            timings['notify'] = elapsed(started)
+        self._save_timings(self.current_build, **timings)
+
+    def _finished(self, id, **fields):
+        """ PRIVATE: publishes that the build with Build.id == id is finished """
+        self.finished = True
+        events.publish('finished', id, **fields)
+
+    def _save_result(self, build):
+        """ PRIVATE: stores the fields building build changed, if it is still
+        being processed. A build that another WorkerThread finished first, or
+        that was superseded in the meantime, is left as it is.
+
+            returns whether the result was stored, and raises if it could not
+            be stored at all
+        """
+        if self.result_writer is not None:
+            stored = self.result_writer.save(build)
+        else:
+            stored = save_result(build, connection=self.connection)
+        if not stored:
+            logger.warning("Build %s was already finished elsewhere; its result "
+                           "was not stored.", build['_id'])
+        return stored
+
+    def _queue_timings(self, build, dequeued, retrieved):
+        """ PRIVATE: the queue and retrieve stages of a prefetched build """
+        timings = dict(retrieve=max(0.0, retrieved - dequeued))
+        queued_at = build.get('queued_at', None)
+        if isinstance(queued_at, datetime):
+            timings['queue'] = max(0.0, dequeued - epoch(queued_at))
+        return timings
+
+    def _save_timings(self, build, **stages):
+        """ PRIVATE: stores the stages measured after the build was saved """
+        build['timings'].update(stages)
+        self.connection.Build.collection.update({'_id': build['_id']}, {'$set': dict(
+            ('timings.%s' % stage, seconds) for stage, seconds in stages.items())})
+
+    def _prefetch(self, ids):
+        """ PRIVATE: Retrieves the builds of a batch of Build.ids
+
+            A single Build.id is retrieved with _retrieve_build, a batch with
+            one $in query.
+
+            returns (Build.id, Build) pairs in the order of ids, with None
+            for builds that are not in the database
+        """
+        if len(ids) == 1:
+            try:
+                return [(ids[0], self._retrieve_build(ids[0]))]
+            except BuildNotFoundException:
+                return [(ids[0], None)]
+
+        return zip(ids, self.connection.Build.get_many(ids))
+
     def _retrieve_build(self, id):
         """ PRIVATE: Retrieves build given build.ID
 
@@ -119,8 +361,8 @@ class WorkerThread(threading.Thread):
     def _build(self, build):
         """ PRIVATE: wrapper for bash build """
         result = self._bash_build(build)
-        build['build_time'] = datetime.now()
-        if type(result) == str:
+        build['build_time'] = datetime.utcnow()
+        if isinstance(result, basestring):
             return dict(success=False, error=result)
         else:
             return dict(success=True)
@@ -150,17 +392,59 @@ class WorkerThread(threading.Thread):
         and maintainer of the server Rosie is installed on, so they can do whatever
         they want.
 
+        The steps are run by a BuildExecutor (see executor.py), which streams
+        their output into the BuildLog of the build as they run. If
+        WORKSPACE_ROOT is set, they are run in a fresh checkout of the commit
+        (see workspace.py), and with TEST_SELECTION the test command only
+        runs the tests affected by what changed (see selection.py).
+
         @param build is the Build object to be built
 
-        returns build results
+        returns True if the build passed, otherwise the error string
         """
-        return True
-        # The original plan was to implement this functionality, but in the end it
-        # was too much to do. It would involve 200+ more lines of code (judging from other
-        # build functionality in open source CI server), so I just mocked this out as
-        # always returning true.
-        #
-        # I also implemented the BuildQueue, so I think this should be OK.
+        log = BuildLog(build['_id'], self.configs, self.connection)
+        with self.lock:
+            self.executor = BuildExecutor(self.configs, log, lambda step:
+                events.publish('stage', build['_id'], stage=stage_name(step)))
+            if self.superseded_by is not None:
+                self.executor.cancel()
+        repository = build.get('repository', dict()).get('url', None)
+        revision = commit_id(build) or build.get('ref', None)
+        events.publish('stage', build['_id'], stage='checkout')
+        started = time.time()
+        try:
+            with self.workspaces.checkout(repository, revision, build['_id']) as directory:
+                tests, reason = self.test_selector.select(build, directory)
+                if reason is not None:
+                    log.write("%s\n" % reason)
+                build['full_run'] = tests is None
+                build['selected_tests'] = tests or []
+                build['timings']['checkout'] = elapsed(started)
+                result = self.executor.run(env=self._build_environment(build), cwd=directory,
+                                           tests=tests)
+                build['dependencies'] = self.executor.dependencies
+                build['shards'] = self.executor.shards
+                self.interrupted = self.executor.interrupted
+                build['timings'].update((stage_name(step), max(0.0, seconds)) for step, seconds
+                                        in self.executor.timings.items())
+                return result
+        except WorkspaceException as e:
+            self.interrupted = True
+            return "failure\n%s" % e.value
+        finally:
+            self.executor = None
+            log.close()
+
+    def _build_environment(self, build):
+        """ PRIVATE: environment variables describing the build to its steps """
+        env = dict(
+            ROSIE_BUILD_ID=build['_id'],
+            ROSIE_REF=build.get('ref', None),
+            ROSIE_COMMIT_URL=build.get('url', None),
+            ROSIE_REPOSITORY_URL=build.get('repository', dict()).get('url', None)
+        )
+        return dict((key, unicode(value).encode('utf-8'))
+                    for key, value in env.items() if value)
 
     def _post_to_github(self, build):
         """ PRIVATE: posts build results to Github
@@ -170,8 +454,11 @@ class WorkerThread(threading.Thread):
 
         @param results is the results information returned by the build method
 
-        returns True if Github is correctly updated, False otherwise
+        returns True if Github is correctly updated, False otherwise. With a
+        GitHubNotifier, returns as soon as the failure is queued for it.
         """
+        if self.notifier is not None:
+            return self.notifier.notify(build)
 
         github_id = self.configs.get('GITHUB_ID', None)
         github_secret = self.configs.get('GITHUB_SECRET', None)
@@ -179,12 +466,16 @@ class WorkerThread(threading.Thread):
         if not github_id or not github_secret:
             return False
 
-        base_url = "https://api.github.com/repos/%s/%s/issues" % (build.repository.owner.name, build.repository.name)
+        api_url = self.configs.get('GITHUB_API_URL', 'https://api.github.com').rstrip('/')
+        base_url = "%s/repos/%s/%s/issues" % (api_url, build.repository.owner.name, build.repository.name)
         auth_string = "?client_id=%s&client_secret=%s" % (github_id, github_secret)
         url = base_url + auth_string
 
         title = "Build failure on ref %s" % build.ref
         body = build['error']
         data = dict(title=title, body=body)
-        return requests.post(url, data)
+        started = time.time()
+        response = requests.post(url, data)
+        metrics.notify_latency.observe(elapsed(started))
+        return response
 
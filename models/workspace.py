@@ -0,0 +1,249 @@
+"""
+The WorkspaceCache class gives every build a fresh checkout of its commit
+without cloning the repository from scratch each time.
+
+For every repository it keeps a bare mirror under WORKSPACE_ROOT/mirrors. A
+build fetches into the mirror of its repository (only when the commit is not
+in it yet), then checks the commit out into a worktree of its own under
+WORKSPACE_ROOT/worktrees, which is removed again when the build is done:
+
+    with workspaces.checkout(url, revision, build_id) as directory:
+        ...                     # run the build steps in directory
+
+Mirrors are shared by all WorkerThreads, and by every Rosie process using
+the same WORKSPACE_ROOT, so each mirror has lock files next to it. A build
+holds the mirror lock shared from checkout to the removal of its worktree,
+and only evicting the mirror takes it exclusively, so a mirror is never
+evicted under a build. Cloning and fetching take a fetch lock of their own,
+since git can fetch while others read the mirror, and adding and removing
+worktrees take another short one: no build waits for the other builds of
+its repository to finish. A clone or fetch that takes longer than
+WORKSPACE_FETCH_TIMEOUT fails the checkout (BUILD_TIMEOUT only starts with
+the first build step).
+
+When the mirrors take up more than WORKSPACE_DISK_BUDGET bytes, the least
+recently used ones that no build is using are removed after every build.
+
+CONFIGURATION:
+
+    WORKSPACE_ROOT is the directory mirrors and worktrees are kept in
+    (default None, in which case builds run in BUILD_DIRECTORY and nothing
+    is checked out).
+    WORKSPACE_DISK_BUDGET is how many bytes the mirrors may take up (default
+    None, no limit).
+    WORKSPACE_FETCH_TIMEOUT is how many seconds a clone or fetch may take
+    (default 600, None for no limit).
+"""
+
+from contextlib import contextmanager
+import subprocess
+import tempfile
+import threading
+import hashlib
+import logging
+import shutil
+import signal
+import fcntl
+import os
+
+logger = logging.getLogger(__name__)
+
+class WorkspaceException(Exception):
+    """ Raised when a revision cannot be checked out """
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class WorkspaceCache(object):
+    """PUBLIC: Constructor for WorkspaceCache
+
+        @param configs is the configuration for the Rosie server
+    """
+    def __init__(self, configs=dict()):
+        self.root = configs.get('WORKSPACE_ROOT', None)
+        self.budget = configs.get('WORKSPACE_DISK_BUDGET', None)
+        self.fetch_timeout = configs.get('WORKSPACE_FETCH_TIMEOUT', 600)
+        if self.root:
+            self.mirrors = os.path.join(self.root, 'mirrors')
+            self.worktrees = os.path.join(self.root, 'worktrees')
+            for directory in (self.mirrors, self.worktrees):
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+
+    @property
+    def enabled(self):
+        return bool(self.root)
+
+    def mirror_path(self, url):
+        """ PUBLIC: the directory of the mirror of the repository at url """
+        return os.path.join(self.mirrors, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.git')
+
+    @contextmanager
+    def checkout(self, url, revision, name=''):
+        """ PUBLIC: checks revision of the repository at url out into a new
+        worktree, and removes the worktree when the block is done
+
+            @param url is the url git fetches the repository from
+            @param revision is the commit id or ref to check out
+            @param name is put in front of the name of the worktree
+
+            yields the directory of the worktree, or None if the
+            WorkspaceCache is not enabled
+        """
+        if not self.enabled:
+            yield None
+            return
+        if not url or not revision:
+            raise WorkspaceException("There is nothing to check out.")
+
+        mirror = self.mirror_path(url)
+        lock = open(mirror + '.lock', 'a')
+        directory = None
+        try:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            if not os.path.isdir(mirror) or not self._has_commit(mirror, revision):
+                with self._lock(mirror + '.fetch.lock'):
+                    self._update_mirror(mirror, url, revision)
+            directory = tempfile.mkdtemp(prefix='%s-' % name, dir=self.worktrees)
+            with self._lock(mirror + '.worktrees.lock'):
+                self._git(mirror, 'worktree', 'add', '--detach', directory, revision)
+
+            yield directory
+        finally:
+            if directory is not None:
+                with self._lock(mirror + '.worktrees.lock'):
+                    self._remove_worktree(mirror, directory)
+            if os.path.isdir(mirror):
+                os.utime(mirror, None)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+            self.evict()
+
+    def evict(self):
+        """ PUBLIC: removes the least recently used mirrors not in use until
+        the mirrors fit in WORKSPACE_DISK_BUDGET
+
+            returns the paths of the mirrors that were removed
+        """
+        if not self.enabled or self.budget is None:
+            return []
+
+        mirrors = [os.path.join(self.mirrors, name) for name in os.listdir(self.mirrors)
+                   if name.endswith('.git')]
+        sizes = dict((mirror, disk_usage(mirror)) for mirror in mirrors)
+        total = sum(sizes.values())
+
+        removed = []
+        for mirror in sorted(mirrors, key=os.path.getmtime):
+            if total <= self.budget:
+                break
+            lock = open(mirror + '.lock', 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                # a build is using it
+                lock.close()
+                continue
+            try:
+                shutil.rmtree(mirror)
+                total -= sizes[mirror]
+                removed.append(mirror)
+            finally:
+                lock.close()
+        return removed
+
+    @contextmanager
+    def _lock(self, path):
+        """ PRIVATE: holds the lock file at path exclusively; the builds
+        holding a mirror shared take turns on its fetch and worktrees locks """
+        lock = open(path, 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+        finally:
+            lock.close()
+
+    def _update_mirror(self, mirror, url, revision):
+        """ PRIVATE: clones or fetches the mirror, unless it already has the
+        commit (a ref is always fetched, since it may have moved). Another
+        build may have fetched it while this one waited for the lock. """
+        if not os.path.isdir(mirror):
+            self._git(None, 'clone', '--mirror', '--quiet', url, mirror,
+                      timeout=self.fetch_timeout)
+        elif not self._has_commit(mirror, revision):
+            self._git(mirror, 'fetch', '--prune', '--quiet', 'origin',
+                      timeout=self.fetch_timeout)
+
+    def _has_commit(self, mirror, revision):
+        """ PRIVATE: whether the mirror has the commit with id revision """
+        if revision.startswith('refs/'):
+            return False
+        try:
+            self._git(mirror, 'cat-file', '-e', '%s^{commit}' % revision)
+        except WorkspaceException:
+            return False
+        return True
+
+    def _remove_worktree(self, mirror, directory):
+        """ PRIVATE: removes a worktree, and its entry in the mirror """
+        try:
+            self._git(mirror, 'worktree', 'remove', '--force', directory)
+        except WorkspaceException:
+            logger.exception("Could not remove the worktree %s.", directory)
+            shutil.rmtree(directory, ignore_errors=True)
+            if os.path.isdir(mirror):
+                self._git(mirror, 'worktree', 'prune')
+
+    def _git(self, directory, *args, **kwargs):
+        """ PRIVATE: runs a git command, raising a WorkspaceException with its
+        output if it fails
+
+            @param timeout is how many seconds the command may take (keyword
+                only, default None for no limit); git and everything it
+                started, such as ssh, is killed after it
+        """
+        timeout = kwargs.get('timeout', None)
+        command = ['git'] + list(args)
+        if directory is not None:
+            command[1:1] = ['--git-dir', directory]
+        env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, env=env,
+                                       close_fds=True, preexec_fn=os.setsid)
+        except OSError as e:
+            raise WorkspaceException("git %s failed: %s" % (args[0], e))
+
+        killed = []
+        def kill():
+            killed.append(True)
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        timer = threading.Timer(timeout, kill) if timeout else None
+        if timer is not None:
+            timer.daemon = True
+            timer.start()
+        try:
+            output = process.communicate()[0]
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if killed:
+            raise WorkspaceException("git %s timed out after %s seconds" % (args[0], timeout))
+        if process.returncode != 0:
+            raise WorkspaceException("git %s failed: %s" % (args[0], output))
+        return output
+
+
+def disk_usage(path):
+    """ PUBLIC: how many bytes the files under path take up """
+    total = 0
+    for directory, subdirectories, files in os.walk(path):
+        for name in files:
+            total += os.lstat(os.path.join(directory, name)).st_size
+    return total
@@ -5,14 +5,32 @@ BLACKBOX TESTING:
 
     def test_api_builds():
     def test_api_builds_bad():
+    def test_api_builds_push_per_commit():
     def test_api_pings():
+    def test_api_metrics():
     def test_api_build_id_returns_corrent_information():
     def test_api_build_status_wrong_id():
+    def test_api_build_etag():
+    def test_api_finished_build_etag():
     def test_api_build_statuses():
     def test_api_accepts_settings_changes():
     def test_api_denies_bad_settings():
+    def test_api_builds_paginated():
+    def test_api_builds_page_etag():
+    def test_api_builds_filtered():
+    def test_api_builds_projected():
+    def test_api_builds_bad_query():
+    def test_api_builds_queries_use_indexes():
+    def test_api_builds_batch():
+    def test_api_build_timings():
+    def test_api_build_events():
+    def test_api_events_stream_ends_after_timeout():
+    def test_api_events_head_leaves_no_subscriber():
+    def test_api_timing_percentiles():
     def test_api_blame_list():
     def test_api_rebuilds():
+    def test_api_rebuild_changes_etag():
+    def test_api_rebuild_of_queued_build_is_refused():
 
 WHITEBOX TESTING:
 
@@ -30,10 +48,14 @@ from rosie.api import api
 from rosie.models import (
     Build,
     WorkerThread,
+    events,
+    explain_query,
+    QueryPlanException,
     connection
 )
 from mock import patch
 from mongokit import ObjectId
+from datetime import datetime
 
 Build = connection.Build
 
@@ -82,12 +104,41 @@ class APITest(testing.TestCase):
             content_type='application/json'
         )
 
-        api.worker.join()
+        api.queue.join()
 
         build = Build.find_one(dict(_id=ObjectId(response.json['id'])))
 
         self.assertEqual(build['status'],1)
 
+    @patch.object(WorkerThread, '_bash_build')
+    def test_api_builds_push_per_commit(self, mock):
+        """ Verifies that a push of several commits makes a build of every
+        commit, with the head commit's build as id """
+        mock.return_value = True
+        payload = dict(self.fake_json['payload'], commits=[
+            dict(url='https://github.com/cs181f/rosie/commit/%d' % i,
+                 author=dict(name='dunvi', email='dunvi.dunvi@gmail.com'),
+                 message='commit %d' % i, timestamp='2012-12-15T20:05:07-08:00')
+            for i in range(3)])
+
+        api.config['PUSH_BUILDS'] = 'all'
+        try:
+            response = self.client.post(
+                '/build',
+                data=json.dumps(dict(payload=payload)),
+                content_type='application/json'
+            )
+            api.queue.join()
+        finally:
+            api.config['PUSH_BUILDS'] = 'head'
+
+        self.assertEqual(len(response.json['ids']), 3)
+        self.assertEqual(response.json['id'], response.json['ids'][-1])
+        builds = [Build.find_one(dict(_id=ObjectId(id))) for id in response.json['ids']]
+        self.assertEqual([build['message'] for build in builds],
+                         ['commit 0', 'commit 1', 'commit 2'])
+        self.assertEqual(Build.find().count(), 3)
+
     @patch.object(WorkerThread, '_bash_build')
     def test_api_builds_bad(self, mock):
         """ Verifies that a bad build returns an error and posts the error to
@@ -101,7 +152,7 @@ class APITest(testing.TestCase):
             content_type='application/json'
         )
 
-        api.worker.join()
+        api.queue.join()
 
         build = Build.find_one(dict(_id=ObjectId(response.json['id'])))
 
@@ -119,6 +170,20 @@ class APITest(testing.TestCase):
 
         self.assertTrue(response.json['building'])
 
+    def test_api_metrics(self):
+        """ Verifies that /metrics shows the workers, the queue and the
+        requests that were made in the Prometheus text format """
+        self.client.get('/ping')
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertTrue('# TYPE rosie_workers gauge' in response.data)
+        self.assertTrue('rosie_workers{state="idle"}' in response.data)
+        self.assertTrue('# TYPE rosie_queue_wait_seconds histogram' in response.data)
+        self.assertTrue('rosie_http_requests_total{endpoint="ping",method="GET",status="200"}'
+                        in response.data)
+
     def test_api_build_id_returns_corrent_information(self):
         """ Verifies that when a build is running, returns the status of that
         build and otherwise returns clear."""
@@ -142,6 +207,48 @@ class APITest(testing.TestCase):
 
         self.assertEqual(response.json['error'], 'Invalid Build ID')
 
+    def test_api_build_etag(self):
+        """ Verifies that a build comes with an ETag, and that a conditional
+        GET of a build that did not change gets 304 without a body """
+
+        build = Build()
+        build.save()
+
+        response = self.client.get('/builds/%s' % build._id)
+        etag = response.headers['ETag']
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+
+        response = self.client.get('/builds/%s' % build._id,
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+
+        Build.collection.update({'_id': build._id}, {'$set': {'status': 1}})
+        response = self.client.get('/builds/%s' % build._id,
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_api_finished_build_etag(self):
+        """ Verifies that a finished build may be cached, and that a
+        conditional GET of one that was served before needs no read """
+
+        build = Build()
+        build.status = 1
+        build.build_time = datetime.utcnow()
+        build.timings = {'save': 0.01}
+        build.save()
+
+        response = self.client.get('/builds/%s' % build._id)
+        self.assertTrue(response.headers['Cache-Control'].startswith('public, max-age='))
+        self.assertFalse('Last-Modified' in response.headers)
+
+        with patch.object(Build, 'find') as find:
+            response = self.client.get('/builds/%s' % build._id,
+                                       headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(find.called)
+
     def test_api_builds_returned_corrent(self):
         """ Verifies that build statuses returned match initial set."""
 
@@ -158,6 +265,216 @@ class APITest(testing.TestCase):
         for b in response.json:
             self.assertTrue(builds.count(json.loads(b)['_id']['$oid']) == 1)
 
+    def test_api_builds_paginated(self):
+        """ Verifies that /builds returns the newest builds first, one page at
+        a time, with a link to the next page """
+
+        ids = []
+        for i in range(5):
+            build = Build()
+            build.save()
+            ids.append(str(build._id))
+
+        response = self.client.get('/builds?limit=3')
+        page = [json.loads(b)['_id']['$oid'] for b in response.json]
+        self.assertEqual(page, ids[:1:-1])
+
+        next_page = response.headers['Link'].split('>')[0].lstrip('<')
+        response = self.client.get(next_page)
+        page = [json.loads(b)['_id']['$oid'] for b in response.json]
+        self.assertEqual(page, ids[1::-1])
+        self.assertFalse('Link' in response.headers)
+
+    def test_api_builds_page_etag(self):
+        """ Verifies that a page of builds gets 304 until anything on it
+        changes, and only for a matching ETag """
+
+        for i in range(5):
+            build = Build()
+            build.save()
+
+        response = self.client.get('/builds?limit=3')
+        etag = response.headers['ETag']
+        response = self.client.get('/builds?limit=3', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue('Link' in response.headers)
+
+        # another page is another document
+        response = self.client.get('/builds?limit=2', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+        # a change the build's status and times do not show
+        Build.collection.update({'_id': build._id}, {'$set': {'ref': u'refs/heads/other'}})
+        response = self.client.get('/builds?limit=3', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+
+        response = self.client.get('/builds?limit=3', headers={
+            'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], etag)
+
+    def test_api_builds_filtered(self):
+        """ Verifies that /builds only returns builds matching the filters """
+
+        for i in range(6):
+            build = Build()
+            build.status = i % 3
+            build.ref = u'refs/heads/master'
+            build.author.name = u'dunvi'
+            build.save()
+
+        response = self.client.get('/builds?status=2&author=dunvi&ref=refs/heads/master')
+
+        self.assertEqual(len(response.json), 2)
+        for b in response.json:
+            self.assertEqual(json.loads(b)['status'], 2)
+
+    def test_api_builds_projected(self):
+        """ Verifies that list views leave out the message and error unless
+        asked for them """
+
+        build = Build()
+        build.message = u'a long commit message'
+        build.save()
+
+        listed = json.loads(self.client.get('/builds').json[0])
+        self.assertFalse('message' in listed)
+        self.assertFalse('error' in listed)
+
+        listed = json.loads(self.client.get('/builds?fields=all').json[0])
+        self.assertEqual(listed['message'], 'a long commit message')
+
+        listed = json.loads(self.client.get('/builds?fields=status').json[0])
+        self.assertEqual(sorted(listed.keys()), ['_id', 'status'])
+
+    def test_api_builds_bad_query(self):
+        """ Verifies that a malformed query returns an error """
+
+        response = self.client.get('/builds?before=1234')
+
+        self.assertEqual(response.json['error'], 'Invalid query')
+
+    def test_api_builds_queries_use_indexes(self):
+        """ Verifies that the filtered queries of /builds, /blame and
+        /builds/timings use the Build indexes instead of scanning the whole
+        builds collection """
+
+        for i in range(5):
+            build = Build()
+            build.save()
+
+        configs = dict(QUERY_EXPLAIN=True, QUERY_EXPLAIN_STRICT=True)
+        # without an index to use, the audit does see a collection scan
+        with self.assertRaises(QueryPlanException):
+            explain_query('ref', Build.find({'ref': u'refs/heads/master'}).sort(
+                'build_time', -1), configs)
+
+        api.config.update(configs)
+        try:
+            for path in ['/builds?status=2&order=build_time',
+                         '/builds?author=dunvi&status=2&order=build_time',
+                         '/builds?repository=rosie&ref=refs/heads/master&order=build_time',
+                         '/builds/%s' % build._id,
+                         '/blame', '/blame?repository=rosie&days=7',
+                         '/builds/timings?repository=rosie']:
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200, path)
+        finally:
+            api.config['QUERY_EXPLAIN'] = api.config['QUERY_EXPLAIN_STRICT'] = False
+
+    def test_api_builds_batch(self):
+        """ Verifies that /builds/batch returns the requested builds in order,
+        with null for unknown ids """
+
+        ids = []
+        for i in range(3):
+            build = Build()
+            build.save()
+            ids.append(str(build._id))
+
+        unknown = str(ObjectId())
+        response = self.client.get('/builds/batch?ids=%s,%s,%s' % (ids[2], unknown, ids[0]))
+
+        self.assertEqual(json.loads(response.json[0])['_id']['$oid'], ids[2])
+        self.assertEqual(response.json[1], None)
+        self.assertEqual(json.loads(response.json[2])['_id']['$oid'], ids[0])
+
+        response = self.client.get('/builds/batch?ids=1234')
+        self.assertEqual(response.json['error'], 'Invalid Build ID')
+
+    def test_api_build_events(self):
+        """ Verifies that the events of a build are streamed from memory, and
+        that the stream ends once the build is finished """
+        build_id = ObjectId()
+        events.publish('started', build_id, status=0)
+        seq = events.publish('stage', build_id, stage='test_command')['seq']
+        events.publish('finished', build_id, status=1)
+
+        response = self.client.get('/builds/%s/events' % build_id)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertTrue(response.data.startswith('retry: '))
+        self.assertTrue('event: finished' in response.data)
+        self.assertFalse('event: stage' in response.data)
+
+        response = self.client.get('/builds/%s/events' % build_id,
+                                   headers={'Last-Event-ID': str(seq - 1)})
+        self.assertEqual([line for line in response.data.split('\n')
+                          if line.startswith('event:')],
+                         ['event: stage', 'event: finished'])
+
+        response = self.client.get('/builds/1234/events')
+        self.assertEqual(response.json['error'], 'Invalid Build ID')
+
+    def test_api_events_stream_ends_after_timeout(self):
+        """ Verifies that a stream of every build ends after
+        EVENTS_STREAM_TIMEOUT, so the client reconnects """
+        watchers = events.watchers()
+        api.config['EVENTS_STREAM_TIMEOUT'] = 0.1
+        try:
+            response = self.client.get('/events')
+            self.assertTrue(': keep-alive' in response.data)
+        finally:
+            api.config['EVENTS_STREAM_TIMEOUT'] = 30
+        self.assertEqual(events.watchers(), watchers)
+
+    def test_api_events_head_leaves_no_subscriber(self):
+        """ Verifies that a response whose body is never read, such as that
+        of a HEAD request, does not subscribe to the events """
+        watchers = events.watchers()
+        response = self.client.head('/builds/%s/events' % ObjectId())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(events.watchers(), watchers)
+
+    def test_api_build_timings(self):
+        """ Verifies that the stage timings of a build are returned """
+        build = Build()
+        build.timings = dict(queue=1.5, test_command=3.0)
+        build.save()
+
+        response = self.client.get('/builds/%s/timings' % build['_id'])
+        self.assertEqual(response.json['timings'], dict(queue=1.5, test_command=3.0))
+
+        response = self.client.get('/builds/nope/timings')
+        self.assertEqual(response.json['error'], "Invalid Build ID")
+
+    def test_api_timing_percentiles(self):
+        """ Verifies that percentiles are computed per stage over the
+        finished builds of the window """
+        for seconds in (1.0, 2.0, 3.0):
+            build = Build()
+            build.status = 1
+            build.build_time = datetime.utcnow()
+            build.timings = dict(queue=seconds)
+            build.save()
+
+        response = self.client.get('/builds/timings?days=1')
+        self.assertEqual(response.json['queue'], dict(count=3, p50=2.0, p95=3.0, p99=3.0))
+
+        response = self.client.get('/builds/timings?days=soon')
+        self.assertEqual(response.json['error'], "Invalid query")
+
     def test_api_blame_list(self):
         """ Verifies that the data returned is the same as data stored"""
 
@@ -189,10 +506,41 @@ class APITest(testing.TestCase):
 
         response = self.client.post('/builds/new', data=dict(build_id=str(build._id)))
 
-        api.worker.join()
+        api.queue.join()
 
         build.reload()
 
         self.assertEqual(build.status, 1)
-        self.assertTrue(api.worker.current_build is None)
+        self.assertEqual(api.dispatcher.current_builds(), [])
         self.assertEqual(response.json['id'], str(build._id))
+
+    def test_api_rebuild_changes_etag(self):
+        """ Verifies that a finished build that is queued again is read
+        again instead of answered from the ETags of finished builds """
+
+        build = Build()
+        build.status = 2
+        build.timings = {'save': 0.01}
+        build.save()
+        etag = self.client.get('/builds/%s' % build._id).headers['ETag']
+
+        with patch.object(api.queue, 'add_build'):
+            self.client.post('/builds/new', data=dict(build_id=str(build._id)))
+
+        response = self.client.get('/builds/%s' % build._id,
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['status'], 0)
+
+    def test_api_rebuild_of_queued_build_is_refused(self):
+        """ Verifies that a build that is still queued or being built is not
+        queued a second time """
+
+        build = Build()
+        build.save()
+
+        with patch.object(api.queue, 'add_build') as add_build:
+            response = self.client.post('/builds/new', data=dict(build_id=str(build._id)))
+
+        self.assertEqual(response.json['error'], "Build is already queued")
+        self.assertFalse(add_build.called)
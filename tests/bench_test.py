@@ -0,0 +1,50 @@
+"""
+Test cases for the helpers of the benchmark suite. The benchmarks themselves
+are not run here.
+
+WHITEBOX TESTING:
+
+    def test_record_summarizes_times(self):
+    def test_throughput_of_total(self):
+    def test_compare_matches_name_and_params(self):
+    def test_payload_is_a_valid_build(self):
+"""
+
+import unittest
+from rosie.benchmarks.bench import record, throughput, compare, payload
+from rosie.models import connection
+
+class BenchmarkHelpersTest(unittest.TestCase):
+    """Test cases for the benchmark helpers"""
+
+    def test_record_summarizes_times(self):
+        result = record('build.to_json', dict(), [0.3, 0.1, 0.2, 0.4])
+
+        self.assertEqual(result['iterations'], 4)
+        self.assertAlmostEqual(result['mean'], 0.25)
+        self.assertEqual(result['p50'], 0.3)
+        self.assertEqual(result['p95'], 0.4)
+        self.assertAlmostEqual(result['ops_per_second'], 4.0)
+
+    def test_throughput_of_total(self):
+        result = throughput('queue.memory', dict(producers=1), 100, 2.0)
+
+        self.assertEqual(result['mean'], 0.02)
+        self.assertEqual(result['ops_per_second'], 50.0)
+
+    def test_compare_matches_name_and_params(self):
+        before = dict(results=[record('api.blame', dict(documents=1000), [1.0]),
+                               record('api.blame', dict(documents=10000), [2.0])])
+        after = dict(results=[record('api.blame', dict(documents=10000), [3.0]),
+                              record('api.builds', dict(documents=10000), [1.0])])
+
+        lines = compare(before, after)
+        self.assertEqual(len(lines), 1)
+        self.assertTrue('"documents": 10000' in lines[0])
+        self.assertTrue(lines[0].endswith('+50.0%'))
+
+    def test_payload_is_a_valid_build(self):
+        build = connection.Build(payload(7))
+
+        self.assertEqual(build.repository.name, u'cli')
+        self.assertTrue(build.url.endswith('/commit/%040x' % 7))
@@ -0,0 +1,95 @@
+"""
+Test cases for the blame counts. These tests run against the local MongoDB.
+
+BLACKBOX TESTING:
+
+    def test_aggregated_counts_per_author(self):
+    def test_aggregated_counts_for_window_and_repository(self):
+    def test_counters_count_recorded_failures(self):
+    def test_counters_for_window_and_repository(self):
+    def test_rebuilt_counters_match_aggregation(self):
+
+WHITEBOX TESTING:
+
+    def test_record_failure_without_author_does_nothing(self):
+"""
+
+import unittest
+from datetime import datetime, timedelta
+from rosie.models import (
+    blame_counts,
+    record_failure,
+    rebuild_blame_counters,
+    connection
+)
+
+Build = connection.Build
+
+class BlameTest(unittest.TestCase):
+    """Test cases for blame counts"""
+
+    def setUp(self):
+        """ Configure blame to use the counters """
+        self.configs = dict(BLAME_COUNTERS=True)
+
+    def tearDown(self):
+        """ Remove all builds and counters """
+        connection.Build.collection.remove()
+        connection.rosie.blame.remove()
+
+    def failed_build(self, author, repository=u'rosie', days_ago=0):
+        build = Build()
+        build.status = 2
+        build.author.name = author
+        build.repository.name = repository
+        build.build_time = datetime.utcnow() - timedelta(days=days_ago)
+        build.save()
+        return build
+
+    def test_aggregated_counts_per_author(self):
+        for author in [u'dunvi', u'dunvi', u'jessepollak']:
+            self.failed_build(author)
+        passed = Build()
+        passed.status = 1
+        passed.author.name = u'brennenbyrne'
+        passed.save()
+
+        self.assertEqual(blame_counts(), dict(dunvi=2, jessepollak=1))
+
+    def test_aggregated_counts_for_window_and_repository(self):
+        self.failed_build(u'dunvi', days_ago=10)
+        self.failed_build(u'dunvi', repository=u'other')
+        self.failed_build(u'dunvi')
+
+        since = datetime.utcnow() - timedelta(days=1)
+        self.assertEqual(blame_counts(since=since, repository=u'rosie'), dict(dunvi=1))
+
+    def test_counters_count_recorded_failures(self):
+        for author in [u'dunvi', u'dunvi', u'jessepollak']:
+            record_failure(self.failed_build(author))
+
+        self.assertEqual(blame_counts(configs=self.configs), dict(dunvi=2, jessepollak=1))
+        self.assertEqual(connection.rosie.blame.find().count(), 2)
+
+    def test_counters_for_window_and_repository(self):
+        record_failure(self.failed_build(u'dunvi', days_ago=10))
+        record_failure(self.failed_build(u'dunvi', repository=u'other'))
+        record_failure(self.failed_build(u'dunvi'))
+
+        since = datetime.utcnow() - timedelta(days=1)
+        self.assertEqual(blame_counts(since=since, repository=u'rosie', configs=self.configs),
+                         dict(dunvi=1))
+
+    def test_rebuilt_counters_match_aggregation(self):
+        self.failed_build(u'dunvi', days_ago=3)
+        self.failed_build(u'dunvi')
+        self.failed_build(u'jessepollak', repository=u'other')
+
+        rebuild_blame_counters()
+
+        self.assertEqual(blame_counts(configs=self.configs), blame_counts())
+
+    def test_record_failure_without_author_does_nothing(self):
+        record_failure(Build())
+
+        self.assertEqual(connection.rosie.blame.find().count(), 0)
@@ -0,0 +1,82 @@
+"""
+Test cases for the BuildLog class. These tests run against the local MongoDB.
+
+BLACKBOX TESTING:
+
+    def test_written_log_can_be_read(self):
+    def test_read_from_offset(self):
+    def test_unflushed_output_is_not_visible(self):
+    def test_rebuilt_build_has_only_new_log(self):
+
+WHITEBOX TESTING:
+
+    def test_log_is_stored_in_chunks(self):
+    def test_tail_is_bounded(self):
+    def test_tail_starts_at_a_character(self):
+"""
+
+import unittest
+from mongokit import ObjectId
+from rosie.models import (
+    BuildLog,
+    connection
+)
+
+class BuildLogTest(unittest.TestCase):
+    """Test cases for BuildLog"""
+
+    def setUp(self):
+        """ Create a log with small chunks """
+        self.configs = dict(BUILD_LOG_CHUNK_SIZE=10, BUILD_LOG_TAIL_SIZE=8)
+        self.build_id = ObjectId()
+        self.log = BuildLog(self.build_id, self.configs)
+
+    def tearDown(self):
+        """ Remove all chunks """
+        connection.rosie.build_logs.remove()
+
+    def test_written_log_can_be_read(self):
+        self.log.write('hello ')
+        self.log.write('world\n')
+        self.log.close()
+
+        self.assertEqual(BuildLog.read(self.build_id), ('hello world\n', 12))
+
+    def test_read_from_offset(self):
+        self.log.write('0123456789abcdefghij')
+        self.log.close()
+
+        self.assertEqual(BuildLog.read(self.build_id, 15), ('fghij', 20))
+        self.assertEqual(BuildLog.read(self.build_id, 20), ('', 20))
+
+    def test_unflushed_output_is_not_visible(self):
+        self.log.write('abc')
+
+        self.assertEqual(BuildLog.read(self.build_id), ('', 0))
+
+    def test_rebuilt_build_has_only_new_log(self):
+        self.log.write('the first run printed a lot\n')
+        self.log.close()
+
+        log = BuildLog(self.build_id, self.configs)
+        log.write('rebuilt\n')
+        log.close()
+
+        self.assertEqual(BuildLog.read(self.build_id), ('rebuilt\n', 8))
+
+    def test_log_is_stored_in_chunks(self):
+        for i in range(5):
+            self.log.write('0123456789')
+
+        self.assertEqual(connection.rosie.build_logs.find().count(), 5)
+        self.assertEqual(self.log.buffered, 0)
+
+    def test_tail_is_bounded(self):
+        self.log.write('0123456789abcdefghij')
+
+        self.assertEqual(self.log.tail, 'cdefghij')
+
+    def test_tail_starts_at_a_character(self):
+        self.log.write('ab' + '\xc3\xa9' * 4 + 'c')
+
+        self.assertEqual(self.log.tail, '\xc3\xa9' * 3 + 'c')
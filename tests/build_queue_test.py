@@ -11,6 +11,9 @@ WHITEBOX TESTING:
     def test_next_build_returns_if_if_builds(self):
     def test_next_build_returns_false_if_empty(self):
     def test_add_build_adds_build(self):
+    def test_add_builds_adds_all_builds(self):
+    def test_next_builds_returns_up_to_count(self):
+    def test_next_builds_raises_exception_if_empty(self):
     def test_can_be_accessed_from_multiple_threads(self):
 
 BLACKBOX TESTING:
@@ -77,6 +80,24 @@ class BuildQueueTest(unittest.TestCase):
         self.assertTrue(self.queue.has_builds())
         self.assertEqual(1, self.queue.next_build())
 
+    def test_add_builds_adds_all_builds(self, Build):
+        """ Verifies that add_builds queues every build in order, and that
+        each of them counts as unfinished """
+        self.queue.add_builds([dict(_id=i) for i in range(3)])
+        self.assertEqual(self.queue.next_builds(5), [0, 1, 2])
+        self.assertEqual(self.queue.unfinished_tasks, 3)
+
+    def test_next_builds_returns_up_to_count(self, Build):
+        """ Verifies that next_builds drains at most count ids in order """
+        for i in range(5):
+            self.queue.add_build(i)
+        self.assertEqual(self.queue.next_builds(3), [0, 1, 2])
+        self.assertEqual(self.queue.next_builds(3), [3, 4])
+
+    def test_next_builds_raises_exception_if_empty(self, Build):
+        with self.assertRaises(Queue.Empty):
+            self.queue.next_builds(3)
+
     def test_can_be_accessed_from_multiple_threads(self, Build):
         """ Verifies that the Queue can be accessed and updated
         from multiple threads (ApplicationServer, WorkerThread for example)
@@ -12,6 +12,9 @@ following tests:
     def test_build_retrieval
     def test_multiple_build_retrieval
     def test_update_existing_build
+    def test_get_many_returns_builds_in_order
+    def test_indexes_are_created
+    def test_expand_push_modes
 
     While other tests existed at some point, they were unnecessary
     as they consisted of the same code again! this is because this
@@ -27,7 +30,9 @@ from bson.objectid import ObjectId
 from rosie.models import (
     Build,
     BuildErrorException,
-    connection
+    connection,
+    ensure_indexes,
+    expand_push
 )
 
 from mongokit import SchemaTypeError, StructureError
@@ -191,3 +196,55 @@ class BuildTest(unittest.TestCase):
 	 self.assertEqual(check['status'],2)
          self.assertEqual(check['error'],error_msg)
 
+    def test_get_many_returns_builds_in_order(self):
+         """ Tests that get_many returns the requested builds in the order
+             of the ids, with None for ids that match no build """
+         saved = []
+         for i in range(3):
+             build = Build.new_from_json(self.json)
+             build.save()
+             saved.append(build['_id'])
+
+         missing = ObjectId()
+         builds = Build.get_many([saved[2], missing, saved[0]])
+
+         self.assertEqual(builds[0]['_id'], saved[2])
+         self.assertEqual(builds[1], None)
+         self.assertEqual(builds[2]['_id'], saved[0])
+
+    def test_indexes_are_created(self):
+         """ Tests that ensure_indexes creates the indexes Build declares """
+         ensure_indexes()
+
+         keys = [info['key'] for info in Build.collection.index_information().values()]
+         self.assertTrue([('status', 1), ('build_time', -1)] in keys)
+         self.assertTrue([('repository.name', 1), ('ref', 1), ('build_time', -1)] in keys)
+         self.assertTrue([('repository.url', 1), ('ref', 1), ('build_time', -1)] in keys)
+         self.assertTrue([('author.name', 1), ('status', 1)] in keys)
+
+    def test_expand_push_modes(self):
+         """ Tests that a push payload is split into the payloads of the
+             commits to build, and that any other payload is left alone """
+         push = dict(self.json, commits=[
+             dict(url=u'https://github.com/cs181f/rosie/commit/%d' % i,
+                  author=dict(name=u'dunvi', email=u'dunvi@example.com', username=u'dunvi'),
+                  message=u'commit %d' % i, timestamp=u'2012-12-15T20:05:07-08:00')
+             for i in range(5)])
+
+         self.assertEqual(expand_push(self.json, 'all'), [self.json])
+
+         head = expand_push(push, 'head')
+         self.assertEqual(len(head), 1)
+         self.assertEqual(head[0]['url'], u'https://github.com/cs181f/rosie/commit/4')
+         self.assertEqual(head[0]['author'], dict(name=u'dunvi', email=u'dunvi@example.com'))
+         self.assertEqual(head[0]['ref'], self.json['ref'])
+         self.assertFalse('commits' in head[0])
+
+         messages = [payload['message'] for payload in expand_push(push, 'all')]
+         self.assertEqual(messages, [u'commit %d' % i for i in range(5)])
+
+         messages = [payload['message'] for payload in expand_push(push, 'every', 2)]
+         self.assertEqual(messages, [u'commit 0', u'commit 2', u'commit 4'])
+
+         with self.assertRaises(BuildErrorException):
+             expand_push(push, 'some')
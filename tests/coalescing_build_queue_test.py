@@ -0,0 +1,124 @@
+"""
+Test cases for CoalescingBuildQueue. The database is replaced by a mock
+connection, so we can check which builds are marked as superseded.
+
+BLACKBOX TESTING:
+
+    def test_builds_of_different_refs_are_kept(self):
+    def test_newer_build_replaces_queued_build_in_place(self):
+    def test_replaced_build_is_marked_superseded(self):
+    def test_builds_added_by_id_are_not_coalesced(self):
+    def test_rebuilds_are_not_coalesced(self):
+    def test_join_returns_after_coalesced_builds(self):
+    def test_add_builds_keeps_every_build_it_adds(self):
+    def test_push_of_every_commit_replaces_queued_push(self):
+
+WHITEBOX TESTING:
+
+    def test_requeued_build_does_not_supersede_itself(self):
+"""
+
+from mock import MagicMock
+
+import unittest
+import threading
+from rosie.models import CoalescingBuildQueue
+
+def build(id, ref=u'refs/heads/master', url=u'https://github.com/cs181f/rosie'):
+    return dict(_id=id, ref=ref, repository=dict(url=url))
+
+class CoalescingBuildQueueTest(unittest.TestCase):
+    """Test cases for CoalescingBuildQueue"""
+
+    def setUp(self):
+        """ Create a queue with a mock connection """
+        self.connection = MagicMock()
+        self.queue = CoalescingBuildQueue(dict(), self.connection)
+        self.update = self.connection.Build.collection.update
+
+    def test_builds_of_different_refs_are_kept(self):
+        self.queue.add_build(build(1))
+        self.queue.add_build(build(2, ref=u'refs/heads/feature'))
+        self.queue.add_build(build(3, url=u'https://github.com/cs181f/other'))
+
+        self.assertEqual(self.queue.next_builds(5), [1, 2, 3])
+        self.assertFalse(self.update.called)
+
+    def test_newer_build_replaces_queued_build_in_place(self):
+        self.queue.add_build(build(1))
+        self.queue.add_build(build(2, ref=u'refs/heads/feature'))
+        self.queue.add_build(build(3))
+        self.queue.add_build(build(4))
+
+        self.assertEqual(self.queue.next_builds(5), [4, 2])
+
+    def test_replaced_build_is_marked_superseded(self):
+        self.queue.add_build(build(1))
+        self.queue.add_build(build(2))
+
+        self.update.assert_called_once_with(
+            {'_id': 1, 'status': 0},
+            {'$set': {'status': 3, 'superseded_by': 2}})
+
+    def test_builds_added_by_id_are_not_coalesced(self):
+        self.queue.add_build(1)
+        self.queue.add_build(2)
+
+        self.assertEqual(self.queue.next_builds(5), [1, 2])
+
+    def test_rebuilds_are_not_coalesced(self):
+        self.queue.add_build(build(1))
+        self.queue.add_build(build(2), trigger='rebuild')
+        self.queue.add_build(build(3))
+
+        self.assertEqual(self.queue.next_builds(5), [3, 2])
+        self.update.assert_called_once_with(
+            {'_id': 1, 'status': 0},
+            {'$set': {'status': 3, 'superseded_by': 3}})
+
+    def test_add_builds_keeps_every_build_it_adds(self):
+        self.queue.add_builds([build(1), build(2, ref=u'refs/heads/feature'), build(3)])
+
+        self.assertEqual(self.queue.next_builds(5), [1, 3, 2])
+        self.assertFalse(self.update.called)
+
+    def test_push_of_every_commit_replaces_queued_push(self):
+        """ Verifies that the builds of a push with PUSH_BUILDS = 'all' are
+        all queued, and are all superseded by the next push of their ref """
+        self.queue.add_builds([build(1), build(2), build(3)])
+        self.queue.add_build(build(4, ref=u'refs/heads/feature'))
+        self.assertEqual(self.queue.next_build(), 1)
+
+        self.queue.add_builds([build(5), build(6)])
+
+        self.assertEqual(self.queue.next_builds(5), [5, 6, 4])
+        self.assertEqual(self.update.call_count, 2)
+        for build_id in (2, 3):
+            self.update.assert_any_call(
+                {'_id': build_id, 'status': 0},
+                {'$set': {'status': 3, 'superseded_by': 6}})
+        self.queue.complete_build(1)
+        for build_id in (5, 6, 4):
+            self.queue.complete_build(build_id)
+        joined = threading.Thread(target=self.queue.join)
+        joined.start()
+        joined.join(5)
+        self.assertFalse(joined.is_alive())
+
+    def test_join_returns_after_coalesced_builds(self):
+        """ Verifies that a replaced build does not count as unfinished """
+        for i in range(3):
+            self.queue.add_build(build(i))
+        self.queue.complete_build(self.queue.next_build())
+
+        joined = threading.Thread(target=self.queue.join)
+        joined.start()
+        joined.join(5)
+        self.assertFalse(joined.is_alive())
+
+    def test_requeued_build_does_not_supersede_itself(self):
+        self.queue.add_build(build(1))
+        self.queue.add_build(build(1))
+
+        self.assertEqual(self.queue.next_builds(5), [1])
+        self.assertFalse(self.update.called)
@@ -0,0 +1,114 @@
+"""
+Test cases for the DependencyCache class. The build directories and the
+cache are temporary directories.
+
+BLACKBOX TESTING:
+
+    def test_first_build_misses_and_saves(self):
+    def test_unchanged_lockfile_hits(self):
+    def test_changed_lockfile_misses(self):
+    def test_path_without_lockfile_is_not_cached(self):
+    def test_old_entries_are_evicted(self):
+    def test_least_recently_used_entries_are_evicted(self):
+
+WHITEBOX TESTING:
+
+    def test_restore_replaces_existing_directory(self):
+"""
+
+import unittest
+import tempfile
+import shutil
+import time
+import os
+from rosie.models import DependencyCache
+
+class DependencyCacheTest(unittest.TestCase):
+    """Test cases for DependencyCache"""
+
+    def setUp(self):
+        """ Create a cache and a build directory with a lockfile """
+        self.directory = tempfile.mkdtemp()
+        self.configs = dict(DEPENDENCY_CACHE_ROOT=os.path.join(self.directory, 'cache'),
+                            DEPENDENCY_CACHE_PATHS={'.deps': ['requirements.txt']},
+                            PRE_BUILD_HOOK='pip install --target .deps -r requirements.txt')
+        self.cache = DependencyCache(self.configs)
+
+    def tearDown(self):
+        """ Remove everything that was created """
+        shutil.rmtree(self.directory)
+
+    def build_directory(self, requirements='requests==0.10.6\n'):
+        directory = tempfile.mkdtemp(dir=self.directory)
+        if requirements is not None:
+            self.write(directory, 'requirements.txt', requirements)
+        return directory
+
+    def write(self, directory, filename, contents):
+        path = os.path.join(directory, filename)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def install(self, directory):
+        entries = self.cache.restore(directory)
+        if not os.path.exists(os.path.join(directory, '.deps')):
+            self.write(directory, '.deps/requests/__init__.py', 'installed')
+        self.cache.save(directory, entries)
+        return entries
+
+    def test_first_build_misses_and_saves(self):
+        entries = self.install(self.build_directory())
+
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['path'], '.deps')
+        self.assertFalse(entries[0]['hit'])
+        self.assertTrue(os.path.isdir(os.path.join(self.cache.root, entries[0]['key'])))
+
+    def test_unchanged_lockfile_hits(self):
+        self.install(self.build_directory())
+        directory = self.build_directory()
+        entries = self.cache.restore(directory)
+
+        self.assertTrue(entries[0]['hit'])
+        self.assertTrue(entries[0]['restore_time'] >= 0)
+        with open(os.path.join(directory, '.deps/requests/__init__.py')) as f:
+            self.assertEqual(f.read(), 'installed')
+
+    def test_changed_lockfile_misses(self):
+        self.install(self.build_directory())
+        entries = self.cache.restore(self.build_directory('requests==1.0\n'))
+
+        self.assertFalse(entries[0]['hit'])
+
+    def test_path_without_lockfile_is_not_cached(self):
+        self.assertEqual(self.install(self.build_directory(None)), [])
+        self.assertEqual(os.listdir(self.cache.root), [])
+
+    def test_old_entries_are_evicted(self):
+        key = self.install(self.build_directory())[0]['key']
+        long_ago = time.time() - 3600
+        os.utime(os.path.join(self.cache.root, key), (long_ago, long_ago))
+        self.cache.max_age = 60
+
+        self.assertEqual(self.cache.evict(), [key])
+        self.assertEqual(os.listdir(self.cache.root), [])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        old = self.install(self.build_directory())[0]['key']
+        long_ago = time.time() - 60
+        os.utime(os.path.join(self.cache.root, old), (long_ago, long_ago))
+        new = self.install(self.build_directory('requests==1.0\n'))[0]['key']
+        self.cache.max_size = len('installed')
+
+        self.assertEqual(self.cache.evict(), [old])
+        self.assertEqual(os.listdir(self.cache.root), [new])
+
+    def test_restore_replaces_existing_directory(self):
+        self.install(self.build_directory())
+        directory = self.build_directory()
+        self.write(directory, '.deps/stale.py', 'stale')
+        self.cache.restore(directory)
+
+        self.assertEqual(os.listdir(os.path.join(directory, '.deps')), ['requests'])
@@ -0,0 +1,170 @@
+"""
+Test cases for the Dispatcher class. In these test cases, we verify that the
+Dispatcher keeps a pool of persistent WorkerThreads that build everything that
+is pushed onto the BuildQueue without being restarted.
+
+WHITEBOX TESTING:
+
+    def test_start_creates_configured_number_of_workers(self):
+    def test_start_twice_does_not_add_workers(self):
+    def test_stop_terminates_workers(self):
+    def test_result_writer_is_shared_when_batching(self):
+
+BLACKBOX TESTING:
+
+    def test_workers_build_builds_added_after_start(self):
+    def test_is_building_reflects_workers(self):
+    def test_worker_states_counts_busy_and_idle(self):
+    def test_cancel_superseded_cancels_same_ref(self):
+    def test_status_of_worker_finishing_meanwhile(self):
+"""
+
+# Library to enable mocking of classes
+from mock import patch, MagicMock
+
+import unittest
+from rosie.models import (
+    BuildQueue,
+    Build,
+    Dispatcher,
+    WorkerThread
+)
+
+class DispatcherTest(unittest.TestCase):
+    """Test cases for Dispatcher"""
+
+    def setUp(self):
+        """ Create a queue and a dispatcher with a small pool """
+        self.queue = BuildQueue()
+        self.configs = dict(WORKER_COUNT=3, WORKER_POLL_INTERVAL=0.05)
+        self.dispatcher = Dispatcher(self.queue, self.configs)
+
+    def tearDown(self):
+        """ Stop any workers that are still running """
+        self.dispatcher.stop()
+
+    def test_start_creates_configured_number_of_workers(self):
+        """ Verifies that WORKER_COUNT persistent workers are started """
+        self.dispatcher.start()
+
+        self.assertEqual(len(self.dispatcher.workers), 3)
+        for worker in self.dispatcher.workers:
+            self.assertTrue(worker.persistent)
+            self.assertTrue(worker.is_alive())
+
+    def test_start_twice_does_not_add_workers(self):
+        """ Verifies that starting a running Dispatcher is a no-op """
+        self.dispatcher.start()
+        self.dispatcher.start()
+
+        self.assertEqual(len(self.dispatcher.workers), 3)
+
+    def test_stop_terminates_workers(self):
+        """ Verifies that stop() shuts every worker down """
+        self.dispatcher.start()
+        workers = list(self.dispatcher.workers)
+        self.dispatcher.stop()
+
+        self.assertEqual(self.dispatcher.workers, [])
+        for worker in workers:
+            self.assertFalse(worker.is_alive())
+
+    def test_result_writer_is_shared_when_batching(self):
+        """ Verifies that with RESULT_WRITE_BATCHING every worker stores its
+        results through the one ResultWriter, which stops with the pool """
+        self.dispatcher = Dispatcher(self.queue, dict(self.configs, RESULT_WRITE_BATCHING=True))
+        self.dispatcher.start()
+        writer = self.dispatcher.result_writer
+
+        self.assertTrue(writer.is_alive())
+        for worker in self.dispatcher.workers:
+            self.assertIs(worker.result_writer, writer)
+
+        self.dispatcher.stop(5)
+        self.assertFalse(writer.is_alive())
+
+    def test_workers_build_builds_added_after_start(self):
+        """ Verifies that builds pushed after the pool is started are built
+        by the already running workers """
+        with patch.object(WorkerThread, '_save_result') as save:
+            builds = []
+            for i in range(5):
+                build = Build()
+                build['_id'] = i
+                builds.append(build)
+
+            with patch.object(WorkerThread, '_retrieve_build') as mock1:
+                mock1.side_effect = lambda key: builds[key]
+
+                with patch.object(WorkerThread, '_bash_build') as mock2:
+                    mock2.return_value = True
+                    self.dispatcher.start()
+                    workers = list(self.dispatcher.workers)
+
+                    for b in builds:
+                        self.queue.add_build(b)
+                    self.queue.join()
+
+            for b in builds:
+                self.assertEqual(b.status, 1)
+            self.assertEqual(self.dispatcher.workers, workers)
+            self.assertEqual(self.dispatcher.current_builds(), [])
+
+    def test_is_building_reflects_workers(self):
+        """ Verifies that the Dispatcher is building if any worker is """
+        self.dispatcher.start()
+        self.assertFalse(self.dispatcher.is_building())
+
+        with patch.object(WorkerThread, 'is_building') as mock:
+            mock.return_value = True
+            self.assertTrue(self.dispatcher.is_building())
+
+    def test_worker_states_counts_busy_and_idle(self):
+        """ Verifies that the busy and idle WorkerThreads add up to the pool """
+        busy, idle = MagicMock(), MagicMock()
+        busy.is_building.return_value = True
+        idle.is_building.return_value = False
+        self.dispatcher.workers = [busy, idle, idle]
+
+        self.assertEqual(self.dispatcher.worker_states(), dict(busy=1, idle=2))
+        self.dispatcher.workers = []
+
+    def test_cancel_superseded_cancels_same_ref(self):
+        """ Verifies that only the running builds of the same repository and
+        ref as the newer build are cancelled """
+        def build(id, ref):
+            return dict(_id=id, ref=ref, repository=dict(url=u'https://github.com/cs181f/rosie'))
+
+        same, other, idle = MagicMock(), MagicMock(), MagicMock()
+        same.current_build = build(1, u'refs/heads/master')
+        other.current_build = build(2, u'refs/heads/feature')
+        idle.current_build = None
+        self.dispatcher.workers = [same, other, idle]
+
+        self.dispatcher.cancel_superseded(build(3, u'refs/heads/master'))
+        self.dispatcher.workers = []
+
+        same.cancel.assert_called_once_with(1, 3)
+        self.assertFalse(other.cancel.called)
+        self.assertFalse(idle.cancel.called)
+
+    def test_status_of_worker_finishing_meanwhile(self):
+        """ Verifies that a worker that finishes its build while /ping looks
+        at it is either building it or idle """
+        class FinishingWorker(object):
+            # has a build the first time it is asked, and none after that
+            def __init__(self):
+                self.builds = [dict(_id=1)]
+
+            @property
+            def current_build(self):
+                return self.builds.pop() if self.builds else None
+
+            def is_building(self):
+                return True
+
+        self.dispatcher.workers = [FinishingWorker()]
+        status = self.dispatcher.status()
+        self.dispatcher.workers = []
+
+        self.assertEqual(status, dict(building=True, builds=['1']))
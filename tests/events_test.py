@@ -0,0 +1,99 @@
+"""
+Test cases for the EventBus. In these test cases, we verify that events are
+handed to the subscribers of their build and of every build, in order, that
+new and resuming subscribers get what they missed, and that slow subscribers
+cannot hold up publishing.
+
+WHITEBOX TESTING:
+
+    def test_last_event_is_kept_per_build(self):
+    def test_unsubscribe_stops_events(self):
+
+BLACKBOX TESTING:
+
+    def test_subscribers_get_events_of_their_build(self):
+    def test_subscriber_to_build_gets_its_last_event_first(self):
+    def test_resuming_subscriber_gets_missed_events(self):
+    def test_slow_subscriber_loses_oldest_events(self):
+    def test_get_waits_for_event(self):
+    def test_format_event(self):
+"""
+
+import unittest
+import threading
+import json
+from rosie.models import (
+    EventBus,
+    Subscription,
+    format_event
+)
+
+class EventBusTest(unittest.TestCase):
+    """Test cases for EventBus"""
+
+    def setUp(self):
+        """ Create an event bus of its own """
+        self.events = EventBus(backlog=10, recent=2)
+
+    def test_subscribers_get_events_of_their_build(self):
+        one = self.events.subscribe(Subscription('1'))
+        every = self.events.subscribe(Subscription())
+        self.events.publish('started', '1', status=0)
+        self.events.publish('started', '2', status=0)
+
+        self.assertEqual([(e['type'], e['id']) for e in one.get(0)], [('started', '1')])
+        self.assertEqual([e['id'] for e in every.get(0)], ['1', '2'])
+        self.assertEqual(self.events.watchers(), 2)
+
+    def test_subscriber_to_build_gets_its_last_event_first(self):
+        self.events.publish('started', '1', status=0)
+        self.events.publish('stage', '1', stage='test_command')
+        one = self.events.subscribe(Subscription('1'))
+
+        self.assertEqual([e['type'] for e in one.get(0)], ['stage'])
+        self.assertEqual(self.events.subscribe(Subscription()).get(0), [])
+
+    def test_resuming_subscriber_gets_missed_events(self):
+        for i in range(5):
+            self.events.publish('stage', str(i % 2), stage=str(i))
+        one = self.events.subscribe(Subscription('0'), after=1)
+
+        self.assertEqual([e['seq'] for e in one.get(0)], [3, 5])
+
+    def test_slow_subscriber_loses_oldest_events(self):
+        slow = self.events.subscribe(Subscription(None, size=3))
+        for i in range(5):
+            self.events.publish('started', str(i), status=0)
+
+        self.assertEqual([e['seq'] for e in slow.get(0)], [3, 4, 5])
+
+    def test_get_waits_for_event(self):
+        subscription = self.events.subscribe(Subscription('1'))
+        timer = threading.Timer(0.1, self.events.publish, ('finished', '1'), dict(status=1))
+        timer.start()
+
+        self.assertEqual([e['type'] for e in subscription.get(5)], ['finished'])
+        self.assertEqual(subscription.get(0.01), [])
+
+    def test_last_event_is_kept_per_build(self):
+        for i in range(3):
+            self.events.publish('started', str(i), status=0)
+
+        self.assertEqual(self.events.last_event('0'), None)
+        self.assertEqual(self.events.last_event('2')['seq'], 3)
+
+    def test_unsubscribe_stops_events(self):
+        subscription = self.events.subscribe(Subscription('1'))
+        self.events.unsubscribe(subscription)
+        self.events.publish('started', '1', status=0)
+
+        self.assertEqual(subscription.get(0), [])
+        self.assertEqual(self.events.watchers(), 0)
+
+    def test_format_event(self):
+        event = self.events.publish('finished', '1', status=2)
+        lines = format_event(event).split('\n')
+
+        self.assertEqual(lines[:2], ['id: 1', 'event: finished'])
+        self.assertEqual(json.loads(lines[2][len('data: '):])['status'], 2)
+        self.assertTrue(format_event(event).endswith('\n\n'))
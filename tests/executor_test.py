@@ -0,0 +1,292 @@
+"""
+Test cases for the BuildExecutor class. In these test cases, we verify that the
+configured steps are run as real subprocesses, that their output is streamed
+into the log, and that failures, timeouts and resource limits are reported.
+The BuildLog is replaced by a FakeLog, so these tests do not need MongoDB.
+
+BLACKBOX TESTING:
+
+    def test_build_without_steps_passes(self):
+    def test_passing_steps_return_true(self):
+    def test_failing_test_command_returns_error(self):
+    def test_error_of_binary_output_is_text(self):
+    def test_failing_pre_build_hook_skips_test_command(self):
+    def test_post_build_hook_runs_after_failure(self):
+    def test_missing_build_directory_fails_build(self):
+    def test_unknown_rlimit_fails_build(self):
+    def test_output_is_streamed_into_log(self):
+    def test_environment_is_passed_to_steps(self):
+    def test_timeout_kills_build(self):
+    def test_post_build_hook_runs_after_timeout(self):
+    def test_post_build_hook_times_out(self):
+    def test_cancel_kills_build(self):
+    def test_dependencies_are_cached_after_pre_build_hook(self):
+    def test_dependencies_are_not_cached_without_build_directory(self):
+    def test_shards_run_at_the_same_time(self):
+    def test_failing_shard_fails_build(self):
+    def test_long_shard_lines_are_not_held_back(self):
+    def test_test_files_are_dealt_out_over_shards(self):
+    def test_only_selected_tests_are_run(self):
+    def test_steps_are_timed(self):
+    def test_steps_are_announced(self):
+
+WHITEBOX TESTING:
+
+    def test_rlimits_are_applied(self):
+    def test_started_shards_are_killed_when_one_cannot_start(self):
+"""
+
+import unittest
+import threading
+import tempfile
+import shutil
+import time
+import os
+from rosie.models import BuildExecutor
+
+class FakeLog(object):
+    """ Keeps the log in memory instead of MongoDB """
+    def __init__(self):
+        self.data = ''
+        self.tail = ''
+        self.flushed_at = time.time()
+
+    def write(self, data):
+        self.data += data
+        self.tail = self.data[-4096:]
+
+    def flush(self):
+        self.flushed_at = time.time()
+
+class BuildExecutorTest(unittest.TestCase):
+    """Test cases for BuildExecutor"""
+
+    def setUp(self):
+        """ Create a log to run builds against """
+        self.log = FakeLog()
+
+    def run_build(self, **configs):
+        return BuildExecutor(configs, self.log).run()
+
+    def test_build_without_steps_passes(self):
+        self.assertTrue(self.run_build())
+
+    def test_passing_steps_return_true(self):
+        result = self.run_build(PRE_BUILD_HOOK='true', TEST_COMMAND='true',
+                                POST_BUILD_HOOK='true')
+        self.assertEqual(result, True)
+
+    def test_failing_test_command_returns_error(self):
+        result = self.run_build(TEST_COMMAND='echo broken; exit 3')
+
+        self.assertEqual(type(result), unicode)
+        self.assertTrue(result.startswith('The test command exited with status 3.'))
+        self.assertTrue('broken' in result)
+
+    def test_error_of_binary_output_is_text(self):
+        result = self.run_build(TEST_COMMAND="printf 'caf\\303\\251 \\377'; exit 1")
+
+        self.assertEqual(type(result), unicode)
+        self.assertTrue(result.endswith(u'caf\xe9 \ufffd'))
+
+    def test_failing_pre_build_hook_skips_test_command(self):
+        result = self.run_build(PRE_BUILD_HOOK='exit 1', TEST_COMMAND='echo tested')
+
+        self.assertTrue(result.startswith('The pre-build hook exited with status 1.'))
+        self.assertFalse('tested\n' in self.log.data)
+
+    def test_post_build_hook_runs_after_failure(self):
+        result = self.run_build(TEST_COMMAND='exit 1', POST_BUILD_HOOK='echo cleaned')
+
+        self.assertTrue(result.startswith('The test command exited'))
+        self.assertTrue('cleaned\n' in self.log.data)
+
+    def test_missing_build_directory_fails_build(self):
+        result = self.run_build(TEST_COMMAND='true',
+                                BUILD_DIRECTORY='/nonexistent/rosie/build')
+
+        self.assertTrue(result.startswith('The test command could not be started'))
+
+    def test_unknown_rlimit_fails_build(self):
+        result = self.run_build(TEST_COMMAND='true', BUILD_RLIMITS=dict(RLIMIT_ROSIE=1))
+
+        self.assertTrue(result.startswith('The test command could not be started'))
+
+    def test_output_is_streamed_into_log(self):
+        self.run_build(TEST_COMMAND='echo out; echo err 1>&2')
+
+        self.assertTrue('out\n' in self.log.data)
+        self.assertTrue('err\n' in self.log.data)
+
+    def test_environment_is_passed_to_steps(self):
+        executor = BuildExecutor(dict(TEST_COMMAND='echo $ROSIE_REF'), self.log)
+        executor.run(env=dict(ROSIE_REF='refs/heads/master'))
+
+        self.assertTrue('refs/heads/master\n' in self.log.data)
+
+    def test_timeout_kills_build(self):
+        start = time.time()
+        executor = BuildExecutor(dict(TEST_COMMAND='sleep 30', BUILD_TIMEOUT=0.5), self.log)
+        result = executor.run()
+
+        self.assertTrue(time.time() - start < 10)
+        self.assertTrue(result.startswith('The test command timed out'))
+        self.assertTrue(executor.interrupted)
+
+    def test_post_build_hook_runs_after_timeout(self):
+        result = self.run_build(TEST_COMMAND='sleep 30', POST_BUILD_HOOK='echo post ran',
+                                BUILD_TIMEOUT=0.5)
+
+        self.assertTrue(result.startswith('The test command timed out'))
+        self.assertTrue('post ran\n' in self.log.data)
+
+    def test_post_build_hook_times_out(self):
+        start = time.time()
+        result = self.run_build(TEST_COMMAND='true', POST_BUILD_HOOK='sleep 30',
+                                POST_BUILD_HOOK_TIMEOUT=0.5)
+
+        self.assertTrue(time.time() - start < 10)
+        self.assertEqual(result.split('\n')[0],
+                         'The post-build hook timed out after 0.5 seconds.')
+
+    def test_cancel_kills_build(self):
+        executor = BuildExecutor(dict(TEST_COMMAND='sleep 30', POST_BUILD_HOOK='echo post'),
+                                 self.log)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(executor.run()))
+        thread.start()
+        time.sleep(0.5)
+        executor.cancel()
+        thread.join(10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(results[0].startswith('The build was cancelled.'))
+        self.assertFalse('post\n' in self.log.data)
+
+    def test_rlimits_are_applied(self):
+        self.run_build(TEST_COMMAND='ulimit -n', BUILD_RLIMITS=dict(RLIMIT_NOFILE=64))
+
+        self.assertTrue('\n64\n' in self.log.data)
+
+    def test_started_shards_are_killed_when_one_cannot_start(self):
+        executor = BuildExecutor(dict(), self.log)
+        start = time.time()
+        # an environment that is not all strings cannot be executed
+        result = executor.run_shards('test command', [('sleep 30', dict(os.environ)),
+                                                      ('true', dict(ROSIE_SHARD_INDEX=1))],
+                                     None, None)
+
+        self.assertTrue(time.time() - start < 10)
+        self.assertTrue(result.startswith('The test command could not be started'))
+        self.assertEqual(executor.processes, [])
+
+    def test_dependencies_are_cached_after_pre_build_hook(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        configs = dict(DEPENDENCY_CACHE_ROOT=os.path.join(root, 'cache'),
+                       DEPENDENCY_CACHE_PATHS={'.deps': ['requirements.txt']},
+                       PRE_BUILD_HOOK='test -d .deps || (mkdir .deps && echo installed)',
+                       TEST_COMMAND='test -d .deps')
+        for name in ('first', 'second'):
+            os.makedirs(os.path.join(root, name))
+            with open(os.path.join(root, name, 'requirements.txt'), 'w') as f:
+                f.write('requests\n')
+
+        first = BuildExecutor(configs, self.log)
+        self.assertTrue(first.run(cwd=os.path.join(root, 'first')))
+        second = BuildExecutor(configs, self.log)
+        self.assertTrue(second.run(cwd=os.path.join(root, 'second')))
+
+        self.assertFalse(first.dependencies[0]['hit'])
+        self.assertTrue(second.dependencies[0]['hit'])
+        self.assertEqual(self.log.data.count('installed\n'), 1)
+
+    def test_dependencies_are_not_cached_without_build_directory(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(root)
+        os.makedirs('.deps')
+        for filename in ('requirements.txt', os.path.join('.deps', 'installed')):
+            open(filename, 'w').close()
+        executor = BuildExecutor(dict(DEPENDENCY_CACHE_ROOT=os.path.join(root, 'cache'),
+                                      DEPENDENCY_CACHE_PATHS={'.deps': ['requirements.txt']},
+                                      PRE_BUILD_HOOK='true'), self.log)
+
+        self.assertEqual(executor.run(), True)
+        self.assertEqual(executor.dependencies, [])
+        self.assertEqual(os.listdir(os.path.join(root, 'cache')), [])
+        self.assertTrue(os.path.exists(os.path.join(root, '.deps', 'installed')))
+
+    def test_shards_run_at_the_same_time(self):
+        started = time.time()
+        result = self.run_build(TEST_SHARDS=3,
+                                TEST_COMMAND='sleep 1; echo "$ROSIE_SHARD_INDEX/$ROSIE_SHARD_TOTAL"')
+
+        self.assertTrue(result)
+        self.assertTrue(time.time() - started < 2.5)
+        for index in range(3):
+            self.assertTrue('[shard %d/3] %d/3\n' % (index + 1, index) in self.log.data)
+
+    def test_long_shard_lines_are_not_held_back(self):
+        executor = BuildExecutor(dict(TEST_SHARDS=2, TEST_COMMAND="head -c 20000 /dev/zero | "
+                                      "tr '\\0' x; sleep 30"), self.log)
+        thread = threading.Thread(target=executor.run)
+        thread.start()
+        try:
+            deadline = time.time() + 10
+            while self.log.data.count('x') < 2 * 16384 and time.time() < deadline:
+                time.sleep(0.1)
+            self.assertTrue(self.log.data.count('x') >= 2 * 16384)
+            self.assertTrue('[shard 2/2] xxx' in self.log.data)
+        finally:
+            executor.cancel()
+            thread.join(10)
+
+    def test_failing_shard_fails_build(self):
+        executor = BuildExecutor(dict(TEST_SHARDS=2, TEST_COMMAND='exit $ROSIE_SHARD_INDEX'),
+                                 self.log)
+        result = executor.run()
+
+        self.assertTrue(result.startswith(
+            'The test command exited with status 1 in shard 2 of 2.'))
+        self.assertEqual([shard['status'] for shard in executor.shards], [0, 1])
+        self.assertTrue(all(shard['duration'] >= 0 for shard in executor.shards))
+
+    def test_test_files_are_dealt_out_over_shards(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        os.makedirs(os.path.join(root, 'tests'))
+        for name in ('a', 'b', 'c'):
+            open(os.path.join(root, 'tests', '%s_test.py' % name), 'w').close()
+        executor = BuildExecutor(dict(TEST_SHARDS=4, TEST_SHARD_FILES='tests/*_test.py',
+                                      TEST_COMMAND='echo {files}'), self.log)
+
+        self.assertTrue(executor.run(cwd=root))
+        self.assertEqual(len(executor.shards), 3)
+        self.assertTrue('[shard 1/3] tests/a_test.py\n' in self.log.data)
+        self.assertTrue('[shard 3/3] tests/c_test.py\n' in self.log.data)
+
+    def test_only_selected_tests_are_run(self):
+        executor = BuildExecutor(dict(TEST_COMMAND='echo {files}'), self.log)
+
+        self.assertTrue(executor.run(tests=['tests/b_test.py', 'tests/c_test.py']))
+        self.assertTrue('\ntests/b_test.py tests/c_test.py\n' in self.log.data)
+        self.assertTrue(executor.run(tests=[]))
+        self.assertTrue(self.log.data.endswith('No tests are affected by the changes.\n'))
+
+    def test_steps_are_timed(self):
+        executor = BuildExecutor(dict(PRE_BUILD_HOOK='true', TEST_COMMAND='sleep 0.2'),
+                                 self.log)
+
+        self.assertTrue(executor.run())
+        self.assertEqual(sorted(executor.timings), ['pre-build hook', 'test command'])
+        self.assertTrue(executor.timings['test command'] >= 0.2)
+
+    def test_steps_are_announced(self):
+        steps = []
+        executor = BuildExecutor(dict(PRE_BUILD_HOOK='exit 1', TEST_COMMAND='true',
+                                      POST_BUILD_HOOK='true'), self.log, steps.append)
+
+        executor.run()
+        self.assertEqual(steps, ['pre-build hook', 'post-build hook'])
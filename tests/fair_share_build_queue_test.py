@@ -0,0 +1,106 @@
+"""
+Test cases for FairShareBuildQueue.
+
+BLACKBOX TESTING:
+
+    def test_repositories_are_served_round_robin(self):
+    def test_weights_give_more_builds_per_turn(self):
+    def test_max_running_holds_back_repository(self):
+    def test_complete_build_wakes_waiting_worker(self):
+    def test_positions_per_repository(self):
+
+WHITEBOX TESTING:
+
+    def test_join_returns_after_all_builds_completed(self):
+"""
+
+import unittest
+import threading
+import Queue
+from rosie.models import FairShareBuildQueue
+
+MONO = u'https://github.com/cs181f/monorepo'
+ROSIE = u'https://github.com/cs181f/rosie'
+OTHER = u'https://github.com/cs181f/other'
+
+def build(id, url):
+    return dict(_id=id, repository=dict(url=url))
+
+class FairShareBuildQueueTest(unittest.TestCase):
+    """Test cases for FairShareBuildQueue"""
+
+    def drain(self, queue):
+        builds = []
+        while queue.has_builds():
+            builds.append(queue.next_build())
+        return builds
+
+    def test_repositories_are_served_round_robin(self):
+        queue = FairShareBuildQueue()
+        for i in range(5):
+            queue.add_build(build('m%d' % i, MONO))
+        queue.add_build(build('r0', ROSIE))
+        queue.add_build(build('r1', ROSIE))
+        queue.add_build(build('o0', OTHER))
+
+        self.assertEqual(self.drain(queue), ['m0', 'r0', 'o0', 'm1', 'r1', 'm2', 'm3', 'm4'])
+
+    def test_weights_give_more_builds_per_turn(self):
+        queue = FairShareBuildQueue(dict(FAIR_SHARE_WEIGHTS={ROSIE: 2}))
+        for i in range(3):
+            queue.add_build(build('m%d' % i, MONO))
+            queue.add_build(build('r%d' % i, ROSIE))
+
+        self.assertEqual(self.drain(queue), ['m0', 'r0', 'r1', 'm1', 'r2', 'm2'])
+
+    def test_max_running_holds_back_repository(self):
+        queue = FairShareBuildQueue(dict(FAIR_SHARE_MAX_RUNNING={MONO: 1}))
+        for i in range(3):
+            queue.add_build(build('m%d' % i, MONO))
+        queue.add_build(build('r0', ROSIE))
+
+        self.assertEqual(self.drain(queue), ['m0', 'r0'])
+        with self.assertRaises(Queue.Empty):
+            queue.next_build()
+
+        queue.complete_build('m0')
+        self.assertEqual(queue.next_build(), 'm1')
+
+    def test_complete_build_wakes_waiting_worker(self):
+        queue = FairShareBuildQueue(dict(FAIR_SHARE_DEFAULT_MAX_RUNNING=1))
+        queue.add_build(build('m0', MONO))
+        queue.add_build(build('m1', MONO))
+        queue.next_build()
+
+        results = []
+        worker = threading.Thread(target=lambda: results.append(queue.next_build(True, 5)))
+        worker.start()
+        queue.complete_build('m0')
+        worker.join(5)
+
+        self.assertEqual(results, ['m1'])
+
+    def test_positions_per_repository(self):
+        queue = FairShareBuildQueue()
+        queue.add_build(build('m0', MONO))
+        queue.add_build(build('m1', MONO))
+        queue.add_build(build('r0', ROSIE))
+        queue.next_build()
+
+        self.assertEqual(queue.positions(), {
+            MONO: dict(running=1, queued=['m1']),
+            ROSIE: dict(running=0, queued=['r0'])
+        })
+
+    def test_join_returns_after_all_builds_completed(self):
+        queue = FairShareBuildQueue(dict(FAIR_SHARE_DEFAULT_MAX_RUNNING=1))
+        for i in range(3):
+            queue.add_build(build(i, MONO))
+        for i in range(3):
+            queue.complete_build(queue.next_build())
+
+        joined = threading.Thread(target=queue.join)
+        joined.start()
+        joined.join(5)
+        self.assertFalse(joined.is_alive())
+        self.assertEqual(queue.positions(), dict())
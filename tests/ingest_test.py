@@ -0,0 +1,290 @@
+"""
+Test cases for the IngestServer. In these test cases, we verify that webhooks
+delivered to the event-loop front end are saved as Builds with batched inserts,
+added to the BuildQueue, and answered like the Flask application answers them.
+
+BLACKBOX TESTING:
+
+    def test_build_is_saved_and_queued(self):
+    def test_concurrent_deliveries_are_all_saved(self):
+    def test_push_of_every_commit_is_queued(self):
+    def test_missing_payload_is_not_saved(self):
+    def test_invalid_json_is_rejected(self):
+    def test_invalid_payload_is_rejected_alone(self):
+    def test_ping_reports_dispatcher_status(self):
+    def test_unknown_path_is_not_found(self):
+    def test_build_events_are_streamed(self):
+
+WHITEBOX TESTING:
+
+    def test_writer_inserts_a_batch_at_once(self):
+    def test_writer_answers_none_when_insert_fails(self):
+    def test_writer_answers_none_when_queueing_fails(self):
+    def test_writer_survives_a_failing_callback(self):
+"""
+
+# Library to enable mocking of classes
+from mock import patch, MagicMock
+
+import unittest
+import threading
+import httplib
+import socket
+import json
+from mongokit import ObjectId
+from rosie.ingest import IngestServer, BuildWriter
+from rosie.models import (
+    BuildQueue,
+    CoalescingBuildQueue,
+    events,
+    connection
+)
+
+Build = connection.Build
+
+PAYLOAD = {
+    'repository': {
+        'url': 'https://github.com/cs181f/rosie',
+        'name': 'rosie',
+        'description': 'a lightweight CLI server',
+        'owner': {'name': 'test_user', 'email': 'test@example.com'}
+    },
+    'url': 'https://github.com/cs181f/rosie/commit/faea04357ef207d8f9f5c6a04607c7a53d8dc770',
+    'author': {'email': 'dunvi.dunvi@gmail.com', 'name': 'dunvi'},
+    'message': 'updating with changes from design review',
+    'timestamp': '2012-12-15T20:05:07-08:00',
+    'ref': "refs/heads/master"
+}
+
+class IngestServerTest(unittest.TestCase):
+    """Test cases for IngestServer"""
+
+    def setUp(self):
+        """ Start a server on a free port """
+        self.queue = BuildQueue()
+        self.dispatcher = MagicMock()
+        self.dispatcher.status.return_value = dict(building=False)
+        self.server = IngestServer(self.queue, dict(INGEST_PORT=0), connection,
+                                   self.dispatcher)
+        self.server.start()
+
+    def tearDown(self):
+        """ Stop the server and remove the builds it saved """
+        self.server.stop()
+        connection.Build.collection.remove()
+
+    def request(self, method, path, body=None):
+        """ The status and JSON document of a request to the server """
+        client = httplib.HTTPConnection('127.0.0.1', self.server.port, timeout=10)
+        client.request(method, path, body, {'Content-Type': 'application/json'})
+        response = client.getresponse()
+        document = json.loads(response.read())
+        client.close()
+        return response.status, document
+
+    def test_build_is_saved_and_queued(self):
+        """ Verifies that a delivery is only acknowledged with the id of a
+        Build that is in the database and on the queue """
+        status, document = self.request('POST', '/build', json.dumps(dict(payload=PAYLOAD)))
+
+        self.assertEqual(status, 200)
+        self.assertTrue(document['success'])
+        build = Build.find_one(dict(_id=ObjectId(document['id'])))
+        self.assertEqual(build['status'], 0)
+        self.assertEqual(build['ref'], PAYLOAD['ref'])
+        self.assertIsNotNone(build['queued_at'])
+        self.assertEqual(self.queue.next_build(False), build['_id'])
+
+    def test_concurrent_deliveries_are_all_saved(self):
+        """ Verifies that deliveries arriving at once each get a Build of
+        their own """
+        ids = []
+        body = json.dumps(dict(payload=PAYLOAD))
+
+        def deliver():
+            status, document = self.request('POST', '/build', body)
+            ids.append(document['id'])
+
+        threads = [threading.Thread(target=deliver) for i in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(ids)), 50)
+        self.assertEqual(Build.find().count(), 50)
+        queued = set()
+        while self.queue.has_builds():
+            queued.add(str(self.queue.next_build(False)))
+        self.assertEqual(queued, set(ids))
+
+    def test_push_of_every_commit_is_queued(self):
+        """ Verifies that with PUSH_BUILDS = 'all' every commit of a push is
+        built, even on a coalescing queue, and answered with every Build.id """
+        queue = CoalescingBuildQueue(dict(), connection)
+        self.server.push_builds = 'all'
+        self.server.writer.queue = queue
+        commits = [dict(url=PAYLOAD['url'] + str(i), author=PAYLOAD['author'],
+                        message='commit %d' % i, timestamp=PAYLOAD['timestamp'])
+                   for i in range(3)]
+        status, document = self.request('POST', '/build',
+                                        json.dumps(dict(payload=dict(PAYLOAD, commits=commits))))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(document['ids']), 3)
+        self.assertEqual(document['id'], document['ids'][-1])
+        self.assertEqual(Build.find(dict(status=0)).count(), 3)
+        self.assertEqual([str(build_id) for build_id in queue.next_builds(5)], document['ids'])
+
+    def test_missing_payload_is_not_saved(self):
+        """ Verifies that a request without a payload is answered like the
+        Flask application answers it """
+        status, document = self.request('POST', '/build', json.dumps(dict()))
+
+        self.assertEqual(document, dict(success=False))
+        self.assertEqual(Build.find().count(), 0)
+
+    def test_invalid_json_is_rejected(self):
+        """ Verifies that a body that is not JSON is a bad request """
+        status, document = self.request('POST', '/build', '{not json')
+
+        self.assertEqual(status, 400)
+        self.assertEqual(Build.find().count(), 0)
+
+    def test_invalid_payload_is_rejected_alone(self):
+        """ Verifies that a payload that is not a push is a bad request,
+        and does not fail the deliveries around it """
+        results = dict()
+
+        def deliver(name, payload):
+            results[name] = self.request('POST', '/build', json.dumps(dict(payload=payload)))
+
+        threads = [threading.Thread(target=deliver, args=(name, payload))
+                   for name, payload in [('bad', 'x'), ('commits', dict(PAYLOAD, commits='x')),
+                                         ('good', PAYLOAD)]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results['bad'][0], 400)
+        self.assertEqual(results['commits'][0], 400)
+        self.assertEqual(results['good'][0], 200)
+        self.assertEqual(Build.find().count(), 1)
+
+    def test_ping_reports_dispatcher_status(self):
+        """ Verifies that /ping answers with the status of the Dispatcher """
+        status, document = self.request('GET', '/ping')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(document, dict(building=False))
+
+    def test_unknown_path_is_not_found(self):
+        """ Verifies that everything else is left to the Flask application """
+        status, document = self.request('GET', '/builds')
+
+        self.assertEqual(status, 404)
+
+    def test_build_events_are_streamed(self):
+        """ Verifies that /builds/<build_id>/events streams the events of the
+        build from the event loop, and ends once it is finished """
+        build_id = ObjectId()
+        events.publish('started', build_id, status=0)
+
+        stream = socket.create_connection(('127.0.0.1', self.server.port), 10)
+        stream.sendall('GET /builds/%s/events HTTP/1.1\r\nHost: ingest\r\n\r\n' % build_id)
+        # the stream starts with the last event of the build
+        data = ''
+        while 'event: started' not in data:
+            data += stream.recv(4096)
+        events.publish('stage', ObjectId(), stage='checkout')
+        events.publish('finished', build_id, status=1)
+
+        while True:
+            received = stream.recv(4096)
+            if not received:
+                break
+            data += received
+        stream.close()
+
+        self.assertTrue(data.startswith('HTTP/1.0 200 OK'))
+        self.assertTrue('Content-Type: text/event-stream' in data)
+        self.assertEqual([line for line in data.split('\n') if line.startswith('event:')],
+                         ['event: started', 'event: finished'])
+
+
+class BuildWriterTest(unittest.TestCase):
+    """Test cases for BuildWriter"""
+
+    def test_writer_inserts_a_batch_at_once(self):
+        """ Verifies that a batch of payloads takes a single insert """
+        queue = BuildQueue()
+        writer = BuildWriter(queue, dict(), connection)
+        saved = []
+
+        def insert(builds, **kwargs):
+            for build in builds:
+                build['_id'] = ObjectId()
+
+        with patch.object(Build.collection, 'insert', side_effect=insert) as insert:
+            writer.write([([PAYLOAD], saved.append) for i in range(5)])
+
+        self.assertEqual(insert.call_count, 1)
+        self.assertEqual(len(insert.call_args[0][0]), 5)
+        self.assertEqual(len(saved), 5)
+        self.assertTrue(queue.has_builds())
+
+    def test_writer_answers_none_when_insert_fails(self):
+        """ Verifies that deliveries are not acknowledged when their Builds
+        could not be saved """
+        queue = BuildQueue()
+        writer = BuildWriter(queue, dict(), connection)
+        saved = []
+        with patch.object(Build.collection, 'insert', side_effect=Exception("down")):
+            writer.write([([PAYLOAD], saved.append), ([PAYLOAD], saved.append)])
+
+        self.assertEqual(saved, [None, None])
+        self.assertFalse(queue.has_builds())
+
+    def test_writer_answers_none_when_queueing_fails(self):
+        """ Verifies that deliveries are not acknowledged when their Builds
+        could not be queued """
+        queue = MagicMock()
+        queue.add_builds.side_effect = Exception("full")
+        writer = BuildWriter(queue, dict(), connection)
+        saved = []
+
+        def insert(builds, **kwargs):
+            for build in builds:
+                build['_id'] = ObjectId()
+
+        with patch.object(Build.collection, 'insert', side_effect=insert):
+            writer.write([([PAYLOAD], saved.append), ([PAYLOAD], saved.append)])
+
+        self.assertEqual(saved, [None, None])
+
+    def test_writer_survives_a_failing_callback(self):
+        """ Verifies that a callback that raises neither stops the BuildWriter
+        nor keeps the other deliveries of its batch from being answered """
+        queue = BuildQueue()
+        writer = BuildWriter(queue, dict(), connection)
+        saved = []
+        answered = threading.Event()
+
+        def fail(build):
+            raise Exception("closed")
+
+        def last(build):
+            saved.append(build)
+            answered.set()
+
+        writer.start()
+        try:
+            writer.submit([PAYLOAD], fail)
+            writer.submit([PAYLOAD], last)
+            self.assertTrue(answered.wait(10))
+            self.assertTrue(writer.is_alive())
+        finally:
+            writer.stop()
+
+        self.assertIsNotNone(saved[0])
@@ -0,0 +1,103 @@
+"""
+Test cases for the Metrics class and the metrics it is made of.
+
+BLACKBOX TESTING:
+
+    def test_counter_counts_per_label(self):
+    def test_histogram_buckets_are_cumulative(self):
+    def test_queue_depth_per_repository(self):
+    def test_queue_wait_is_observed_when_build_starts(self):
+    def test_dropped_build_leaves_queue(self):
+    def test_gauges_are_collected_on_render(self):
+
+WHITEBOX TESTING:
+
+    def test_label_values_are_escaped(self):
+    def test_builds_started_elsewhere_are_forgotten(self):
+"""
+
+import unittest
+import time
+from rosie.models import Metrics
+from rosie.models.metrics import Counter, Histogram, format_labels, QUEUED_TTL
+
+ROSIE = u'https://github.com/cs181f/rosie'
+OTHER = u'https://github.com/cs181f/other'
+
+def build(id, url):
+    return dict(_id=id, repository=dict(url=url))
+
+class MetricsTest(unittest.TestCase):
+    """Test cases for Metrics"""
+
+    def setUp(self):
+        """ Every test gets metrics of its own """
+        self.metrics = Metrics()
+
+    def test_counter_counts_per_label(self):
+        counter = Counter('requests_total', "Requests.", ('method',))
+        counter.inc(method='GET')
+        counter.inc(method='GET')
+        counter.inc(3, method='POST')
+
+        self.assertEqual(counter.samples(), [
+            ('requests_total', dict(method='GET'), 2),
+            ('requests_total', dict(method='POST'), 3)
+        ])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('wait_seconds', "Wait.", (1, 10))
+        for value in (0.5, 5, 50):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.samples(), [
+            ('wait_seconds_bucket', dict(le='1.0'), 1),
+            ('wait_seconds_bucket', dict(le='10.0'), 2),
+            ('wait_seconds_bucket', dict(le='+Inf'), 3),
+            ('wait_seconds_sum', dict(), 55.5),
+            ('wait_seconds_count', dict(), 3)
+        ])
+
+    def test_queue_depth_per_repository(self):
+        self.metrics.build_queued(build(1, ROSIE))
+        self.metrics.build_queued(build(2, ROSIE))
+        self.metrics.build_queued(build(3, OTHER))
+
+        rendered = self.metrics.render()
+        self.assertTrue('rosie_queue_depth{repository="%s"} 2.0' % ROSIE in rendered)
+        self.assertTrue('rosie_queue_depth{repository="%s"} 1.0' % OTHER in rendered)
+
+    def test_queue_wait_is_observed_when_build_starts(self):
+        self.metrics.build_queued(build(1, ROSIE))
+        self.metrics.build_started(1)
+        self.metrics.build_started(2)
+
+        self.assertTrue('rosie_queue_wait_seconds_count 1.0' in self.metrics.render())
+        self.assertEqual(self.metrics.queued, dict())
+
+    def test_dropped_build_leaves_queue(self):
+        self.metrics.build_queued(build(1, ROSIE))
+        self.metrics.build_dropped(1)
+
+        self.assertFalse('rosie_queue_depth{' in self.metrics.render())
+        self.assertTrue('rosie_queue_wait_seconds_count' not in self.metrics.render())
+
+    def test_gauges_are_collected_on_render(self):
+        self.metrics.gauge('rosie_workers', "Workers.",
+                           lambda: [(dict(state='busy'), 1), (dict(state='idle'), 3)])
+
+        rendered = self.metrics.render()
+        self.assertTrue('# TYPE rosie_workers gauge\n' in rendered)
+        self.assertTrue('rosie_workers{state="idle"} 3.0\n' in rendered)
+
+    def test_label_values_are_escaped(self):
+        self.assertEqual(format_labels(dict(path='a"b\\c\nd')), u'{path="a\\"b\\\\c\\nd"}')
+
+    def test_builds_started_elsewhere_are_forgotten(self):
+        self.metrics.build_queued(build(1, ROSIE))
+        # queued here, but started by the WorkerThreads of another host
+        self.metrics.queued[1] = (ROSIE, time.time() - QUEUED_TTL - 1)
+        self.metrics.build_queued(build(2, OTHER))
+
+        self.assertEqual(self.metrics.queued.keys(), [2])
+        self.assertFalse('rosie_queue_depth{repository="%s"}' % ROSIE in self.metrics.render())
@@ -0,0 +1,155 @@
+"""
+Test cases for MongoBuildQueue. These tests run against the local MongoDB,
+like the Build tests, using a collection of their own.
+
+WHITEBOX TESTING:
+
+    def test_add_build_stores_queued_job(self):
+    def test_add_builds_stores_jobs_in_order(self):
+    def test_claimed_job_is_not_claimed_twice(self):
+    def test_expired_lease_is_requeued(self):
+    def test_complete_build_removes_job(self):
+    def test_job_that_keeps_failing_is_given_up_on(self):
+    def test_heartbeat_survives_database_errors(self):
+
+BLACKBOX TESTING:
+
+    def test_has_builds_returns_correct_true(self):
+    def test_has_builds_returns_correct_false(self):
+    def test_next_build_returns_builds_in_order(self):
+    def test_next_build_raises_exception_if_empty(self):
+    def test_blocking_next_build_times_out(self):
+"""
+
+from mock import patch
+
+import unittest
+import Queue
+import time
+from datetime import datetime, timedelta
+from mongokit import ObjectId
+from rosie.models import (
+    MongoBuildQueue,
+    connection
+)
+
+class MongoBuildQueueTest(unittest.TestCase):
+    """Test cases for MongoBuildQueue"""
+
+    def setUp(self):
+        """ Create a queue on a scratch collection """
+        self.configs = dict(BUILD_QUEUE_COLLECTION='build_queue_test',
+                            BUILD_QUEUE_POLL_INTERVAL=0.05)
+        self.queue = MongoBuildQueue(self.configs)
+        self.collection = connection.rosie.build_queue_test
+
+    def tearDown(self):
+        """ Remove all jobs """
+        self.queue.stop()
+        self.collection.remove()
+        connection.Build.collection.remove()
+
+    def test_add_build_stores_queued_job(self):
+        """ Verifies that add_build inserts a queued job for the Build.id """
+        build_id = ObjectId()
+        self.queue.add_build(dict(_id=build_id))
+
+        job = self.collection.find_one()
+        self.assertEqual(job['build_id'], build_id)
+        self.assertEqual(job['state'], 'queued')
+
+    def test_add_builds_stores_jobs_in_order(self):
+        """ Verifies that add_builds inserts a job for every Build.id, which
+        are claimed in the order they were given """
+        build_ids = [ObjectId() for i in range(3)]
+        self.queue.add_builds([dict(_id=build_id) for build_id in build_ids])
+
+        self.assertEqual(self.collection.find().count(), 3)
+        self.assertEqual(self.queue.next_builds(5), build_ids)
+
+    def test_has_builds_returns_correct_true(self):
+        self.queue.add_build(ObjectId())
+        self.assertTrue(self.queue.has_builds())
+
+    def test_has_builds_returns_correct_false(self):
+        self.assertFalse(self.queue.has_builds())
+
+    def test_next_build_returns_builds_in_order(self):
+        """ Verifies that jobs are claimed first in, first out """
+        ids = [ObjectId() for i in range(3)]
+        for build_id in ids:
+            self.queue.add_build(build_id)
+
+        self.assertEqual([self.queue.next_build() for i in range(3)], ids)
+
+    def test_next_build_raises_exception_if_empty(self):
+        with self.assertRaises(Queue.Empty):
+            self.queue.next_build()
+
+    def test_blocking_next_build_times_out(self):
+        with self.assertRaises(Queue.Empty):
+            self.queue.next_build(block=True, timeout=0.2)
+
+    def test_claimed_job_is_not_claimed_twice(self):
+        """ Verifies that a second queue, as on another host, cannot claim a
+        job while its lease is held """
+        other = MongoBuildQueue(self.configs)
+        self.queue.add_build(ObjectId())
+
+        self.queue.next_build()
+        with self.assertRaises(Queue.Empty):
+            other.next_build()
+
+    def test_expired_lease_is_requeued(self):
+        """ Verifies that the job of a dead worker is handed out again """
+        other = MongoBuildQueue(self.configs)
+        build_id = ObjectId()
+        self.queue.add_build(build_id)
+        self.queue.next_build()
+
+        # the claiming process died and stopped renewing its lease
+        self.queue.claims.clear()
+        self.collection.update({}, {'$set': {
+            'lease_expires': datetime.utcnow() - timedelta(seconds=1)}})
+
+        self.assertEqual(other.next_build(), build_id)
+        self.assertEqual(self.collection.find_one()['attempts'], 2)
+
+    def test_complete_build_removes_job(self):
+        build_id = ObjectId()
+        self.queue.add_build(build_id)
+        self.queue.complete_build(self.queue.next_build())
+
+        self.assertEqual(self.collection.find().count(), 0)
+
+    def test_job_that_keeps_failing_is_given_up_on(self):
+        """ Verifies that a build whose workers all died is failed instead
+        of being handed out forever """
+        build = connection.Build()
+        build.save()
+        self.queue.add_build(build)
+        self.collection.update({}, {'$set': {
+            'state': u'claimed', 'attempts': self.queue.max_attempts,
+            'lease_expires': datetime.utcnow() - timedelta(seconds=1)}})
+
+        self.assertFalse(self.queue.has_builds())
+        self.assertEqual(self.queue._bury(), [build['_id']])
+        self.assertEqual(self.collection.find().count(), 0)
+        self.assertEqual(connection.Build.find_one({'_id': build['_id']})['status'], 2)
+
+    def test_heartbeat_survives_database_errors(self):
+        """ Verifies that a failed heartbeat, say during a failover, does not
+        stop the leases from being renewed """
+        queue = MongoBuildQueue(dict(self.configs, BUILD_QUEUE_LEASE=0.3))
+        try:
+            with patch.object(queue, '_renew', side_effect=Exception("AutoReconnect")) as renew:
+                for i in range(100):
+                    if renew.call_count >= 2:
+                        break
+                    time.sleep(0.05)
+                self.assertTrue(renew.call_count >= 2)
+            self.assertTrue(queue.heartbeat.is_alive())
+        finally:
+            queue.stop()
+        queue.heartbeat.join(5)
+        self.assertFalse(queue.heartbeat.is_alive())
@@ -0,0 +1,133 @@
+"""
+Test cases for the GitHubNotifier class. The GitHub API is replaced by a
+local HTTP server that records the requests it gets and answers with the
+responses the test scripts for it.
+
+BLACKBOX TESTING:
+
+    def test_first_failure_opens_issue(self):
+    def test_later_failures_comment_on_issue(self):
+    def test_burst_of_failures_is_coalesced(self):
+    def test_server_errors_are_retried(self):
+    def test_rate_limit_is_respected(self):
+    def test_without_credentials_nothing_is_queued(self):
+"""
+
+import unittest
+import threading
+import json
+import time
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from rosie.models import (
+    GitHubNotifier,
+    Build
+)
+
+class FakeGitHub(HTTPServer):
+    """ Records requests and answers with the scripted responses, then 201 """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            self.server.requests.append((self.path.split('?')[0], json.loads(body)))
+            if self.server.responses:
+                status, headers = self.server.responses.pop(0)
+            else:
+                status, headers = 201, dict()
+            content = json.dumps(dict(number=7))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeGitHub.Handler)
+        self.requests = []
+        self.responses = []
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+def failed_build(error="error string", ref='refs/heads/master'):
+    build = Build()
+    build.error = error
+    build.ref = ref
+    build.repository.name = 'test_repo'
+    build.repository.owner.name = 'jesse'
+    return build
+
+class GitHubNotifierTest(unittest.TestCase):
+    """Test cases for GitHubNotifier"""
+
+    def setUp(self):
+        """ Start the fake GitHub and a notifier pointed at it """
+        self.github = FakeGitHub()
+        self.configs = dict(GITHUB_ID='github_id', GITHUB_SECRET='github_secret',
+                            GITHUB_API_URL='http://127.0.0.1:%d' % self.github.server_port,
+                            GITHUB_NOTIFY_BACKOFF=0.01)
+        self.notifier = GitHubNotifier(self.configs)
+
+    def tearDown(self):
+        """ Stop the notifier and the fake GitHub """
+        self.notifier.stop()
+        self.github.shutdown()
+        self.github.server_close()
+
+    def deliver(self, *builds):
+        for build in builds:
+            self.notifier.notify(build)
+        if not self.notifier.is_alive():
+            self.notifier.start()
+        self.notifier.deliveries.join()
+
+    def test_first_failure_opens_issue(self):
+        self.deliver(failed_build())
+
+        self.assertEqual(self.github.requests, [
+            ('/repos/jesse/test_repo/issues',
+             dict(title='Build failure on ref refs/heads/master', body='error string'))
+        ])
+
+    def test_later_failures_comment_on_issue(self):
+        self.deliver(failed_build())
+        self.deliver(failed_build("second error"))
+
+        self.assertEqual(self.github.requests[1],
+                         ('/repos/jesse/test_repo/issues/7/comments', dict(body='second error')))
+
+    def test_burst_of_failures_is_coalesced(self):
+        self.deliver(failed_build("first"), failed_build("second"), failed_build("last"),
+                     failed_build("other ref", ref='refs/heads/feature'))
+
+        self.assertEqual(len(self.github.requests), 2)
+        self.assertEqual(self.github.requests[0][1]['body'],
+                         "3 builds failed, the last one with:\n\nlast")
+        self.assertEqual(self.github.requests[1][1]['title'],
+                         'Build failure on ref refs/heads/feature')
+
+    def test_server_errors_are_retried(self):
+        self.github.responses = [(502, dict()), (503, dict())]
+        self.deliver(failed_build())
+
+        self.assertEqual(len(self.github.requests), 3)
+        self.assertEqual(self.notifier.issues.values(), [7])
+
+    def test_rate_limit_is_respected(self):
+        reset = time.time() + 0.5
+        self.github.responses = [(403, {'X-RateLimit-Remaining': '0',
+                                        'X-RateLimit-Reset': str(reset)})]
+        self.deliver(failed_build())
+
+        self.assertEqual(len(self.github.requests), 2)
+        self.assertTrue(time.time() >= reset)
+
+    def test_without_credentials_nothing_is_queued(self):
+        notifier = GitHubNotifier(dict())
+
+        self.assertFalse(notifier.notify(failed_build()))
+        self.assertEqual(notifier.deliveries.qsize(), 0)
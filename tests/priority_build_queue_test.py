@@ -0,0 +1,95 @@
+"""
+Test cases for PriorityBuildQueue. Time is mocked so that aging can be
+tested without waiting.
+
+BLACKBOX TESTING:
+
+    def test_protected_refs_are_built_first(self):
+    def test_webhooks_are_built_before_rebuilds(self):
+    def test_same_class_is_first_in_first_out(self):
+    def test_old_builds_are_aged_up(self):
+    def test_builds_added_by_id_get_default_class(self):
+
+WHITEBOX TESTING:
+
+    def test_can_be_accessed_from_multiple_threads(self):
+"""
+
+from mock import patch
+
+import unittest
+import threading
+import Queue
+from rosie.models import PriorityBuildQueue
+
+def build(id, ref=u'refs/heads/feature'):
+    return dict(_id=id, ref=ref)
+
+class PriorityBuildQueueTest(unittest.TestCase):
+    """Test cases for PriorityBuildQueue"""
+
+    def setUp(self):
+        """ Create a queue with the default rules and a fake clock """
+        self.queue = PriorityBuildQueue(dict(PRIORITY_AGING=100))
+        self.now = 1000.0
+        self.clock = patch('time.time', lambda: self.now)
+        self.clock.start()
+
+    def tearDown(self):
+        self.clock.stop()
+
+    def drain(self):
+        builds = []
+        while self.queue.has_builds():
+            builds.append(self.queue.next_build())
+        return builds
+
+    def test_protected_refs_are_built_first(self):
+        self.queue.add_build(build(1))
+        self.queue.add_build(build(2, u'refs/heads/master'))
+
+        self.assertEqual(self.drain(), [2, 1])
+
+    def test_webhooks_are_built_before_rebuilds(self):
+        self.queue.add_build(build(1), trigger='rebuild')
+        self.queue.add_build(build(2))
+        self.queue.add_build(build(3, u'refs/heads/master'), trigger='rebuild')
+
+        self.assertEqual(self.drain(), [3, 2, 1])
+
+    def test_same_class_is_first_in_first_out(self):
+        for i in range(5):
+            self.queue.add_build(build(i))
+
+        self.assertEqual(self.drain(), range(5))
+
+    def test_old_builds_are_aged_up(self):
+        """ Verifies that a feature branch build that waited two aging periods
+        goes before a master push that just arrived """
+        self.queue.add_build(build(1))
+        self.now += 250
+        self.queue.add_build(build(2, u'refs/heads/master'))
+
+        self.assertEqual(self.drain(), [1, 2])
+
+    def test_builds_added_by_id_get_default_class(self):
+        self.queue.add_build(1)
+        self.queue.add_build(build(2, u'refs/heads/master'))
+
+        self.assertEqual(self.drain(), [2, 1])
+
+    def test_can_be_accessed_from_multiple_threads(self):
+        def add(ids):
+            for i in ids:
+                self.queue.add_build(build(i))
+
+        threads = [threading.Thread(target=add, args=(range(i * 10, i * 10 + 10),))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(self.drain()), range(40))
+        with self.assertRaises(Queue.Empty):
+            self.queue.next_build()
@@ -0,0 +1,95 @@
+"""
+Test cases for the query plan audit. The plans are samples of what MongoDB
+returns from explain(), so these tests do not need a database.
+
+WHITEBOX TESTING:
+
+    def test_collscan_is_detected(self):
+    def test_basic_cursor_is_detected(self):
+    def test_index_scan_is_not_a_collection_scan(self):
+    def test_rejected_plans_are_ignored(self):
+    def test_aggregation_plan_is_found(self):
+    def test_explain_is_skipped_unless_configured(self):
+    def test_aggregation_is_explained(self):
+    def test_strict_mode_raises(self):
+"""
+
+from mock import MagicMock
+
+import unittest
+from rosie.models import (
+    explain_query,
+    explain_aggregate,
+    QueryPlanException
+)
+from rosie.models.query_plan import (
+    is_collection_scan,
+    winning_plan
+)
+
+INDEX_SCAN = {'queryPlanner': {
+    'winningPlan': {'stage': 'LIMIT', 'inputStage': {
+        'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'status_1_build_time_-1'}}},
+    'rejectedPlans': [{'stage': 'COLLSCAN'}]
+}}
+
+COLLECTION_SCAN = {'queryPlanner': {
+    'winningPlan': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}},
+    'rejectedPlans': []
+}}
+
+class QueryPlanTest(unittest.TestCase):
+    """Test cases for the query plan audit"""
+
+    def cursor(self, plan):
+        cursor = MagicMock()
+        cursor.clone.return_value.explain.return_value = plan
+        return cursor
+
+    def test_collscan_is_detected(self):
+        self.assertTrue(is_collection_scan(winning_plan(COLLECTION_SCAN)))
+
+    def test_basic_cursor_is_detected(self):
+        self.assertTrue(is_collection_scan(winning_plan({'cursor': 'BasicCursor', 'n': 3})))
+
+    def test_index_scan_is_not_a_collection_scan(self):
+        self.assertFalse(is_collection_scan(winning_plan({'cursor': 'BtreeCursor _id_'})))
+
+    def test_rejected_plans_are_ignored(self):
+        self.assertFalse(is_collection_scan(winning_plan(INDEX_SCAN)))
+        self.assertFalse(is_collection_scan(winning_plan(
+            {'cursor': 'BtreeCursor _id_', 'allPlans': [{'cursor': 'BasicCursor'}]})))
+
+    def test_aggregation_plan_is_found(self):
+        self.assertTrue(is_collection_scan(winning_plan(
+            {'stages': [{'$cursor': COLLECTION_SCAN}, {'$group': {}}]})))
+        self.assertFalse(is_collection_scan(winning_plan(
+            {'stages': [{'$cursor': {'plan': {'cursor': 'BtreeCursor status_1_build_time_-1'}}},
+                        {'$group': {}}]})))
+
+    def test_explain_is_skipped_unless_configured(self):
+        cursor = self.cursor(COLLECTION_SCAN)
+
+        self.assertEqual(explain_query('test', cursor), cursor)
+        self.assertFalse(cursor.clone.called)
+
+    def test_strict_mode_raises(self):
+        configs = dict(QUERY_EXPLAIN=True, QUERY_EXPLAIN_STRICT=True)
+
+        with self.assertRaises(QueryPlanException):
+            explain_query('test', self.cursor(COLLECTION_SCAN), configs)
+        cursor = self.cursor(INDEX_SCAN)
+        self.assertEqual(explain_query('test', cursor, configs), cursor)
+
+    def test_aggregation_is_explained(self):
+        collection = MagicMock()
+        collection.database.command.return_value = {'stages': [{'$cursor': COLLECTION_SCAN}]}
+        pipeline = [{'$match': {'status': 2}}]
+
+        explain_aggregate('test', collection, pipeline)
+        self.assertFalse(collection.database.command.called)
+
+        with self.assertRaises(QueryPlanException):
+            explain_aggregate('test', collection, pipeline,
+                              dict(QUERY_EXPLAIN=True, QUERY_EXPLAIN_STRICT=True))
+        self.assertEqual(collection.database.command.call_args[1]['pipeline'], pipeline)
@@ -0,0 +1,111 @@
+"""
+Test cases for the ResultCache class. These tests run against the local
+MongoDB.
+
+BLACKBOX TESTING:
+
+    def test_stored_result_is_found(self):
+    def test_other_settings_miss(self):
+    def test_forced_build_misses(self):
+    def test_disabled_cache_misses(self):
+
+WHITEBOX TESTING:
+
+    def test_commit_id_from_url(self):
+    def test_unfinished_build_is_not_stored(self):
+    def test_interrupted_build_is_not_stored(self):
+    def test_selective_run_is_not_stored(self):
+    def test_test_selection_is_part_of_the_key(self):
+"""
+
+import unittest
+from rosie.models import (
+    ResultCache,
+    commit_id,
+    connection
+)
+
+Build = connection.Build
+
+COMMIT = u'https://github.com/cs181f/rosie/commit/1f2e3d4c'
+
+class ResultCacheTest(unittest.TestCase):
+    """Test cases for ResultCache"""
+
+    def setUp(self):
+        """ Configure the cache to use its own collection """
+        self.configs = dict(RESULT_CACHE_COLLECTION='test_build_results',
+                            TEST_COMMAND='make test')
+
+    def tearDown(self):
+        """ Remove all cached results """
+        connection.rosie.test_build_results.remove()
+
+    def finished_build(self, status=2, url=COMMIT):
+        build = Build()
+        build['_id'] = 1
+        build.url = url
+        build.status = status
+        build.error = u"error string"
+        return build
+
+    def test_stored_result_is_found(self):
+        cache = ResultCache(self.configs)
+        cache.store(self.finished_build())
+
+        result = cache.lookup(self.finished_build(0))
+        self.assertEqual(result['build_id'], 1)
+        self.assertEqual(result['status'], 2)
+        self.assertEqual(result['error'], u"error string")
+
+    def test_other_settings_miss(self):
+        ResultCache(self.configs).store(self.finished_build())
+        self.configs['TEST_COMMAND'] = 'make check'
+
+        self.assertEqual(ResultCache(self.configs).lookup(self.finished_build(0)), None)
+
+    def test_forced_build_misses(self):
+        cache = ResultCache(self.configs)
+        cache.store(self.finished_build())
+        build = self.finished_build(0)
+        build.force = True
+
+        self.assertEqual(cache.lookup(build), None)
+
+    def test_disabled_cache_misses(self):
+        ResultCache(self.configs).store(self.finished_build())
+        self.configs['RESULT_CACHE'] = False
+
+        self.assertEqual(ResultCache(self.configs).lookup(self.finished_build(0)), None)
+
+    def test_commit_id_from_url(self):
+        self.assertEqual(commit_id(dict(url=COMMIT)), u'1f2e3d4c')
+        self.assertEqual(commit_id(dict(url=u'https://github.com/cs181f/rosie')), None)
+        self.assertEqual(commit_id(dict()), None)
+
+    def test_unfinished_build_is_not_stored(self):
+        cache = ResultCache(self.configs)
+        cache.store(self.finished_build(0))
+
+        self.assertEqual(connection.rosie.test_build_results.count(), 0)
+
+    def test_interrupted_build_is_not_stored(self):
+        cache = ResultCache(self.configs)
+        cache.store(self.finished_build(), interrupted=True)
+
+        self.assertEqual(connection.rosie.test_build_results.count(), 0)
+
+    def test_selective_run_is_not_stored(self):
+        cache = ResultCache(self.configs)
+        build = self.finished_build(1)
+        build['full_run'] = False
+        cache.store(build)
+
+        self.assertEqual(connection.rosie.test_build_results.count(), 0)
+
+    def test_test_selection_is_part_of_the_key(self):
+        build = self.finished_build(0)
+        key = ResultCache(self.configs).key(build)
+        self.configs['TEST_SELECTION'] = True
+
+        self.assertNotEqual(ResultCache(self.configs).key(build), key)
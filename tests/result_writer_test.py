@@ -0,0 +1,148 @@
+"""
+Test cases for the ResultWriter. In these test cases, we verify that results
+handed to the ResultWriter at the same time are stored with one write, as
+compare-and-sets from status 0, and that every WorkerThread learns whether
+its own result was stored.
+
+WHITEBOX TESTING:
+
+    def test_batch_is_one_update_command(self):
+    def test_lost_race_is_found_by_token(self):
+    def test_failed_batch_is_stored_one_at_a_time(self):
+    def test_result_that_cannot_be_stored_raises(self):
+
+BLACKBOX TESTING:
+
+    def test_concurrent_results_are_written_together(self):
+    def test_result_is_not_stored_twice(self):
+    def test_stopped_writer_does_not_block(self):
+"""
+
+# Library to enable mocking of classes
+from mock import MagicMock
+
+import unittest
+import threading
+from mongokit import ObjectId
+from rosie.models import (
+    ResultWriter,
+    connection
+)
+
+Build = connection.Build
+
+class ResultWriterTest(unittest.TestCase):
+    """Test cases for ResultWriter"""
+
+    def setUp(self):
+        """ Create a writer with a mock connection """
+        self.connection = MagicMock()
+        self.collection = self.connection.Build.collection
+        self.collection.name = 'builds'
+        self.command = self.collection.database.command
+        self.writer = ResultWriter(dict(), self.connection)
+
+    def tearDown(self):
+        """ Remove all builds """
+        connection.Build.collection.remove()
+
+    def results(self, count):
+        return [[dict(_id=i, status=1, error=u''), ['status', 'error'], ObjectId(), False,
+                 threading.Event()] for i in range(count)]
+
+    def test_batch_is_one_update_command(self):
+        """ Verifies that a batch is sent as one update command of
+        compare-and-sets """
+        self.command.return_value = dict(ok=1, n=3)
+        batch = self.results(3)
+        self.writer.write(batch)
+
+        self.assertEqual(self.command.call_count, 1)
+        command = self.command.call_args[0][0]
+        self.assertEqual(command.keys()[0], 'update')
+        self.assertEqual([update['q'] for update in command['updates']],
+                         [{'_id': i, 'status': 0} for i in range(3)])
+        self.assertEqual(command['updates'][0]['u']['$set']['status'], 1)
+        self.assertTrue(all(result[3] for result in batch))
+        self.assertFalse(self.collection.find.called)
+
+    def test_lost_race_is_found_by_token(self):
+        """ Verifies that when fewer updates matched than were sent, the
+        stored tokens tell which results were stored """
+        self.command.return_value = dict(ok=1, n=1)
+        batch = self.results(2)
+        self.collection.find.return_value = [dict(_id=0, result_token=ObjectId()),
+                                             dict(_id=1, result_token=batch[1][2])]
+        self.writer.write(batch)
+
+        self.assertFalse(batch[0][3])
+        self.assertTrue(batch[1][3])
+
+    def test_failed_batch_is_stored_one_at_a_time(self):
+        """ Verifies that when the update command fails, every result is
+        stored with an update of its own instead of being dropped """
+        self.command.side_effect = Exception("not master")
+        self.collection.update.return_value = dict(ok=1, n=1)
+        self.writer = ResultWriter(dict(RESULT_WRITE_WINDOW=0), self.connection)
+        self.writer.start()
+
+        self.assertTrue(self.writer.save(dict(_id=0, status=1), ['status']))
+        self.writer.stop()
+
+        self.assertEqual(self.collection.update.call_args[0][0], {'_id': 0, 'status': 0})
+
+    def test_result_that_cannot_be_stored_raises(self):
+        """ Verifies that a result that could not be stored at all is not
+        mistaken for one that lost the race """
+        self.command.side_effect = Exception("down")
+        self.collection.update.side_effect = Exception("down")
+        batch = self.results(2)
+        self.writer.write_each(batch)
+
+        self.assertTrue(all(isinstance(result[3], Exception) for result in batch))
+
+    def test_concurrent_results_are_written_together(self):
+        """ Verifies that results handed over within the window are written
+        with a single command """
+        self.command.side_effect = lambda command: dict(ok=1, n=len(command['updates']))
+        self.writer = ResultWriter(dict(RESULT_WRITE_WINDOW=0.5), self.connection)
+        self.writer.start()
+        stored = []
+
+        def save(i):
+            stored.append(self.writer.save(dict(_id=i, status=1), ['status']))
+
+        threads = [threading.Thread(target=save, args=(i,)) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.writer.stop()
+
+        self.assertEqual(stored, [True] * 5)
+        self.assertEqual(self.command.call_count, 1)
+
+    def test_result_is_not_stored_twice(self):
+        """ Verifies that of two workers finishing the same build, only the
+        first stores its result (needs MongoDB 2.6 or later) """
+        build = Build({'status': 0, 'error': u''})
+        build.save()
+        writer = ResultWriter(dict(RESULT_WRITE_WINDOW=0), connection)
+        writer.start()
+
+        build['status'] = 1
+        self.assertTrue(writer.save(build))
+        build['status'] = 2
+        self.assertFalse(writer.save(build))
+        writer.stop()
+
+        self.assertEqual(Build.find_one({'_id': build['_id']})['status'], 1)
+
+    def test_stopped_writer_does_not_block(self):
+        """ Verifies that a result handed to a stopped ResultWriter is stored
+        by the WorkerThread itself """
+        self.collection.update.return_value = dict(ok=1, n=1)
+        self.writer.stop()
+
+        self.assertTrue(self.writer.save(dict(_id=0, status=1), ['status']))
+        self.assertFalse(self.command.called)
@@ -0,0 +1,136 @@
+"""
+Test cases for the TestSelector class. The checkouts are local git
+repositories, and the builds the selector looks up are mocked.
+
+BLACKBOX TESTING:
+
+    def test_rules_select_affected_tests(self):
+    def test_path_affecting_no_tests_selects_none(self):
+    def test_unknown_path_runs_all_tests(self):
+    def test_coverage_map_selects_covering_tests(self):
+    def test_without_previous_success_runs_all_tests(self):
+    def test_full_run_is_forced_periodically(self):
+
+WHITEBOX TESTING:
+
+    def test_disabled_selector_runs_all_tests(self):
+    def test_command_without_files_runs_all_tests(self):
+"""
+
+# Library to enable mocking of classes
+from mock import patch, MagicMock
+
+import unittest
+import subprocess
+import tempfile
+import shutil
+import json
+import os
+from rosie.models import TestSelector
+
+def git(directory, *args):
+    return subprocess.check_output(['git', '-C', directory, '-c', 'user.name=rosie',
+                                    '-c', 'user.email=rosie@example.com'] + list(args)).strip()
+
+class TestSelectorTest(unittest.TestCase):
+    """Test cases for TestSelector"""
+
+    def setUp(self):
+        """ Create a checkout with a first commit to compare with """
+        self.directory = tempfile.mkdtemp()
+        git(self.directory, 'init', '--quiet')
+        self.first = self.commit('models/build.py', 'models/queue.py',
+                                 'tests/build_test.py', 'tests/queue_test.py', 'README')
+        self.configs = dict(TEST_SELECTION=True, TEST_COMMAND='nosetests {files}',
+                            TEST_SELECTION_RULES=[
+            (r'tests/.*_test\.py', r'\g<0>'),
+            (r'models/(.*)\.py', r'tests/\1_test.py'),
+            (r'.*\.md', None)
+        ])
+        self.build = dict(_id=2, ref=u'refs/heads/master',
+                          repository=dict(name=u'rosie', url=u'https://github.com/cs181f/rosie'))
+
+    def tearDown(self):
+        """ Remove the checkout """
+        shutil.rmtree(self.directory)
+
+    def commit(self, *paths):
+        for path in paths:
+            filename = os.path.join(self.directory, path)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'a') as f:
+                f.write('changed\n')
+            git(self.directory, 'add', path)
+        git(self.directory, 'commit', '--quiet', '-m', 'commit')
+        return git(self.directory, 'rev-parse', 'HEAD')
+
+    def select(self, previous='first', full_run_due=False):
+        selector = TestSelector(self.configs, MagicMock())
+        with patch.object(TestSelector, '_previous_success') as previous_success:
+            previous_success.return_value = self.first if previous == 'first' else previous
+            with patch.object(TestSelector, '_full_run_due') as due:
+                due.return_value = full_run_due
+                return selector.select(self.build, self.directory)
+
+    def test_rules_select_affected_tests(self):
+        self.commit('models/build.py', 'tests/queue_test.py')
+        tests, reason = self.select()
+
+        self.assertEqual(tests, ['tests/build_test.py', 'tests/queue_test.py'])
+        self.assertTrue(reason.startswith('Running the 2 tests affected by 2 paths'))
+
+    def test_path_affecting_no_tests_selects_none(self):
+        self.commit('CHANGES.md')
+
+        self.assertEqual(self.select()[0], [])
+
+    def test_unknown_path_runs_all_tests(self):
+        self.commit('models/build.py', 'README')
+
+        self.assertEqual(self.select()[0], None)
+
+    def test_coverage_map_selects_covering_tests(self):
+        with open(os.path.join(self.directory, 'coverage.json'), 'w') as f:
+            json.dump({'tests/build_test.py': ['README', 'models/build.py']}, f)
+        self.configs['TEST_SELECTION_RULES'] = []
+        self.configs['TEST_SELECTION_COVERAGE'] = 'coverage.json'
+        self.commit('README')
+
+        self.assertEqual(self.select()[0], ['tests/build_test.py'])
+
+    def test_without_previous_success_runs_all_tests(self):
+        self.commit('models/build.py')
+
+        self.assertEqual(self.select(previous=None)[0], None)
+
+    def test_full_run_is_forced_periodically(self):
+        self.configs['TEST_SELECTION_FULL_RUN_EVERY'] = 3
+        connection = MagicMock()
+        find = connection.Build.collection.find
+        find.return_value.sort.return_value.limit.return_value = [
+            dict(full_run=False), dict(full_run=False)]
+        selector = TestSelector(self.configs, connection)
+
+        self.assertTrue(selector._full_run_due(self.build))
+        find.return_value.sort.return_value.limit.return_value = [
+            dict(full_run=False), dict(full_run=True)]
+        self.assertFalse(selector._full_run_due(self.build))
+        find.return_value.sort.return_value.limit.assert_called_with(2)
+        # the builds of a fork of the same name are not counted
+        self.assertEqual(find.call_args[0][0]['repository.url'],
+                         u'https://github.com/cs181f/rosie')
+        self.assertFalse('repository.name' in find.call_args[0][0])
+
+    def test_disabled_selector_runs_all_tests(self):
+        self.configs['TEST_SELECTION'] = False
+
+        self.assertEqual(self.select(), (None, None))
+
+    def test_command_without_files_runs_all_tests(self):
+        self.configs['TEST_COMMAND'] = 'nosetests'
+        self.commit('models/build.py')
+        tests, reason = self.select()
+
+        self.assertEqual(tests, None)
+        self.assertTrue('{files}' in reason)
@@ -0,0 +1,76 @@
+"""
+Test cases for the stage timings. The percentiles are computed over builds
+in the local MongoDB.
+
+BLACKBOX TESTING:
+
+    def test_percentiles_per_stage(self):
+    def test_percentiles_for_window_and_repository(self):
+
+WHITEBOX TESTING:
+
+    def test_percentile_by_nearest_rank(self):
+    def test_stage_names_of_steps(self):
+    def test_elapsed_is_never_negative(self):
+"""
+
+from mock import patch
+
+import unittest
+import time
+from datetime import datetime, timedelta
+from rosie.models import (
+    stage_percentiles,
+    connection
+)
+from rosie.models.timings import percentile, stage_name, elapsed
+
+Build = connection.Build
+
+class TimingsTest(unittest.TestCase):
+    """Test cases for stage timings"""
+
+    def tearDown(self):
+        """ Remove all builds """
+        connection.Build.collection.remove()
+
+    def finished_build(self, timings, repository=u'rosie', days_ago=0):
+        build = Build()
+        build.status = 1
+        build.repository.name = repository
+        build.build_time = datetime.utcnow() - timedelta(days=days_ago)
+        build.timings = timings
+        build.save()
+        return build
+
+    def test_percentiles_per_stage(self):
+        for seconds in range(1, 101):
+            self.finished_build(dict(queue=float(seconds), test_command=2.0))
+
+        results = stage_percentiles()
+        self.assertEqual(results['queue'], dict(count=100, p50=50.0, p95=95.0, p99=99.0))
+        self.assertEqual(results['test_command']['p99'], 2.0)
+        self.assertFalse('notify' in results)
+
+    def test_percentiles_for_window_and_repository(self):
+        self.finished_build(dict(queue=1.0))
+        self.finished_build(dict(queue=2.0), days_ago=10)
+        self.finished_build(dict(queue=3.0), repository=u'other')
+
+        results = stage_percentiles(datetime.utcnow() - timedelta(days=7), u'rosie')
+        self.assertEqual(results, dict(queue=dict(count=1, p50=1.0, p95=1.0, p99=1.0)))
+
+    def test_percentile_by_nearest_rank(self):
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(percentile([1, 2, 3, 4], 99), 4)
+        self.assertEqual(percentile([7], 1), 7)
+        self.assertEqual(percentile([], 50), None)
+
+    def test_stage_names_of_steps(self):
+        self.assertEqual(stage_name('pre-build hook'), 'pre_build_hook')
+        self.assertEqual(stage_name('test command'), 'test_command')
+
+    def test_elapsed_is_never_negative(self):
+        started = time.time()
+        with patch('time.time', return_value=started - 5):
+            self.assertEqual(elapsed(started), 0.0)
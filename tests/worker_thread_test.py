@@ -6,6 +6,10 @@ WHITEBOX TESTING:
     def test_worker_runs_in_seperate_thread(self):
     def test_init_saves_queue(self):
     def test_worker_reads_first_id_if_queue_not_empty(self):
+    def test_persistent_worker_waits_for_builds(self):
+    def test_persistent_worker_survives_missing_build(self):
+    def test_persistent_worker_requeues_builds_it_cannot_fetch(self):
+    def test_worker_prefetches_batch_with_one_query(self):
     def test_configs_are_accurately_read(self):
     def test_build_can_be_retrieved(self):
 
@@ -17,6 +21,13 @@ BLACKBOX TESTING:
     def test_build_not_sent_to_github_if_success(self):
     def test_build_can_be_saved_if_success(self):
     def test_build_can_be_saved_if_fail(self):
+    def test_cancelled_build_is_marked_superseded(self):
+    def test_build_finished_elsewhere_is_not_reported(self):
+    def test_cached_result_is_not_built_again(self):
+    def test_stage_timings_are_recorded(self):
+    def test_prefetch_wait_is_recorded(self):
+    def test_events_are_published(self):
+    def test_finished_is_published_for_every_build(self):
 
 """
 
@@ -26,13 +37,17 @@ from mock import patch, MagicMock, Mock
 import unittest
 import json
 import threading
+import time
 import subprocess, os
 import requests
 from rosie.models import (
     WorkerThread,
     BuildQueue,
     Build,
-    BuildNotFoundException
+    BuildNotFoundException,
+    ResultCache,
+    Subscription,
+    events
 )
 from datetime import datetime
 
@@ -77,6 +92,100 @@ class WorkerThreadTest(unittest.TestCase):
 
         self.assertEqual(self.thread.current_build, None)
 
+    def test_persistent_worker_waits_for_builds(self):
+        """ Verifies that a persistent WorkerThread blocks on an empty
+        BuildQueue and builds what is added to it later """
+        with patch.object(WorkerThread, '_save_result') as save:
+            build = Build()
+            build['_id'] = 1
+
+            with patch.object(WorkerThread, '_retrieve_build') as mock1:
+                mock1.return_value = build
+
+                with patch.object(WorkerThread, '_bash_build') as mock2:
+                    mock2.return_value = True
+                    self.thread = WorkerThread(self.queue, dict(WORKER_POLL_INTERVAL=0.05),
+                                               persistent=True)
+                    self.thread.start()
+                    self.queue.add_build(build)
+                    self.queue.join()
+
+                    self.assertTrue(self.thread.is_alive())
+                    self.thread.stop()
+                    self.thread.join()
+
+            self.assertEqual(build.status, 1)
+
+    def test_persistent_worker_survives_missing_build(self):
+        """ Verifies that a persistent WorkerThread keeps going when a
+        Build.id on the BuildQueue is not in the database """
+        with patch.object(WorkerThread, '_retrieve_build') as mock1:
+            mock1.side_effect = BuildNotFoundException("Build was not in database.")
+            self.thread = WorkerThread(self.queue, dict(WORKER_POLL_INTERVAL=0.05),
+                                       persistent=True)
+            self.thread.start()
+            self.queue.add_build(1)
+            self.queue.join()
+
+            self.assertTrue(self.thread.is_alive())
+            self.thread.stop()
+            self.thread.join()
+
+    def test_persistent_worker_requeues_builds_it_cannot_fetch(self):
+        """ Verifies that a persistent WorkerThread outlives a database error
+        while fetching a build, and builds it once it can be fetched """
+        with patch.object(WorkerThread, '_save_result') as save:
+            build = Build()
+            build['_id'] = 1
+
+            with patch.object(WorkerThread, '_retrieve_build') as mock1:
+                mock1.side_effect = [Exception("database down"), build]
+
+                with patch.object(WorkerThread, '_bash_build') as mock2:
+                    mock2.return_value = True
+                    self.thread = WorkerThread(self.queue, dict(WORKER_POLL_INTERVAL=0.05),
+                                               persistent=True)
+                    self.thread.start()
+                    self.queue.add_build(build)
+                    self.queue.join()
+
+                    self.assertTrue(self.thread.is_alive())
+                    self.thread.stop()
+                    self.thread.join()
+
+            self.assertEqual(mock1.call_count, 2)
+            self.assertEqual(build.status, 1)
+
+    def test_worker_prefetches_batch_with_one_query(self):
+        """ Verifies that with WORKER_PREFETCH the WorkerThread fetches queued
+        builds with a single query, and that a build missing from the
+        database does not stop the rest of the batch """
+        with patch.object(WorkerThread, '_save_result') as save:
+            builds = []
+            for i in range(3):
+                build = Build()
+                build['_id'] = i
+                builds.append(build)
+
+            with patch.object(Build, 'find') as find:
+                # the second build was deleted after it was queued
+                find.return_value = [builds[2], builds[0]]
+
+                with patch.object(WorkerThread, '_bash_build') as mock:
+                    mock.return_value = True
+                    self.thread = WorkerThread(self.queue, dict(WORKER_PREFETCH=5))
+                    for i in range(3):
+                        self.queue.add_build(i)
+
+                    self.thread.start()
+                    self.thread.join()
+
+            find.assert_called_once_with({'_id': {'$in': [0, 1, 2]}}, None)
+            self.assertEqual(mock.call_count, 2)
+            self.assertEqual(builds[0].status, 1)
+            self.assertEqual(builds[2].status, 1)
+            self.assertFalse(self.queue.has_builds())
+
     def test_build_can_be_retrieved_success(self):
         """ Verifies that WorkerThread can retrieve Build from Mongo with ID
 
@@ -144,7 +253,7 @@ class WorkerThreadTest(unittest.TestCase):
             Mock save on Build
         """
 
-        with patch.object(Build, 'save') as save:
+        with patch.object(WorkerThread, '_save_result') as save:
             save.return_value = True
             build = Build()
             build['_id'] = 1
@@ -160,7 +269,7 @@ class WorkerThreadTest(unittest.TestCase):
                     self.thread.start()
                     self.thread.join()
 
-                    build.save.assert_called_once()
+                    save.assert_called_once_with(build)
                     self.assertEqual(build.status, 1)
 
     def test_build_can_be_saved_if_fail(self):
@@ -169,7 +278,7 @@ class WorkerThreadTest(unittest.TestCase):
         SETUP:
             Mock save on Build
         """
-        with patch.object(Build, 'save') as save:
+        with patch.object(WorkerThread, '_save_result') as save:
             save.return_value = True
             build = Build()
             build['_id'] = 1
@@ -185,7 +294,7 @@ class WorkerThreadTest(unittest.TestCase):
                     self.thread.start()
                     self.thread.join()
 
-                    build.save.assert_called_once()
+                    save.assert_called_once_with(build)
                     self.assertEqual(build.status, 2)
                     self.assertEqual(build.error, mock2.return_value)
 
@@ -193,7 +302,7 @@ class WorkerThreadTest(unittest.TestCase):
         """ Verifies that build failure information is sent to Github as a new
         issue
         """
-        with patch.object(Build, 'save') as save:
+        with patch.object(WorkerThread, '_save_result') as save:
             save.return_value = True
             build = Build()
             build['_id'] = 1
@@ -217,7 +326,7 @@ class WorkerThreadTest(unittest.TestCase):
     def test_build_not_sent_to_github_if_success(self):
         """ Verifies that nothing is sent to Github of build passes.
         """
-        with patch.object(Build, 'save') as save:
+        with patch.object(WorkerThread, '_save_result') as save:
             save.return_value = True
             build = Build()
             build['_id'] = 1
@@ -238,6 +347,34 @@ class WorkerThreadTest(unittest.TestCase):
 
                         self.thread._post_to_github.assert_not_called()
 
+    def test_cancelled_build_is_marked_superseded(self):
+        """ Verifies that a build cancelled by a newer build of the same ref is
+        saved as superseded, and is not reported to Github """
+        with patch.object(WorkerThread, '_save_result') as save:
+            build = Build()
+            build['_id'] = 1
+
+            with patch.object(WorkerThread, '_retrieve_build') as mock1:
+                mock1.return_value = build
+
+                with patch.object(WorkerThread, '_bash_build') as mock2:
+                    def cancelled(build):
+                        self.assertTrue(self.thread.cancel(1, 2))
+                        return "The build was cancelled."
+                    mock2.side_effect = cancelled
+
+                    with patch.object(WorkerThread, '_post_to_github') as mock3:
+                        self.thread = WorkerThread(self.queue)
+                        self.queue.add_build(build)
+
+                        self.thread.start()
+                        self.thread.join()
+
+                        self.assertFalse(mock3.called)
+
+            self.assertEqual(build.status, 3)
+            self.assertEqual(build.superseded_by, 2)
+
     def test_builds_builds_in_correct_order(self):
         """ Verifies that when multiple builds are in the BuildQueue, they
         are built in the correct order
@@ -245,7 +382,7 @@ class WorkerThreadTest(unittest.TestCase):
         SETUP:
             Mock multiple builds
         """
-        with patch.object(Build, 'save') as save:
+        with patch.object(WorkerThread, '_save_result') as save:
             save.return_value = True
             builds = []
             for i in range(5):
@@ -296,6 +433,25 @@ class WorkerThreadTest(unittest.TestCase):
         expected_data = {'body': 'error string', 'title': 'Build failure on ref build_ref'}
         mock.assert_called_once_with(expected_url, expected_data)
 
+    def test_post_to_github_uses_configured_api_url(self):
+        configs = dict(GITHUB_ID='github_id', GITHUB_SECRET='github_secret',
+                       GITHUB_API_URL='https://github.example.com/api/v3/')
+
+        build = Build()
+        build.error = "error string"
+        build.ref = 'build_ref'
+
+        build.repository.name = 'test_repo'
+        build.repository.owner.name = 'jesse'
+
+        self.thread = WorkerThread(self.queue, configs)
+
+        with patch.object(requests, 'post') as mock:
+            self.thread._post_to_github(build)
+
+        self.assertTrue(mock.call_args[0][0].startswith(
+            'https://github.example.com/api/v3/repos/jesse/test_repo/issues?'))
+
     def test_post_to_github_without_credentials_returns_false(self):
         configs = dict()
 
@@ -313,4 +469,158 @@ class WorkerThreadTest(unittest.TestCase):
 
             self.assertFalse(self.thread._post_to_github(build))
 
-        mock.assert_not_called()
\ No newline at end of file
+        mock.assert_not_called()
+    def test_cached_result_is_not_built_again(self):
+        """ Verifies that a build of a commit that was already built with the
+        same configuration gets the cached result without being built """
+        with patch.object(WorkerThread, '_save_result') as save:
+            build = Build()
+            build['_id'] = 1
+
+            with patch.object(WorkerThread, '_retrieve_build') as mock1:
+                mock1.return_value = build
+
+                with patch.object(ResultCache, 'lookup') as lookup:
+                    lookup.return_value = dict(build_id=0, status=2, error=u"error string")
+
+                    with patch.object(WorkerThread, '_bash_build') as mock2:
+                        with patch.object(WorkerThread, '_post_to_github') as mock3:
+                            with patch('rosie.models.worker_thread.record_failure') as record:
+                                self.thread = WorkerThread(self.queue)
+                                self.queue.add_build(build)
+
+                                self.thread.start()
+                                self.thread.join()
+
+                                self.assertFalse(mock2.called)
+                                self.assertFalse(mock3.called)
+                                # the failure counts for /blame all the same
+                                self.assertEqual(record.call_args[0][0], build)
+
+            self.assertEqual(build.status, 2)
+            self.assertEqual(build.error, u"error string")
+            self.assertEqual(build.cached_from, 0)
+
+    def test_stage_timings_are_recorded(self):
+        """ Verifies that the time a build spent queued, being retrieved and
+        being saved is recorded on it """
+        with patch.object(WorkerThread, '_save_result') as save:
+            build = Build()
+            build['_id'] = 1
+            build['queued_at'] = datetime.utcnow()
+
+            with patch.object(WorkerThread, '_retrieve_build') as mock1:
+                mock1.return_value = build
+
+                with patch.object(WorkerThread, '_bash_build') as mock2:
+                    mock2.return_value = True
+                    self.thread = WorkerThread(self.queue)
+                    self.queue.add_build(build)
+
+                    self.thread.start()
+                    self.thread.join()
+
+            self.assertEqual(sorted(build.timings), ['queue', 'retrieve', 'save'])
+            self.assertTrue(all(seconds >= 0 for seconds in build.timings.values()))
+
+    def test_prefetch_wait_is_recorded(self):
+        """ Verifies that with WORKER_PREFETCH the time a build waits behind
+        the builds fetched before it is a stage of its own """
+        with patch.object(WorkerThread, '_save_result') as save:
+            builds = []
+            for i in range(2):
+                build = Build()
+                build['_id'] = i
+                build['queued_at'] = datetime.utcnow()
+                builds.append(build)
+
+            with patch.object(Build, 'find') as find:
+                find.return_value = builds
+
+                with patch.object(WorkerThread, '_bash_build') as mock:
+                    mock.side_effect = lambda build: time.sleep(0.2) or True
+                    self.thread = WorkerThread(self.queue, dict(WORKER_PREFETCH=2))
+                    for build in builds:
+                        self.queue.add_build(build)
+
+                    self.thread.start()
+                    self.thread.join()
+
+            self.assertTrue(builds[0].timings['prefetch_wait'] < 0.2)
+            self.assertTrue(builds[1].timings['prefetch_wait'] >= 0.2)
+
+    def test_build_finished_elsewhere_is_not_reported(self):
+        """ Verifies that a worker whose result was not stored, because
+        another worker finished the build first, does not report it """
+        with patch.object(WorkerThread, '_save_result') as save:
+            save.return_value = False
+            build = Build()
+            build['_id'] = 1
+
+            with patch.object(WorkerThread, '_retrieve_build') as mock1:
+                mock1.return_value = build
+
+                with patch.object(WorkerThread, '_bash_build') as mock2:
+                    mock2.return_value = "There was an error building your build"
+
+                    with patch.object(WorkerThread, '_post_to_github') as mock3:
+                        with patch.object(ResultCache, 'store') as store:
+                            self.thread = WorkerThread(self.queue)
+                            self.queue.add_build(build)
+
+                            self.thread.start()
+                            self.thread.join()
+
+                            save.assert_called_once_with(build)
+                            self.assertFalse(mock3.called)
+                            self.assertFalse(store.called)
+
+    def test_events_are_published(self):
+        """ Verifies that watchers of a build are told when it is started,
+        moves to another stage and is finished """
+        with patch.object(WorkerThread, '_save_result') as save:
+            build = Build()
+            build['_id'] = 1
+            subscription = events.subscribe(Subscription('1'))
+
+            with patch.object(WorkerThread, '_retrieve_build') as mock1:
+                mock1.return_value = build
+
+                with patch.object(WorkerThread, '_bash_build') as mock2:
+                    mock2.return_value = True
+                    self.thread = WorkerThread(self.queue)
+                    self.queue.add_build(build)
+
+                    self.thread.start()
+                    self.thread.join()
+
+            events.unsubscribe(subscription)
+            self.assertEqual([(event['type'], event.get('stage', None), event.get('status', None))
+                              for event in subscription.get(0)],
+                             [('started', None, 0), ('stage', 'save', None), ('finished', None, 1)])
+
+    def test_finished_is_published_for_every_build(self):
+        """ Verifies that watchers of a build that was not found, could not be
+        built or was finished elsewhere are told it is over """
+        subscription = events.subscribe(Subscription(None))
+        build = Build()
+        build['_id'] = 2
+        with patch.object(WorkerThread, '_prefetch') as prefetch:
+            prefetch.return_value = [(1, None), (2, build), (3, Build(dict(_id=3)))]
+            with patch.object(WorkerThread, '_bash_build') as bash:
+                bash.side_effect = [Exception("disk full"), True]
+                with patch.object(WorkerThread, '_save_result') as save:
+                    save.return_value = False
+                    self.thread = WorkerThread(self.queue, dict(WORKER_PREFETCH=3),
+                                               persistent=True)
+                    for i in (1, 2, 3):
+                        self.queue.add_build(i)
+                    self.thread.start()
+                    self.queue.join()
+                    self.thread.stop()
+                    self.thread.join()
+
+        events.unsubscribe(subscription)
+        finished = [(event['id'], event['status']) for event in subscription.get(0)
+                    if event['type'] == 'finished']
+        self.assertEqual(finished, [('1', None), ('2', None), ('3', None)])
@@ -0,0 +1,207 @@
+"""
+Test cases for the WorkspaceCache class. The repositories are local git
+repositories, fetched over file://.
+
+BLACKBOX TESTING:
+
+    def test_checkout_is_at_commit(self):
+    def test_new_commits_are_fetched_into_mirror(self):
+    def test_worktree_is_removed_after_build(self):
+    def test_concurrent_checkouts_share_mirror(self):
+    def test_finished_build_does_not_wait_for_others(self):
+    def test_new_commit_does_not_wait_for_others(self):
+    def test_hung_fetch_times_out(self):
+    def test_least_recently_used_mirror_is_evicted(self):
+    def test_mirror_in_use_is_not_evicted(self):
+    def test_unknown_commit_raises(self):
+
+WHITEBOX TESTING:
+
+    def test_disabled_cache_checks_nothing_out(self):
+"""
+
+import unittest
+import threading
+import subprocess
+import tempfile
+import shutil
+import time
+import os
+from rosie.models import (
+    WorkspaceCache,
+    WorkspaceException
+)
+
+def git(directory, *args):
+    return subprocess.check_output(['git', '-C', directory, '-c', 'user.name=rosie',
+                                    '-c', 'user.email=rosie@example.com'] + list(args)).strip()
+
+class WorkspaceCacheTest(unittest.TestCase):
+    """Test cases for WorkspaceCache"""
+
+    def setUp(self):
+        """ Create a workspace root and a repository to build """
+        self.directory = tempfile.mkdtemp()
+        self.configs = dict(WORKSPACE_ROOT=os.path.join(self.directory, 'workspaces'))
+        self.workspaces = WorkspaceCache(self.configs)
+        self.repository, self.url = self.create_repository('rosie')
+
+    def tearDown(self):
+        """ Remove everything that was created """
+        shutil.rmtree(self.directory)
+
+    def create_repository(self, name):
+        path = os.path.join(self.directory, name)
+        os.makedirs(path)
+        git(path, 'init', '--quiet', '--initial-branch=master')
+        self.commit(path, 'README', name)
+        return path, 'file://' + path
+
+    def mirrors(self):
+        return [os.path.join(self.workspaces.mirrors, name)
+                for name in os.listdir(self.workspaces.mirrors) if name.endswith('.git')]
+
+    def commit(self, path, filename, contents):
+        with open(os.path.join(path, filename), 'w') as f:
+            f.write(contents)
+        git(path, 'add', filename)
+        git(path, 'commit', '--quiet', '-m', filename)
+        return git(path, 'rev-parse', 'HEAD')
+
+    def test_checkout_is_at_commit(self):
+        first = git(self.repository, 'rev-parse', 'HEAD')
+        self.commit(self.repository, 'README', 'second')
+
+        with self.workspaces.checkout(self.url, first, 'build') as directory:
+            self.assertEqual(git(directory, 'rev-parse', 'HEAD'), first)
+            with open(os.path.join(directory, 'README')) as f:
+                self.assertEqual(f.read(), 'rosie')
+
+    def test_new_commits_are_fetched_into_mirror(self):
+        with self.workspaces.checkout(self.url, 'refs/heads/master', 'build'):
+            pass
+        second = self.commit(self.repository, 'setup.py', 'print "rosie"')
+
+        with self.workspaces.checkout(self.url, second, 'build') as directory:
+            self.assertTrue(os.path.exists(os.path.join(directory, 'setup.py')))
+        self.assertEqual(self.mirrors(), [self.workspaces.mirror_path(self.url)])
+
+    def test_worktree_is_removed_after_build(self):
+        with self.workspaces.checkout(self.url, 'HEAD', 'build') as directory:
+            self.assertTrue(os.path.isdir(directory))
+
+        self.assertFalse(os.path.exists(directory))
+        self.assertEqual(os.listdir(self.workspaces.worktrees), [])
+
+    def test_concurrent_checkouts_share_mirror(self):
+        commits = [self.commit(self.repository, 'file%d' % i, str(i)) for i in range(4)]
+        heads = []
+        def build(commit):
+            with self.workspaces.checkout(self.url, commit, 'build') as directory:
+                heads.append(git(directory, 'rev-parse', 'HEAD'))
+        workers = [threading.Thread(target=build, args=(commit,)) for commit in commits]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(30)
+
+        self.assertEqual(sorted(heads), sorted(commits))
+        self.assertEqual(len(self.mirrors()), 1)
+
+    def test_finished_build_does_not_wait_for_others(self):
+        running, done = threading.Event(), threading.Event()
+        def build():
+            with self.workspaces.checkout(self.url, 'HEAD', 'long'):
+                running.set()
+                done.wait(30)
+        worker = threading.Thread(target=build)
+        worker.start()
+        running.wait(30)
+
+        finished = threading.Event()
+        def short_build():
+            with self.workspaces.checkout(self.url, 'HEAD', 'short'):
+                pass
+            finished.set()
+        threading.Thread(target=short_build).start()
+        try:
+            self.assertTrue(finished.wait(30))
+            self.assertEqual(len(os.listdir(self.workspaces.worktrees)), 1)
+        finally:
+            done.set()
+            worker.join(30)
+
+    def test_new_commit_does_not_wait_for_others(self):
+        running, done = threading.Event(), threading.Event()
+        def build():
+            with self.workspaces.checkout(self.url, 'HEAD', 'long'):
+                running.set()
+                done.wait(30)
+        worker = threading.Thread(target=build)
+        worker.start()
+        running.wait(30)
+        second = self.commit(self.repository, 'setup.py', 'print "rosie"')
+
+        heads = []
+        def new_build():
+            with self.workspaces.checkout(self.url, second, 'new') as directory:
+                heads.append(git(directory, 'rev-parse', 'HEAD'))
+        new_worker = threading.Thread(target=new_build)
+        new_worker.start()
+        try:
+            new_worker.join(30)
+            self.assertFalse(new_worker.is_alive())
+            self.assertEqual(heads, [second])
+        finally:
+            done.set()
+            worker.join(30)
+            new_worker.join(30)
+
+    def test_hung_fetch_times_out(self):
+        # a 'git' that hangs stands in for a fetch from a server that never
+        # answers
+        bin = os.path.join(self.directory, 'bin')
+        os.makedirs(bin)
+        with open(os.path.join(bin, 'git'), 'w') as f:
+            f.write('#!/bin/sh\nsleep 30\n')
+        os.chmod(os.path.join(bin, 'git'), 0755)
+        self.workspaces.fetch_timeout = 0.5
+        path = os.environ['PATH']
+        os.environ['PATH'] = bin + os.pathsep + path
+        started = time.time()
+        try:
+            with self.assertRaises(WorkspaceException):
+                with self.workspaces.checkout(self.url, 'HEAD', 'build'):
+                    pass
+        finally:
+            os.environ['PATH'] = path
+        self.assertTrue(time.time() - started < 10)
+
+    def test_least_recently_used_mirror_is_evicted(self):
+        other, other_url = self.create_repository('other')
+        with self.workspaces.checkout(self.url, 'HEAD', 'build'):
+            pass
+        time.sleep(0.01)
+        with self.workspaces.checkout(other_url, 'HEAD', 'build'):
+            pass
+
+        self.workspaces.budget = 1
+        self.assertEqual(self.workspaces.evict()[0], self.workspaces.mirror_path(self.url))
+
+    def test_mirror_in_use_is_not_evicted(self):
+        self.workspaces.budget = 1
+        with self.workspaces.checkout(self.url, 'HEAD', 'build') as directory:
+            self.assertEqual(self.workspaces.evict(), [])
+            self.assertTrue(os.path.exists(os.path.join(directory, 'README')))
+
+        self.assertFalse(os.path.exists(self.workspaces.mirror_path(self.url)))
+
+    def test_unknown_commit_raises(self):
+        with self.assertRaises(WorkspaceException):
+            with self.workspaces.checkout(self.url, 'f' * 40, 'build'):
+                pass
+        self.assertEqual(os.listdir(self.workspaces.worktrees), [])
+
+    def test_disabled_cache_checks_nothing_out(self):
+        with WorkspaceCache().checkout(self.url, 'HEAD', 'build') as directory:
+            self.assertEqual(directory, None)